@@ -0,0 +1,319 @@
+"""
+This module provides a persistent inverted index from users and groups to the spaces and pages they are named on.
+The permissions and restrictions report answers "who is named on this page"; this index answers
+the reverse question, "which spaces and pages name user or group X, and for which operations",
+without reading the full report again.
+
+The index is a SQLite file. Account IDs, group IDs, spaces, pages and operations are interned
+into small integer IDs, and the access rows are stored as (principal, space or page, operation)
+integer triples in tables clustered by principal (WITHOUT ROWID), so all rows of one principal
+are one contiguous, sorted range that a query reads with a single index seek.
+
+The index lists the space permissions and the page restrictions that name a principal. It does
+not resolve group membership: a user who can see a page through one of their groups is listed
+under that group. Space permission operations are stored as `key:targetType` (for example
+`read:space` or `create:page`), page restriction operations as `read` or `update`.
+
+Spaces are identified by their space ID. The space key is stored as well when the export builds
+the index (`--access-index`); the reports carry no space keys, so an index built from a report with
+`access_index.py build` lists the space IDs and names only. The report is read one space at a time.
+
+The index is built into a temporary file and moved into place when the build is complete, so
+queries always see a full index.
+
+Classes:
+- AccessIndexBuilder: Builds the index from exported space records.
+- AccessIndex: Queries the index.
+
+Functions:
+- default_access_index_path(output_file): Returns the index file used for an export.
+- build_from_report(report_path, index_path): Builds the index from an existing report.
+
+Usage:
+    python access_index.py build
+    python access_index.py query 5b10ac8d82e05b22cc7d4ef5
+    python access_index.py query "Confluence Administrators" --operation update --json
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import time
+
+from flat_export import page_restriction_rows, space_permission_rows
+from json_stream import iter_records
+from principals import load_principals, resolve_space
+
+REPORT_FILE = "File Examples/confluence_permissions_and_restrictions_data.json"
+BATCH_SIZE = 5000
+
+SCHEMA = """
+    CREATE TABLE principals (id INTEGER PRIMARY KEY, type TEXT, principal_id TEXT, name TEXT);
+    CREATE TABLE spaces (id INTEGER PRIMARY KEY, space_key TEXT, space_id TEXT, space_name TEXT);
+    CREATE TABLE pages (id INTEGER PRIMARY KEY, page_id TEXT, page_name TEXT, space INTEGER);
+    CREATE TABLE operations (id INTEGER PRIMARY KEY, name TEXT);
+    CREATE TABLE space_access (
+        principal INTEGER, space INTEGER, operation INTEGER,
+        PRIMARY KEY (principal, space, operation)
+    ) WITHOUT ROWID;
+    CREATE TABLE page_access (
+        principal INTEGER, page INTEGER, operation INTEGER,
+        PRIMARY KEY (principal, page, operation)
+    ) WITHOUT ROWID;
+"""
+
+# Columns filled when a value is interned
+COLUMNS = {
+    'principals': ('id', 'type', 'principal_id'),
+    'spaces': ('id', 'space_key', 'space_id', 'space_name'),
+    'pages': ('id', 'page_id', 'page_name', 'space'),
+    'operations': ('id', 'name'),
+}
+
+# Lookup indexes, created once the tables are filled
+INDEXES = """
+    CREATE UNIQUE INDEX principals_id ON principals (principal_id, type);
+    CREATE INDEX principals_name ON principals (name COLLATE NOCASE);
+    CREATE UNIQUE INDEX pages_page_id ON pages (page_id);
+"""
+
+
+# Function to get the access index file used for an export
+def default_access_index_path(output_file):
+    return os.path.splitext(output_file)[0] + '.access.sqlite'
+
+
+# Builds the access index from exported space records
+class AccessIndexBuilder:
+    def __init__(self, path, batch_size=BATCH_SIZE):
+        self.path = path
+        self.batch_size = batch_size
+        self._build_path = path + '.build'
+        if os.path.exists(self._build_path):
+            os.remove(self._build_path)
+        self._conn = sqlite3.connect(self._build_path)
+        # The build file is thrown away if the build fails, so it needs no journal
+        self._conn.execute('PRAGMA journal_mode=OFF')
+        self._conn.execute('PRAGMA synchronous=OFF')
+        self._conn.executescript(SCHEMA)
+        # Interned values: natural key -> integer ID
+        self._principals = {}
+        self._spaces = {}
+        self._pages = {}
+        self._operations = {}
+        self._new = {'principals': [], 'spaces': [], 'pages': [], 'operations': []}
+        self._space_access = set()
+        self._page_access = set()
+        # Display and group names are only in page restrictions, so they are set once at the end
+        self._names = {}
+        self.counts = {'space_access': 0, 'page_access': 0}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+        return False
+
+    # Function to get the ID of an interned value, adding it on first use
+    def _intern(self, table, interned, key, *values):
+        value_id = interned.get(key)
+        if value_id is None:
+            value_id = len(interned) + 1
+            interned[key] = value_id
+            self._new[table].append((value_id, *values))
+        return value_id
+
+    # Function to add the access rows of one exported space record; space_key is None if it is not known
+    def add_space(self, space_key, space_data):
+        space_id = None if space_data.get("space_id") is None else str(space_data["space_id"])
+        space = self._intern('spaces', self._spaces, space_id or space_key, space_key, space_id,
+                             space_data.get("space_name"))
+        for _, _, principal_type, principal_id, operation, target_type in space_permission_rows(
+                space_key, space_data.get("space_id"), space_data.get("space_permissions")):
+            if principal_id is None:
+                continue
+            principal = self._intern('principals', self._principals, (principal_type, principal_id),
+                                     principal_type, principal_id)
+            operation_id = self._intern('operations', self._operations, f"{operation}:{target_type}", f"{operation}:{target_type}")
+            self._space_access.add((principal, space, operation_id))
+        for page_data in space_data.get("space_pages") or []:
+            page = self._intern('pages', self._pages, page_data["page_id"],
+                                page_data["page_id"], page_data.get("page_name"), space)
+            for _, _, _, operation, subject_type, subject_id, subject_name in page_restriction_rows(
+                    space_key, page_data["page_id"], page_data.get("page_name"), page_data.get("page_restrictions")):
+                if subject_id is None:
+                    continue
+                principal = self._intern('principals', self._principals, (subject_type, subject_id),
+                                         subject_type, subject_id)
+                if subject_name:
+                    self._names[principal] = subject_name
+                operation_id = self._intern('operations', self._operations, operation, operation)
+                self._page_access.add((principal, page, operation_id))
+        if len(self._space_access) + len(self._page_access) >= self.batch_size:
+            self._flush()
+
+    # Function to write the buffered values and access rows
+    def _flush(self):
+        for table, rows in self._new.items():
+            if rows:
+                columns = ', '.join(COLUMNS[table])
+                placeholders = ', '.join('?' for _ in COLUMNS[table])
+                self._conn.executemany(f"INSERT INTO {table} ({columns}) VALUES ({placeholders})", rows)
+                rows.clear()
+        for table, rows in (('space_access', self._space_access), ('page_access', self._page_access)):
+            if rows:
+                cursor = self._conn.executemany(f"INSERT OR IGNORE INTO {table} VALUES (?, ?, ?)", sorted(rows))
+                self.counts[table] += cursor.rowcount
+                rows.clear()
+        self._conn.commit()
+
+    def print_summary(self):
+        print(f"Access index: {len(self._principals)} users and groups, {self.counts['space_access']} space "
+              f"and {self.counts['page_access']} page entries written to '{self.path}'")
+
+    # Function to finish the build and move the index into place
+    def close(self):
+        if self._conn is None:
+            return
+        self._flush()
+        self._conn.executemany('UPDATE principals SET name = ? WHERE id = ?',
+                               [(name, principal) for principal, name in self._names.items()])
+        self._conn.executescript(INDEXES)
+        self._conn.commit()
+        self._conn.close()
+        self._conn = None
+        os.replace(self._build_path, self.path)
+
+    # Function to abandon an unfinished build, keeping the previous index
+    def discard(self):
+        if self._conn is None:
+            return
+        self._conn.close()
+        self._conn = None
+        os.remove(self._build_path)
+
+
+# Function to build the access index from an existing permissions and restrictions report
+def build_from_report(report_path, index_path):
+    # Reports written with --intern-principals reference users and groups in their principal table
+    principals = load_principals(report_path)
+    with AccessIndexBuilder(index_path) as builder:
+        for space_data in iter_records(report_path):
+            if principals is not None:
+                space_data = resolve_space(space_data, principals)
+            # The report records carry no space key, the space ID identifies the space
+            builder.add_space(space_data.get("space_key"), space_data)
+    return builder
+
+
+# Queries the access index
+class AccessIndex:
+    def __init__(self, path):
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"Access index '{path}' not found, build it first")
+        self.path = path
+        self._conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    # Function to find principals by account ID, group ID or (case-insensitive) display or group name
+    def find_principals(self, value):
+        rows = self._conn.execute(
+            'SELECT id, type, principal_id, name FROM principals WHERE principal_id = ?', (value,)
+        ).fetchall()
+        if not rows:
+            rows = self._conn.execute(
+                'SELECT id, type, principal_id, name FROM principals WHERE name = ? COLLATE NOCASE', (value,)
+            ).fetchall()
+        return rows
+
+    # Function to get the spaces and pages a principal is named on, with their operations
+    def access(self, principal, operation=None):
+        operation_filter = ' AND o.name = ?' if operation else ''
+        params = (principal, operation) if operation else (principal,)
+        spaces = self._conn.execute(f"""
+            SELECT s.space_id, s.space_key, s.space_name, group_concat(o.name, ',')
+            FROM space_access a JOIN spaces s ON s.id = a.space JOIN operations o ON o.id = a.operation
+            WHERE a.principal = ?{operation_filter}
+            GROUP BY a.space ORDER BY a.space
+        """, params).fetchall()
+        pages = self._conn.execute(f"""
+            SELECT s.space_id, s.space_key, p.page_id, p.page_name, group_concat(o.name, ',')
+            FROM page_access a JOIN pages p ON p.id = a.page JOIN spaces s ON s.id = p.space
+            JOIN operations o ON o.id = a.operation
+            WHERE a.principal = ?{operation_filter}
+            GROUP BY a.page ORDER BY p.space, p.page_id
+        """, params).fetchall()
+        return {
+            "spaces": [{"space_id": space_id, "space_key": key, "space_name": name, "operations": sorted(ops.split(','))}
+                       for space_id, key, name, ops in spaces],
+            "pages": [{"space_id": space_id, "space_key": key, "page_id": page_id, "page_name": name,
+                       "operations": sorted(ops.split(','))}
+                      for space_id, key, page_id, name, ops in pages],
+        }
+
+    def close(self):
+        self._conn.close()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Build and query the inverted index of users and groups to spaces and pages.")
+    parser.add_argument('--index', default=default_access_index_path(REPORT_FILE),
+                        help="Access index file (default: next to the permissions and restrictions report)")
+    commands = parser.add_subparsers(dest='command', required=True)
+    build = commands.add_parser('build', help="Build the index from an existing permissions and restrictions report")
+    build.add_argument('--report', default=REPORT_FILE, help=f"Report to index, .json or .jsonl (default: {REPORT_FILE})")
+    query = commands.add_parser('query', help="List the spaces and pages that name a user or group")
+    query.add_argument('principal', help="Account ID, group ID, display name or group name")
+    query.add_argument('--operation', help="Only list this operation (e.g. read, update, read:space)")
+    query.add_argument('--json', action='store_true', help="Print the result as JSON")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.command == 'build':
+        build_from_report(args.report, args.index).print_summary()
+        return 0
+
+    if not os.path.exists(args.index):
+        print(f"Error: access index '{args.index}' not found, run the export with --access-index or 'access_index.py build' first")
+        return 1
+    start = time.perf_counter()
+    with AccessIndex(args.index) as index:
+        results = [
+            dict(type=principal_type, principal_id=principal_id, name=name, **index.access(principal, args.operation))
+            for principal, principal_type, principal_id, name in index.find_principals(args.principal)
+        ]
+    elapsed = time.perf_counter() - start
+
+    if args.json:
+        print(json.dumps(results, indent=4))
+    elif not results:
+        print(f"No user or group '{args.principal}' in '{args.index}'")
+    for result in [] if args.json else results:
+        print(f"{result['principal_id']} ({result['type']}{', ' + result['name'] if result['name'] else ''})")
+        print(f"  Spaces ({len(result['spaces'])}):")
+        for space in result['spaces']:
+            print(f"    {space['space_id']}  {space['space_key'] or '-'}  {space['space_name']}  {', '.join(space['operations'])}")
+        print(f"  Pages ({len(result['pages'])}):")
+        for page in result['pages']:
+            print(f"    {page['space_id']}  {page['space_key'] or '-'}  {page['page_id']}  {page['page_name']}  {', '.join(page['operations'])}")
+    if not args.json:
+        print(f"({elapsed * 1000:.1f} ms)")
+    return 0 if results else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
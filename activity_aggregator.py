@@ -0,0 +1,122 @@
+"""
+This module provides the single-pass activity aggregation used by confluence_user_usage.py.
+Every managed account is looked at exactly once: its `last_active` timestamp is parsed once
+(and identical dates share one parse), its email domain is interned to a small integer, and it
+is counted into every configured activity window in the same step.
+
+No per-account data is kept: only counts, interned domains and parsed dates, so memory does not
+grow with the number of accounts. The user lists of the windows are produced by a second pass over
+the accounts (`iter_window_users()`), which confluence_user_usage.py reads back from its spool file.
+
+Classes:
+- ActivityAggregator: Counts active users, Confluence users per domain and users per activity window.
+
+Functions:
+- window_cutoff_day(now, days): Returns the first epoch day that counts as active within a window.
+
+Usage:
+    aggregator = ActivityAggregator(windows=(90, 60, 30))
+    for account in accounts:
+        aggregator.add(account)
+    aggregator.window_domain_counts(30)
+    users = aggregator.iter_window_users(accounts, 30)
+"""
+
+from datetime import datetime, timedelta
+
+NEVER_ACTIVE = -1
+
+
+# Function to get the first day (as a date ordinal) that counts as active within a window
+def window_cutoff_day(now, days):
+    cutoff = now - timedelta(days=days)
+    # A last_active date counts from midnight, so it is inside the window when midnight >= cutoff
+    if cutoff.time() == datetime.min.time():
+        return cutoff.toordinal()
+    return cutoff.toordinal() + 1
+
+
+# Counts active users, Confluence users per domain and users per activity window in one pass
+class ActivityAggregator:
+    def __init__(self, windows=(90, 60, 30), now=None):
+        self.now = now or datetime.now()
+        self.windows = tuple(windows)
+        self._cutoffs = [window_cutoff_day(self.now, days) for days in self.windows]
+
+        # Interned domains and parsed dates
+        self.domains = []
+        self._domain_ids = {}
+        self._parsed_days = {}
+
+        self.active_users = 0
+        self.never_active = 0
+        self._confluence_domain_counts = {}
+        self._window_domain_counts = [{} for _ in self.windows]
+        self._window_user_counts = [0 for _ in self.windows]
+
+    # Function to intern an email domain
+    def _domain_id(self, email):
+        domain = email.split('@')[-1]
+        domain_id = self._domain_ids.get(domain)
+        if domain_id is None:
+            domain_id = len(self.domains)
+            self._domain_ids[domain] = domain_id
+            self.domains.append(domain)
+        return domain_id
+
+    # Function to convert a last_active timestamp to a date ordinal, parsing each date once
+    def _day(self, last_active):
+        if not last_active:
+            return NEVER_ACTIVE
+        date_part = last_active.split('T')[0]
+        day = self._parsed_days.get(date_part)
+        if day is None:
+            day = datetime.strptime(date_part, '%Y-%m-%d').toordinal()
+            self._parsed_days[date_part] = day
+        return day
+
+    def add(self, account):
+        if account.get('account_status') != 'active':
+            return
+        self.active_users += 1
+
+        domain_id = self._domain_id(account.get('email', ''))
+        day = self._day(account.get('last_active'))
+
+        for access in account.get('product_access') or []:
+            if access.get('name') == 'Confluence':
+                counts = self._confluence_domain_counts
+                counts[domain_id] = counts.get(domain_id, 0) + 1
+                break
+
+        if day == NEVER_ACTIVE:
+            self.never_active += 1
+            return
+        for position, cutoff in enumerate(self._cutoffs):
+            if day >= cutoff:
+                counts = self._window_domain_counts[position]
+                counts[domain_id] = counts.get(domain_id, 0) + 1
+                self._window_user_counts[position] += 1
+
+    # Function to convert counts keyed by domain ID into counts keyed by domain name
+    def _named_counts(self, counts):
+        return {self.domains[domain_id]: count for domain_id, count in counts.items()}
+
+    def confluence_domain_counts(self):
+        return self._named_counts(self._confluence_domain_counts)
+
+    def window_domain_counts(self, days):
+        return self._named_counts(self._window_domain_counts[self.windows.index(days)])
+
+    def window_user_count(self, days):
+        return self._window_user_counts[self.windows.index(days)]
+
+    # Function to yield the name and email of the active accounts within a window, in account order
+    def iter_window_users(self, accounts, days):
+        cutoff = self._cutoffs[self.windows.index(days)]
+        for account in accounts:
+            if account.get('account_status') != 'active':
+                continue
+            day = self._day(account.get('last_active'))
+            if day != NEVER_ACTIVE and day >= cutoff:
+                yield {'name': account.get('name'), 'email': account.get('email')}
@@ -0,0 +1,171 @@
+"""
+This script benchmarks the Confluence scripts offline against the local mock server (see mock_confluence.py).
+It starts the mock with a synthetic tenant, runs each selected script's main() in its own
+subprocess against it, and reports per script:
+- wall time,
+- number of requests served by the mock (and how many were answered with 429),
+- throughput in requests per second,
+- peak resident memory (RSS) of the script's process.
+
+Every script runs in a fresh temporary working directory with its own "File Examples" folder, with
+the response cache disabled (unless `--cache` is given), so runs do not influence each other.
+
+To use this script:
+1. Ensure you have the `requests` library installed (`pip install requests`).
+2. Run the benchmark, for example:
+   python benchmark.py
+   python benchmark.py --scripts restrictions,crawl --spaces 50 --pages 400 --latency 0.05 --throttle-rate 0.01
+   python benchmark.py --json benchmark_results.json
+
+Dependencies:
+- requests: To read the mock server statistics.
+
+Functions:
+- run_script(name, base_url, workdir, cache): Runs one script against the mock and returns its measurements.
+- peak_rss_mb(rusage): Converts the maximum RSS of a finished process into megabytes.
+
+Usage:
+1. No Confluence credentials are needed; the scripts are pointed at the mock server.
+2. Execute the script and compare the results between code changes.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import requests
+
+from mock_confluence import add_tenant_arguments, start_server, tenant_from_args
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Script name: (file, command line arguments)
+SCRIPTS = {
+    'spaces': ('get_confluence_spaces.py', []),
+    'restrictions': ('space_permissions_and_page_restrictions.py', []),
+    'watchers': ('spaces_and_pages_watchers.py', []),
+    'crawl': ('confluence_crawl.py', []),
+    'usage': ('confluence_user_usage.py', []),
+    'remove-dry-run': ('remove_page_restrictions.py', ['--dry-run', '--space', 'SP0', '--space', 'SP1']),
+}
+
+# Runs the script as __main__, so it goes through its own main() and argument parsing
+CHILD_CODE = "import runpy, sys; sys.argv = sys.argv[1:]; runpy.run_path(sys.argv[0], run_name='__main__')"
+
+
+# Function to convert the maximum RSS of a finished process into megabytes
+def peak_rss_mb(rusage):
+    if rusage is None:
+        return None
+    # ru_maxrss is in bytes on macOS and in kilobytes on Linux
+    divisor = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    return round(rusage.ru_maxrss / divisor, 1)
+
+
+# Function to get the request statistics of the mock server
+def mock_stats(base_url):
+    return requests.get(f'{base_url}/_mock/stats', timeout=10).json()
+
+
+# Function to run one script against the mock server and return its measurements
+def run_script(name, base_url, workdir, cache=False):
+    script, script_args = SCRIPTS[name]
+    os.makedirs(os.path.join(workdir, "File Examples"), exist_ok=True)
+    env = dict(os.environ,
+               CONFLUENCE_BASE_URL=base_url,
+               CONFLUENCE_GRAPHQL_URL=f'{base_url}/cgraphql',
+               ATLASSIAN_ADMIN_URL=base_url,
+               ATLASSIAN_ORG_ID='benchmark-org',
+               USERNAME='benchmark@example.com',
+               USER_API_TOKEN='benchmark-token',
+               API_TOKEN='benchmark-org-token',
+               CONFLUENCE_CACHE='1' if cache else '0',
+               CONFLUENCE_CACHE_PATH=os.path.join(workdir, '.confluence_cache.sqlite'),
+               PYTHONPATH=os.pathsep.join(filter(None, [REPO_DIR, os.environ.get('PYTHONPATH')])))
+    command = [sys.executable, '-c', CHILD_CODE, os.path.join(REPO_DIR, script), *script_args]
+
+    before = mock_stats(base_url)
+    log_path = os.path.join(workdir, f'{name}.log')
+    with open(log_path, 'w') as log:
+        start = time.perf_counter()
+        process = subprocess.Popen(command, cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT)
+        if hasattr(os, 'wait4'):
+            _, status, rusage = os.wait4(process.pid, 0)
+            process.returncode = os.waitstatus_to_exitcode(status)
+        else:
+            process.wait()
+            rusage = None
+        elapsed = time.perf_counter() - start
+    after = mock_stats(base_url)
+
+    requests_served = after['requests'] - before['requests']
+    result = {
+        "script": name,
+        "exit_code": process.returncode,
+        "wall_seconds": round(elapsed, 3),
+        "requests": requests_served,
+        "throttled": after['throttled'] - before['throttled'],
+        "requests_per_second": round(requests_served / elapsed, 2) if elapsed > 0 else None,
+        "peak_rss_mb": peak_rss_mb(rusage),
+    }
+    if process.returncode != 0:
+        with open(log_path) as log:
+            result["output_tail"] = log.read()[-2000:]
+    return result
+
+
+# Function to parse the scripts option
+def parse_scripts(value):
+    names = [name.strip() for name in value.split(',') if name.strip()]
+    unknown = [name for name in names if name not in SCRIPTS]
+    if unknown:
+        raise argparse.ArgumentTypeError(f"unknown script(s): {', '.join(unknown)} (choose from {', '.join(SCRIPTS)})")
+    return names
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the Confluence scripts against a local mock server.")
+    parser.add_argument('--scripts', type=parse_scripts, default=list(SCRIPTS),
+                        help=f"Comma-separated scripts to run (default: {','.join(SCRIPTS)})")
+    parser.add_argument('--cache', action='store_true', help="Keep the response cache enabled")
+    parser.add_argument('--json', help="Also write the results to this JSON file")
+    add_tenant_arguments(parser)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    server = start_server(tenant_from_args(args))
+    base_url = f'http://127.0.0.1:{server.server_address[1]}'
+    print(f"Mock tenant: {args.spaces} spaces x {args.pages} pages, {args.users} users, "
+          f"latency {args.latency * 1000:.0f} ms, throttle rate {args.throttle_rate}, page size {args.max_limit}")
+
+    results = []
+    try:
+        for name in args.scripts:
+            with tempfile.TemporaryDirectory(prefix=f'benchmark-{name}-') as workdir:
+                result = run_script(name, base_url, workdir, cache=args.cache)
+            results.append(result)
+            print(f"{name:<16} {result['wall_seconds']:>9.2f} s {result['requests']:>8} requests "
+                  f"({result['throttled']} throttled) {result['requests_per_second'] or 0:>9.1f} req/s "
+                  f"{result['peak_rss_mb'] if result['peak_rss_mb'] is not None else '-':>8} MB peak RSS"
+                  + ("" if result['exit_code'] == 0 else f"  FAILED (exit code {result['exit_code']})"))
+            if result['exit_code'] != 0:
+                print(result['output_tail'])
+    finally:
+        server.shutdown()
+
+    if args.json:
+        with open(args.json, 'w') as json_file:
+            json.dump({"tenant": {key: value for key, value in vars(args).items() if key not in ('scripts', 'json')},
+                       "results": results}, json_file, indent=4)
+        print(f"Results saved to '{args.json}'")
+    return 0 if all(result['exit_code'] == 0 for result in results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
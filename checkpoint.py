@@ -0,0 +1,166 @@
+"""
+This module provides a durable checkpoint store for the long-running Confluence exports.
+Progress is recorded in a local SQLite file: the page listing of every space (with its
+pagination cursor), every finished page record and every finished space. A run started with
+`--resume` skips the work that is already recorded and continues in the middle of a space,
+so re-running after a token expiry or network failure costs minutes instead of hours.
+
+Finished records are kept in the checkpoint so a resumed run can still write the complete
+report in the usual order without fetching those spaces and pages again.
+
+Classes:
+- CheckpointStore: SQLite-backed record of completed spaces, pages and listing cursors.
+
+Functions:
+- default_checkpoint_path(output_file): Returns the checkpoint file used for an export.
+
+Usage:
+    checkpoint = CheckpointStore(default_checkpoint_path(OUTPUT_FILE), resume=args.resume)
+    if checkpoint.is_space_done(space_key):
+        space_data = checkpoint.load_space(space_key)
+"""
+
+import os
+import sqlite3
+import threading
+
+from json_codec import dumps, loads
+
+COMMIT_EVERY = 200
+
+
+# Function to get the checkpoint file used for an export
+def default_checkpoint_path(output_file):
+    return os.path.splitext(output_file)[0] + '.checkpoint.sqlite'
+
+
+# SQLite-backed record of completed spaces, pages and listing cursors
+class CheckpointStore:
+    def __init__(self, path, resume=False):
+        self.path = path
+        if not resume:
+            for suffix in ('', '-wal', '-shm'):
+                if os.path.exists(path + suffix):
+                    os.remove(path + suffix)
+        self._lock = threading.Lock()
+        self._uncommitted = 0
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS spaces (
+                space_key TEXT PRIMARY KEY,
+                cursor TEXT,
+                listing_done INTEGER NOT NULL DEFAULT 0,
+                record TEXT
+            );
+            CREATE TABLE IF NOT EXISTS pages (
+                space_key TEXT NOT NULL,
+                page_id TEXT NOT NULL,
+                position INTEGER NOT NULL,
+                stub TEXT,
+                record TEXT,
+                PRIMARY KEY (space_key, page_id)
+            );
+        """)
+        self._conn.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    # Function to run a write statement and commit every COMMIT_EVERY writes
+    def _write(self, sql, params=(), many=False):
+        with self._lock:
+            if many:
+                self._conn.executemany(sql, params)
+            else:
+                self._conn.execute(sql, params)
+            self._uncommitted += 1
+            if self._uncommitted >= COMMIT_EVERY:
+                self._conn.commit()
+                self._uncommitted = 0
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def commit(self):
+        with self._lock:
+            self._conn.commit()
+            self._uncommitted = 0
+
+    def close(self):
+        self.commit()
+        self._conn.close()
+
+    def is_space_done(self, space_key):
+        rows = self._query('SELECT record FROM spaces WHERE space_key = ?', (space_key,))
+        return bool(rows) and rows[0][0] is not None
+
+    # Function to get the pages listed so far for a space and whether the listing finished
+    def listed_pages(self, space_key):
+        rows = self._query('SELECT listing_done FROM spaces WHERE space_key = ?', (space_key,))
+        done = bool(rows) and bool(rows[0][0])
+        pages = self._query(
+            'SELECT stub FROM pages WHERE space_key = ? ORDER BY position', (space_key,)
+        )
+        return [loads(stub) for stub, in pages], done
+
+    def get_cursor(self, space_key):
+        rows = self._query('SELECT cursor FROM spaces WHERE space_key = ?', (space_key,))
+        return rows[0][0] if rows else None
+
+    # Function to record a batch of listed pages and the cursor of the next listing page
+    def save_listing(self, space_key, pages, cursor=None, done=False):
+        with self._lock:
+            position = self._conn.execute(
+                'SELECT COUNT(*) FROM pages WHERE space_key = ?', (space_key,)
+            ).fetchone()[0]
+        self._write(
+            'INSERT OR IGNORE INTO pages (space_key, page_id, position, stub) VALUES (?, ?, ?, ?)',
+            [(space_key, page['id'], position + i, dumps(page)) for i, page in enumerate(pages)],
+            many=True,
+        )
+        self._write(
+            'INSERT INTO spaces (space_key, cursor, listing_done) VALUES (?, ?, ?) '
+            'ON CONFLICT(space_key) DO UPDATE SET cursor = excluded.cursor, listing_done = excluded.listing_done',
+            (space_key, cursor, int(done)),
+        )
+
+    # Function to get the finished page records of a space, keyed by page ID
+    def completed_pages(self, space_key):
+        rows = self._query(
+            'SELECT page_id, record FROM pages WHERE space_key = ? AND record IS NOT NULL', (space_key,)
+        )
+        return {page_id: loads(record) for page_id, record in rows}
+
+    def save_page(self, space_key, page_id, record):
+        self._write(
+            'UPDATE pages SET record = ? WHERE space_key = ? AND page_id = ?',
+            (dumps(record), space_key, page_id),
+        )
+
+    # Function to mark a space finished; the record is stored without its page list
+    def mark_space_done(self, space_key, record):
+        record = {key: value for key, value in record.items() if key != 'space_pages'}
+        self._write(
+            'INSERT INTO spaces (space_key, listing_done, record) VALUES (?, 1, ?) '
+            'ON CONFLICT(space_key) DO UPDATE SET record = excluded.record',
+            (space_key, dumps(record)),
+        )
+        self.commit()
+
+    # Function to rebuild a finished space record together with its page records
+    def load_space(self, space_key):
+        rows = self._query('SELECT record FROM spaces WHERE space_key = ?', (space_key,))
+        record = loads(rows[0][0])
+        pages = self._query(
+            'SELECT record FROM pages WHERE space_key = ? AND record IS NOT NULL ORDER BY position',
+            (space_key,),
+        )
+        record["space_pages"] = [loads(page) for page, in pages]
+        return record
@@ -0,0 +1,102 @@
+"""
+This module provides the adaptive concurrency limit used by FetchPool (see fetch_pool.py).
+A fixed number of requests in flight is either too slow or triggers rate limiting, and the right
+number changes with the load on the tenant. AdaptiveLimit tunes it from what the API reports:
+- Every window of successful calls, the p95 latency of the window is compared with a baseline
+  (the lowest p95 seen, drifting slowly upwards so a tenant that stays slower is accepted).
+  While latency stays flat, the limit grows by one (additive increase).
+- When the p95 rises above `tolerance` times the baseline, requests are queueing on the server
+  and the limit is cut by a quarter.
+- When a call is throttled (429), the limit is halved (multiplicative decrease), at most once
+  per `cooldown` seconds so one burst of 429s does not collapse it to the minimum.
+
+The limit is used like a semaphore whose size changes while it is held.
+
+Classes:
+- AdaptiveLimit: AIMD concurrency limit driven by latency and throttling.
+
+Usage:
+    limit = AdaptiveLimit(initial=8, max_limit=64)
+    with limit:
+        response = client.get(url)
+    limit.on_sample(latency, throttled=response.status_code == 429)
+"""
+
+import math
+import threading
+import time
+
+WINDOW = 20
+TOLERANCE = 1.5
+LATENCY_DECREASE = 0.75
+THROTTLE_DECREASE = 0.5
+BASELINE_DRIFT = 0.05
+COOLDOWN = 1.0
+
+
+# AIMD concurrency limit driven by latency and throttling
+class AdaptiveLimit:
+    def __init__(self, initial=8, min_limit=1, max_limit=64, window=WINDOW, tolerance=TOLERANCE, cooldown=COOLDOWN):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.limit = float(min(max(initial, min_limit), max_limit))
+        self.window = window
+        self.tolerance = tolerance
+        self.cooldown = cooldown
+        self.baseline = None
+        self.in_flight = 0
+        self.decreases = 0
+        self._samples = []
+        self._hold_until = 0.0
+        self._condition = threading.Condition()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+        return False
+
+    # Function to block until fewer calls than the current limit are in flight
+    def acquire(self):
+        with self._condition:
+            while self.in_flight >= int(self.limit):
+                self._condition.wait()
+            self.in_flight += 1
+
+    def release(self):
+        with self._condition:
+            self.in_flight -= 1
+            self._condition.notify()
+
+    # Function to adjust the limit from one finished call
+    def on_sample(self, latency, throttled=False):
+        with self._condition:
+            if throttled:
+                now = time.monotonic()
+                if now >= self._hold_until:
+                    self._set_limit(self.limit * THROTTLE_DECREASE)
+                    self._hold_until = now + self.cooldown
+                    self._samples = []
+                return
+            self._samples.append(latency)
+            if len(self._samples) < max(self.window, int(self.limit)):
+                return
+            ordered = sorted(self._samples)
+            p95 = ordered[max(1, math.ceil(0.95 * len(ordered))) - 1]
+            self._samples = []
+            if self.baseline is not None and p95 > self.baseline * self.tolerance:
+                self._set_limit(self.limit * LATENCY_DECREASE)
+            else:
+                self._set_limit(self.limit + 1)
+            if self.baseline is None or p95 < self.baseline:
+                self.baseline = p95
+            else:
+                self.baseline += (p95 - self.baseline) * BASELINE_DRIFT
+
+    def _set_limit(self, limit):
+        if limit < self.limit:
+            self.decreases += 1
+        self.limit = float(min(max(limit, self.min_limit), self.max_limit))
+        self._condition.notify_all()
@@ -0,0 +1,308 @@
+"""
+This module provides the shared HTTP client used by all Confluence scripts.
+It keeps one pooled `requests.Session` per client so connections (and TLS sessions) are reused,
+and wraps every call with rate limiting and retries so large crawls run as fast as the tenant allows.
+
+The client:
+1. Reuses keep-alive connections through a tuned `HTTPAdapter` connection pool.
+2. Sends requests as fast as the callers ask for them until the tenant pushes back. On a 429
+   response (or any response with `Retry-After`), an adaptive token bucket starts pacing requests
+   at half the rate that was being sent, and raises the rate again by half every half second
+   while calls succeed.
+3. Honors the `Retry-After` header on 429 and 503 responses, pausing all callers of the client.
+4. Retries 5xx responses, connection resets and timeouts with jittered exponential backoff.
+5. Serves space and page listings from the shared on-disk response cache (see response_cache.py).
+6. Reports every finished call (status, latency, bytes, retries, throttling waits) to its observers,
+   which is how request metrics are collected (see instrumentation.py).
+
+Configuration (environment variables, all optional):
+- CONFLUENCE_POOL_SIZE: Maximum pooled connections per host (default: 32).
+- CONFLUENCE_MAX_RETRIES: Maximum retries per request (default: 6).
+- CONFLUENCE_INITIAL_RPS: Starting request rate in requests per second (default: unpaced until throttled).
+- CONFLUENCE_MAX_RPS: Upper bound for the adaptive request rate (default: none).
+- CONFLUENCE_CACHE, CONFLUENCE_CACHE_PATH, CONFLUENCE_CACHE_TTL, CONFLUENCE_CACHE_MAX_MB: See response_cache.py.
+- CONFLUENCE_METRICS, CONFLUENCE_METRICS_PROMETHEUS, CONFLUENCE_PROFILE: See instrumentation.py.
+
+Classes:
+- TokenBucket: Thread-safe adaptive token bucket.
+- ConfluenceClient: Pooled session with rate limiting, retries and response caching.
+
+Functions:
+- parse_retry_after(value): Converts a Retry-After header into a number of seconds.
+- backoff_delay(attempt): Returns a jittered exponential backoff delay.
+
+Usage:
+    client = ConfluenceClient(auth=HTTPBasicAuth(username, api_token))
+    response = client.get(url, params={'limit': 50})
+"""
+
+import os
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+
+from instrumentation import RequestEvent, default_instrumentation
+from response_cache import auth_identity, cache_key, default_cache
+
+POOL_SIZE = int(os.getenv('CONFLUENCE_POOL_SIZE', '32'))
+MAX_RETRIES = int(os.getenv('CONFLUENCE_MAX_RETRIES', '6'))
+# Unset (or 0) means no pacing until the first throttled call, and no upper bound
+INITIAL_RPS = float(os.getenv('CONFLUENCE_INITIAL_RPS', '0')) or None
+MAX_RPS = float(os.getenv('CONFLUENCE_MAX_RPS', '0')) or None
+MIN_RPS = 0.5
+# Factor the rate is raised by per RECOVERY_INTERVAL seconds without throttling
+RPS_RECOVERY = 1.5
+RECOVERY_INTERVAL = 0.5
+# Without a maximum rate, pacing stops once the rate is this many times the rate actually sent
+UNPACED_FACTOR = 4
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 60.0
+REQUEST_TIMEOUT = 60
+RETRY_STATUSES = {500, 502, 503, 504}
+CACHED_METHODS = {'GET', 'HEAD'}
+RETRY_EXCEPTIONS = (
+    requests.exceptions.ConnectionError,
+    requests.exceptions.Timeout,
+    requests.exceptions.ChunkedEncodingError,
+)
+
+
+# Function to convert a Retry-After header (seconds or HTTP date) into seconds
+def parse_retry_after(value):
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+# Function to get a jittered exponential backoff delay for a retry attempt
+def backoff_delay(attempt):
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * (2 ** attempt)))
+
+
+# Adaptive token bucket: unpaced (rate None) until throttled, then multiplicative decrease on
+# throttling and multiplicative increase while calls succeed
+class TokenBucket:
+    def __init__(self, rate=INITIAL_RPS, max_rate=MAX_RPS, min_rate=MIN_RPS):
+        self.rate = min(rate, max_rate) if rate and max_rate else rate or max_rate
+        self.max_rate = max_rate
+        self.min_rate = min_rate
+        self._tokens = max(1.0, self.rate or 1.0)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._changed = self._updated
+        self._throttled_at = float('-inf')
+        # Requests let through in the current and the last full second, to know the rate sent when throttled
+        self._window_start = self._updated
+        self._window_count = 0
+        self._sent_rate = 0.0
+        self._lock = threading.Lock()
+
+    # Function to get a bucket with 1/count of this bucket's rates, for one of count processes
+    def share(self, count):
+        scale = lambda value: value / count if value else value
+        return TokenBucket(rate=scale(self.rate), max_rate=scale(self.max_rate), min_rate=self.min_rate / count)
+
+    # Function to count a request that was let through
+    def _count(self, now):
+        if now - self._window_start >= 1.0:
+            self._sent_rate = self._window_count / (now - self._window_start)
+            self._window_start = now
+            self._window_count = 0
+        self._window_count += 1
+
+    # Function to block until a token is available
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    wait = self._paused_until - now
+                elif self.rate is None:
+                    self._count(now)
+                    return
+                else:
+                    burst = max(1.0, self.rate)
+                    self._tokens = min(burst, self._tokens + (now - self._updated) * self.rate)
+                    self._updated = now
+                    if self._tokens >= 1.0:
+                        self._tokens -= 1.0
+                        self._count(now)
+                        return
+                    wait = (1.0 - self._tokens) / self.rate
+            time.sleep(wait)
+
+    # Function to raise the rate by RPS_RECOVERY once per RECOVERY_INTERVAL while calls succeed
+    def on_success(self):
+        with self._lock:
+            now = time.monotonic()
+            if self.rate is None or now - self._changed < RECOVERY_INTERVAL:
+                return
+            self.rate = self.rate * RPS_RECOVERY
+            if self.max_rate:
+                self.rate = min(self.max_rate, self.rate)
+            elif self._sent_rate and self.rate > UNPACED_FACTOR * self._sent_rate:
+                # The callers send far less than the bucket allows, so the tenant no longer holds them back
+                self.rate = None
+            self._changed = now
+
+    # Function to halve the rate (the rate being sent, when unpaced) and pause all callers after a throttled call
+    def on_throttle(self, retry_after=None):
+        with self._lock:
+            now = time.monotonic()
+            # Calls sent before the last cut may still come back throttled, so halve at most once per RECOVERY_INTERVAL
+            if now - self._throttled_at >= RECOVERY_INTERVAL:
+                if self.rate is None:
+                    elapsed = now - self._window_start
+                    current = self._window_count / elapsed if elapsed > 0 else 0.0
+                    self.rate = max(self._sent_rate, current)
+                self.rate = max(self.min_rate, self.rate / 2)
+                self._throttled_at = now
+            self._tokens = 0.0
+            self._updated = now
+            self._changed = now
+            if retry_after:
+                self._paused_until = max(self._paused_until, now + retry_after)
+
+
+# Pooled session with adaptive rate limiting and retries
+class ConfluenceClient:
+    def __init__(self, auth=None, headers=None, pool_size=POOL_SIZE, max_retries=MAX_RETRIES, bucket=None, cache=None):
+        self.max_retries = max_retries
+        self.bucket = bucket or TokenBucket()
+        # Pass cache=False to bypass the shared response cache
+        self.cache = (cache if cache is not None else default_cache()) or None
+        # Callables receiving a RequestEvent for every finished API call (see instrumentation.py)
+        self.observers = []
+        instrumentation = default_instrumentation()
+        if instrumentation is not None:
+            self.observers.append(instrumentation.record)
+        self.session = requests.Session()
+        self.session.auth = auth
+        if headers:
+            self.session.headers.update(headers)
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    # Function to report a finished API call to the observers
+    def _notify(self, method, url, response, latency, retries=0, throttle_wait=0.0, cached=False, throttled=0):
+        if not self.observers:
+            return
+        event = RequestEvent(
+            method=method.upper(),
+            url=url,
+            status=response.status_code if response is not None else None,
+            latency=latency,
+            bytes=len(response.content) if response is not None else 0,
+            retries=retries,
+            throttle_wait=throttle_wait,
+            cached=cached,
+            throttled=throttled,
+        )
+        for observer in self.observers:
+            observer(event)
+
+    # Function to send a request, answering cacheable requests from the response cache when possible
+    def request(self, method, url, **kwargs):
+        ttl = self.cache.ttl_for(url) if self.cache and method.upper() in CACHED_METHODS else 0
+        if not ttl:
+            return self._send(method, url, **kwargs)
+
+        headers = CaseInsensitiveDict(self.session.headers)
+        headers.update(kwargs.get('headers') or {})
+        identity = auth_identity(kwargs.get('auth', self.session.auth), headers)
+        key = cache_key(method, url, kwargs.get('params'), kwargs.get('json', kwargs.get('data')), identity)
+        cached = self.cache.lookup(key)
+        if cached is not None:
+            cached_response, age = cached
+            if age < ttl:
+                self.cache.hits += 1
+                self._notify(method, url, cached_response, 0.0, cached=True)
+                return cached_response
+            # Revalidate a stale entry instead of downloading it again when the server allows it
+            validators = {}
+            if cached_response.headers.get('ETag'):
+                validators['If-None-Match'] = cached_response.headers['ETag']
+            if cached_response.headers.get('Last-Modified'):
+                validators['If-Modified-Since'] = cached_response.headers['Last-Modified']
+            if validators:
+                kwargs['headers'] = {**(kwargs.get('headers') or {}), **validators}
+
+        response = self._send(method, url, **kwargs)
+        if cached is not None and response.status_code == 304:
+            self.cache.revalidated += 1
+            self.cache.refresh(key)
+            return cached_response
+        self.cache.misses += 1
+        if response.status_code == 200:
+            self.cache.store(key, response)
+        return response
+
+    # Function to send a request, retrying throttled, failed and 5xx calls
+    def _send(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', REQUEST_TIMEOUT)
+        attempt = 0
+        latency = 0.0
+        throttle_wait = 0.0
+        throttled = 0
+        while True:
+            waited = time.perf_counter()
+            self.bucket.acquire()
+            throttle_wait += time.perf_counter() - waited
+            start = time.perf_counter()
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except RETRY_EXCEPTIONS:
+                latency += time.perf_counter() - start
+                if attempt >= self.max_retries:
+                    self._notify(method, url, None, latency, attempt, throttle_wait, throttled=throttled)
+                    raise
+                time.sleep(backoff_delay(attempt))
+                attempt += 1
+                continue
+            latency += time.perf_counter() - start
+
+            if response.status_code == 429 or response.status_code in RETRY_STATUSES:
+                if attempt >= self.max_retries:
+                    self._notify(method, url, response, latency, attempt, throttle_wait, throttled=throttled)
+                    return response
+                retry_after = parse_retry_after(response.headers.get('Retry-After'))
+                delay = retry_after if retry_after is not None else backoff_delay(attempt)
+                # The tenant asks to slow down with a 429, or with Retry-After on a 503
+                if response.status_code == 429 or retry_after is not None:
+                    throttled += response.status_code == 429
+                    self.bucket.on_throttle(retry_after)
+                    throttle_wait += delay
+                response.close()
+                time.sleep(delay)
+                attempt += 1
+                continue
+
+            self.bucket.on_success()
+            self._notify(method, url, response, latency, attempt, throttle_wait, throttled=throttled)
+            return response
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.request('DELETE', url, **kwargs)
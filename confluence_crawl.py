@@ -0,0 +1,422 @@
+"""
+This script crawls Confluence Cloud once and writes the space permissions and page restrictions
+report and the space and page watchers report from the same pass.
+Running space_permissions_and_page_restrictions.py and spaces_and_pages_watchers.py one after the
+other lists every space and every page twice; this script lists them once and runs all lookups
+on one shared worker pool.
+
+The lookups are organised as stages. Every stage enriches either spaces or pages with one field
+of one report:
+- permissions: `space_permissions` in the permissions and restrictions report.
+- restrictions: `page_restrictions` in the permissions and restrictions report.
+- space-watchers: `space_watchers` in the watchers report.
+- page-watchers: `page_watchers` in the watchers report.
+
+With `--flat-export`, both reports are also written as flat, indexed tables (see flat_export.py).
+`--indent` and `--fields` work as in the standalone scripts: compact JSON by default, and with
+`--fields minimal` only the principals, operations and watcher accounts are kept (see projection.py).
+With `--intern-principals`, each report gets its own principal table (see principals.py); a sharded
+crawl interns the principals when the shard outputs are merged.
+
+For very large tenants the crawl can be sharded across processes or machines (see sharding.py):
+- `--processes N` splits the spaces into N shards, crawls them in N processes that share the
+  request rate, and merges the partial outputs into the usual reports.
+- `--shard i/N` crawls only shard i of N and writes its partial output, e.g. on another machine;
+  `--merge N` then combines the partial outputs of all N shards into the reports.
+
+Stages are selected with `--stages` (default: all). A report is written when at least one of its
+stages runs, in the same format as the standalone script. Lookups are submitted in chunks: one
+space or page per task for REST lookups, many keys per task for the batched GraphQL watcher
+lookups. New stages are added by adding a `Stage` to `STAGES`.
+
+Personal spaces and the "Cloud Acceleration Service" space are skipped for permissions and
+restrictions, as in the standalone export. Spaces without a pages endpoint are left out of both reports.
+Checkpoints, resume and the incremental restrictions mode are only available in the standalone scripts.
+
+To use this script:
+1. Ensure you have the `requests` library installed (`pip install requests`).
+2. Run the script, for example:
+   python confluence_crawl.py
+   python confluence_crawl.py --stages restrictions,page-watchers --workers 16
+   python confluence_crawl.py --processes 4
+
+Dependencies:
+- requests: To handle HTTP requests.
+
+Classes:
+- Stage: One lookup that enriches spaces or pages with a field of a report.
+
+Functions:
+- get_all_spaces(): Retrieves all spaces in the Confluence instance.
+- submit_lookups(pool, stage, keys): Submits the lookups of a stage in chunks and returns a future per key.
+- lookup_result(futures, key): Returns the result of one key from the chunked lookups.
+- principal_tables(args, reports): Returns a new principal table per report if principals are interned.
+- open_report_writer(args, name, table): Opens the record writer of a report.
+- crawl(args): Crawls all spaces, or the spaces of one shard, and writes the reports.
+- run_shard(args, index, count): Crawls one shard in a worker process, with its share of the request rate.
+- run_sharded(args): Crawls all shards in parallel processes and merges their outputs.
+- merge_shard_outputs(args, count, remove): Merges the partial outputs of all shards into the reports.
+
+Usage:
+1. Update the .env file with your Confluence instance details.
+2. Execute the script to export both reports in one crawl.
+"""
+
+from requests.auth import HTTPBasicAuth
+import argparse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, wait
+from contextlib import ExitStack
+import multiprocessing
+from urllib.parse import urlparse
+from dotenv import load_dotenv
+import os
+from confluence_client import ConfluenceClient
+from fetch_pool import FetchPool
+from flat_export import FLAT_FORMATS, FlatExporter
+from instrumentation import default_instrumentation, profile_stage
+from json_stream import OUTPUT_FORMATS, JsonLinesWriter, open_record_writer, output_path
+from paginator import SPACE_LIMIT, iter_results
+from principals import PrincipalTable, reference_writer
+from projection import PROJECTIONS
+from sharding import merge_shards, missing_shards, parse_shard, shard_of, shard_path, shard_suffix
+import space_permissions_and_page_restrictions as restrictions_export
+import spaces_and_pages_watchers as watchers_export
+
+# Load the .env file
+load_dotenv()
+
+confluence_base_url = os.getenv('CONFLUENCE_BASE_URL')
+username = os.getenv('USERNAME')
+api_token = os.getenv('USER_API_TOKEN')
+
+client = ConfluenceClient(auth=HTTPBasicAuth(username, api_token))
+
+# All stages share this script's client, so they share one connection pool and one rate limit
+restrictions_export.client = client
+watchers_export.client = client
+
+# Number of keys per task for the batched GraphQL lookups
+WATCHERS_CHUNK = 200
+
+
+# One lookup that enriches spaces or pages with a field of a report
+class Stage:
+    def __init__(self, name, report, level, field, lookup, chunk_size=1, url=None):
+        self.name = name
+        self.report = report
+        self.level = level
+        self.field = field
+        # lookup(keys) returns (key, value) pairs for a list of space keys or page IDs
+        self.lookup = lookup
+        self.chunk_size = chunk_size
+        self.url = url
+
+    @property
+    def host(self):
+        return urlparse(self.url() if callable(self.url) else self.url).netloc
+
+
+# Report name: (output file, function deciding whether a space is enriched)
+REPORTS = {
+    'restrictions': (restrictions_export.OUTPUT_FILE, restrictions_export.is_space_included),
+    'watchers': (watchers_export.OUTPUT_FILE, lambda space: True),
+}
+
+STAGES = {stage.name: stage for stage in (
+    Stage('permissions', 'restrictions', 'space', 'space_permissions',
+          lambda keys: [(key, restrictions_export.get_space_permissions(key)) for key in keys],
+          url=confluence_base_url),
+    Stage('restrictions', 'restrictions', 'page', 'page_restrictions',
+          lambda keys: [(key, restrictions_export.get_page_restrictions(key)) for key in keys],
+          url=confluence_base_url),
+    Stage('space-watchers', 'watchers', 'space', 'space_watchers',
+          lambda keys: watchers_export.get_watchers('space', keys),
+          chunk_size=WATCHERS_CHUNK, url=lambda: watchers_export.GRAPHQL_URL),
+    Stage('page-watchers', 'watchers', 'page', 'page_watchers',
+          lambda keys: watchers_export.get_watchers('page', keys),
+          chunk_size=WATCHERS_CHUNK, url=lambda: watchers_export.GRAPHQL_URL),
+)}
+
+# Function to get all spaces
+def get_all_spaces():
+    url = f'{confluence_base_url}/rest/api/space'
+    return list(iter_results(client, url, limit=SPACE_LIMIT))
+
+# Function to submit the lookups of a stage in chunks, returning the future that resolves each key
+def submit_lookups(pool, stage, keys):
+    futures = {}
+    host = stage.host
+    for start in range(0, len(keys), stage.chunk_size):
+        chunk = keys[start:start + stage.chunk_size]
+        future = pool.submit(lambda chunk=chunk: dict(stage.lookup(chunk)), host=host)
+        for key in chunk:
+            futures[key] = future
+    return futures
+
+# Function to get the result of one key from the chunked lookups
+def lookup_result(futures, key):
+    return futures.pop(key).result()[key]
+
+# Function to parse the stages option
+def parse_stages(value):
+    names = [name.strip() for name in value.split(',') if name.strip()]
+    unknown = [name for name in names if name not in STAGES]
+    if unknown:
+        raise argparse.ArgumentTypeError(f"unknown stage(s): {', '.join(unknown)} (choose from {', '.join(STAGES)})")
+    return names
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Crawl Confluence once and export permissions, restrictions and watchers.")
+    parser.add_argument('--stages', type=parse_stages, default=list(STAGES),
+                        help=f"Comma-separated stages to run (default: {','.join(STAGES)})")
+    parser.add_argument('--workers', type=int, default=8, help="Number of concurrent worker threads (default: 8)")
+    parser.add_argument('--per-host-limit', type=int, default=8, help="Maximum concurrent requests per host (default: 8)")
+    parser.add_argument('--adaptive', action='store_true', help="Tune the concurrent requests per host between 1 and --workers, starting at --per-host-limit")
+    parser.add_argument('--output-format', choices=OUTPUT_FORMATS, default='json', help="Write JSON arrays (default) or JSON Lines, one space per line")
+    parser.add_argument('--indent', type=int, default=None, help="Indent the JSON arrays by this many spaces (default: compact)")
+    parser.add_argument('--fields', choices=PROJECTIONS, default='full', help="Export full API records (default) or only principals, operations and watcher accounts")
+    parser.add_argument('--intern-principals', action='store_true', help="Write every user, group and watcher once to a principal table per report and reference them by index")
+    parser.add_argument('--flat-export', help="Also write flat tables (one row per permission, restriction subject and watcher) to this SQLite file or, for parquet/csv, directory")
+    parser.add_argument('--flat-format', choices=FLAT_FORMATS, default='sqlite', help="Format of the flat export (default: sqlite; parquet needs pyarrow)")
+    sharding = parser.add_mutually_exclusive_group()
+    sharding.add_argument('--processes', type=int, default=1, help="Split the spaces into this many shards and crawl them in parallel processes (default: 1)")
+    sharding.add_argument('--shard', type=parse_shard, metavar='I/N', help="Only crawl shard I of N and write its partial output (e.g. to run the shards on different machines)")
+    sharding.add_argument('--merge', type=int, metavar='N', help="Merge the partial outputs of N shards into the reports")
+    return parser.parse_args(argv)
+
+# Function to get the reports written by the selected stages
+def selected_reports(args):
+    return [name for name in REPORTS if any(STAGES[stage].report == name for stage in args.stages)]
+
+# Function to get the partial output file of a report for one shard
+def report_shard_path(name, index, count):
+    return shard_path(REPORTS[name][0], index, count, '.jsonl')
+
+# Function to get a new principal table per report if principals are interned
+def principal_tables(args, reports):
+    return {name: PrincipalTable() for name in reports} if args.intern_principals else {}
+
+# Function to open the final record writer of a report, referencing principals by index if a table is given
+def open_report_writer(args, name, table=None):
+    report_path = REPORTS[name][0]
+    return reference_writer(open_record_writer(report_path, args.output_format, indent=args.indent),
+                            table, report_path, args.indent)
+
+# Function to open the flat export of the whole crawl or of one shard
+def open_flat_export(args, shard=None):
+    if shard is None:
+        return FlatExporter(args.flat_export, args.flat_format)
+    if args.flat_format == 'sqlite':
+        return FlatExporter(shard_path(args.flat_export, *shard))
+    # Parquet and CSV shards write their own files into the export directory
+    return FlatExporter(args.flat_export, args.flat_format, file_suffix=shard_suffix(*shard))
+
+# Function to crawl all spaces, or the spaces of one shard, and write the reports
+def crawl(args):
+    stages = [STAGES[name] for name in args.stages]
+    reports = selected_reports(args)
+    listing_host = urlparse(confluence_base_url).netloc
+    shard = args.shard
+    restrictions_export.fields = watchers_export.fields = args.fields
+
+    with ExitStack() as stack:
+        pool = stack.enter_context(FetchPool(max_workers=args.workers, per_host_limit=args.per_host_limit, adaptive=args.adaptive))
+        if args.adaptive:
+            client.observers.append(pool.observe)
+        # Shard outputs are intermediate, their principals are interned when they are merged
+        tables = principal_tables(args, reports) if shard is None else {}
+        if shard is None:
+            paths = {name: output_path(REPORTS[name][0], args.output_format) for name in reports}
+            # The lookups share one copy of every principal, the writers reference them by index
+            restrictions_export.principals = tables.get('restrictions')
+            watchers_export.principals = tables.get('watchers')
+            writers = {name: stack.enter_context(open_report_writer(args, name, tables.get(name))) for name in reports}
+        else:
+            paths = {name: report_shard_path(name, *shard) for name in reports}
+            writers = {name: stack.enter_context(JsonLinesWriter(paths[name])) for name in reports}
+        flat = stack.enter_context(open_flat_export(args, shard)) if args.flat_export else None
+        spaces = get_all_spaces()
+        # Position of every space in the full listing, so the shards can be merged back in listing order
+        positions = {space['key']: position for position, space in enumerate(spaces)}
+        if shard is not None:
+            spaces = [space for space in spaces if shard_of(space['key'], shard[1]) == shard[0]]
+
+        # Function to get the stages that run for a space
+        def space_stages(space):
+            return [stage for stage in stages if REPORTS[stage.report][1](space)]
+
+        # Spaces whose page lookups are in flight, kept in output order; at most this many spaces
+        # and pages are pending, so memory does not grow with the size of the tenant
+        pending = deque()
+        pending_pages = 0
+        max_pending_pages = args.workers * 50
+        max_pending_spaces = args.workers * 4
+        finished_spaces = 0
+
+        # The space lookups and page listings run ahead of the space being processed, one window of
+        # spaces at a time; a window is large enough for a full chunk of batched space lookups and
+        # the next one is submitted when half of the current one is processed
+        lookup_window = max([max_pending_spaces] + [stage.chunk_size for stage in stages if stage.level == 'space'])
+        space_futures = {stage.name: {} for stage in stages if stage.level == 'space'}
+        listing_futures = {}
+        next_lookup = 0
+
+        def submit_space_lookups(position):
+            nonlocal next_lookup
+            if next_lookup > position + lookup_window // 2:
+                return
+            window = spaces[next_lookup:next_lookup + lookup_window]
+            next_lookup += len(window)
+            for stage in stages:
+                if stage.level == 'space':
+                    keys = [space['key'] for space in window if stage in space_stages(space)]
+                    space_futures[stage.name].update(submit_lookups(pool, stage, keys))
+            for space in window:
+                if any(stage.level == 'page' for stage in space_stages(space)):
+                    listing_futures[space['key']] = pool.submit(restrictions_export.get_space_pages, space['key'], host=listing_host)
+
+        def finish_space():
+            nonlocal pending_pages, finished_spaces
+            space, enriched_stages, pages, page_futures = pending.popleft()
+            # Wait for the API calls first, so the stage below only measures local processing
+            lookups = {futures[space['key']] for futures in space_futures.values() if space['key'] in futures}
+            for futures in page_futures.values():
+                lookups.update(futures.values())
+            wait(lookups)
+            with profile_stage('write_space'):
+                for name in reports:
+                    space_data = {
+                        "space_name": space['name'],
+                        "space_id": space['id'],
+                        "space_type": space['type']
+                    }
+                    report_stages = [stage for stage in enriched_stages if stage.report == name]
+                    for stage in report_stages:
+                        if stage.level == 'space':
+                            space_data[stage.field] = lookup_result(space_futures[stage.name], space['key'])
+                    page_stages = [stage for stage in report_stages if stage.level == 'page']
+                    if page_stages:
+                        space_pages = []
+                        for page in pages:
+                            page_data = {
+                                "page_name": page['title'],
+                                "page_id": page['id']
+                            }
+                            for stage in page_stages:
+                                page_data[stage.field] = lookup_result(page_futures[stage.name], page['id'])
+                            space_pages.append(page_data)
+                        space_data["space_pages"] = space_pages
+                    writers[name].write(space_data if shard is None else [positions[space['key']], space_data])
+                    if flat is not None:
+                        flat.write_space(space['key'], space_data)
+            pending_pages -= len(pages or [])
+            finished_spaces += 1
+            pool.print_progress(finished_spaces, len(spaces))
+
+        for position, space in enumerate(spaces):
+            while pending_pages > max_pending_pages or len(pending) >= max_pending_spaces:
+                finish_space()
+            submit_space_lookups(position)
+            enriched_stages = space_stages(space)
+            pages = None
+            page_futures = {}
+            if space['key'] in listing_futures:
+                pages = listing_futures.pop(space['key']).result()
+                if pages is None:
+                    # The space has no pages endpoint; drop its pending space lookups too
+                    for futures in space_futures.values():
+                        futures.pop(space['key'], None)
+                    continue
+                page_ids = [page['id'] for page in pages]
+                for stage in enriched_stages:
+                    if stage.level == 'page':
+                        page_futures[stage.name] = submit_lookups(pool, stage, page_ids)
+                pending_pages += len(pages)
+            pending.append((space, enriched_stages, pages, page_futures))
+
+        while pending:
+            finish_space()
+
+    for name in reports:
+        prefix = "Exported" if shard is None else f"Shard {shard[0]}/{shard[1]}: exported"
+        print(f"{prefix} {writers[name].count} spaces to '{paths[name]}'")
+        if name in tables:
+            tables[name].print_summary(writers[name].path)
+    pool.print_summary()
+    if flat is not None:
+        flat.print_summary()
+
+# Function to crawl one shard in a worker process, with its share of the request rate
+def run_shard(args, index, count):
+    # All shards talk to the same tenant, so each process gets 1/count of the rate budget
+    client.bucket = client.bucket.share(count)
+    instrumentation = default_instrumentation()
+    if instrumentation is not None:
+        # Every process writes its own metrics and profiles instead of overwriting the other shards' files
+        if instrumentation.report_path:
+            instrumentation.report_path = shard_path(instrumentation.report_path, index, count)
+        if instrumentation.prometheus_path:
+            instrumentation.prometheus_path = shard_path(instrumentation.prometheus_path, index, count)
+        instrumentation.profile_dir = os.path.join(instrumentation.profile_dir, f"shard-{index}-of-{count}")
+        os.makedirs(instrumentation.profile_dir, exist_ok=True)
+    args.shard = (index, count)
+    crawl(args)
+
+# Function to crawl all shards in parallel processes and merge their outputs
+def run_sharded(args):
+    count = args.processes
+    # Spawned (not forked) workers open their own HTTP sessions and cache connections
+    with ProcessPoolExecutor(max_workers=count, mp_context=multiprocessing.get_context('spawn')) as executor:
+        futures = [executor.submit(run_shard, args, index, count) for index in range(1, count + 1)]
+        for future in futures:
+            future.result()
+    merge_shard_outputs(args, count, remove=True)
+
+# Function to merge the partial outputs of all shards into the reports
+def merge_shard_outputs(args, count, remove=False):
+    reports = selected_reports(args)
+    report_paths = {
+        name: [report_shard_path(name, index, count) for index in range(1, count + 1)]
+        for name in reports
+    }
+    flat_paths = []
+    if args.flat_export and args.flat_format == 'sqlite':
+        flat_paths = [shard_path(args.flat_export, index, count) for index in range(1, count + 1)]
+    # Check all shards first, so an incomplete merge never overwrites an existing report
+    missing = missing_shards([path for paths in report_paths.values() for path in paths] + flat_paths)
+    if missing:
+        print(f"Error: missing shard output(s): {', '.join(missing)}")
+        return False
+
+    tables = principal_tables(args, reports)
+    for name in reports:
+        with open_report_writer(args, name, tables.get(name)) as writer:
+            merge_shards(report_paths[name], writer)
+        print(f"Merged {writer.count} spaces from {count} shards into '{output_path(REPORTS[name][0], args.output_format)}'")
+        if name in tables:
+            tables[name].print_summary(writer.path)
+    if flat_paths:
+        with FlatExporter(args.flat_export) as flat:
+            for path in flat_paths:
+                flat.append_sqlite(path)
+        flat.print_summary()
+    elif args.flat_export:
+        print(f"Flat export: the {args.flat_format} files of the {count} shards are in '{args.flat_export}'")
+
+    if remove:
+        for path in [path for paths in report_paths.values() for path in paths] + flat_paths:
+            os.remove(path)
+    return True
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.merge:
+        merge_shard_outputs(args, args.merge)
+    elif args.processes > 1:
+        run_sharded(args)
+    else:
+        crawl(args)
+
+if __name__ == "__main__":
+    main()
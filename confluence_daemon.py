@@ -0,0 +1,461 @@
+"""
+This script runs a long-lived daemon that keeps the Confluence reports warm in memory and serves them over local HTTP.
+Every export script starts cold: it loads `.env`, opens new connections, lists every space and
+page and looks everything up again before it exits. The daemon does that once and then keeps an
+in-memory model of spaces, pages, permissions, restrictions and watchers, refreshes it in the
+background and answers report requests from memory in milliseconds.
+
+The refresh runs every `--interval` seconds (or on `POST /refresh`) and reuses the lookup stages of
+confluence_crawl.py on one pooled, keep-alive HTTP client:
+1. Spaces are listed, and space permissions and space watchers are looked up for all spaces.
+2. The page listings (with page versions) are read for all spaces.
+3. Pages that are new, have a new version or moved to another space are looked up first, most
+   recently modified first, so recent changes reach the reports early in a refresh.
+4. Then up to `--stale-batch` unchanged pages whose data is older than `--max-age-hours` are looked
+   up again, oldest first, since restriction changes do not always create a new page version.
+Page results are stored as each round of lookups finishes; a space's page list is replaced once
+all its new and changed pages are in, so a report never lists a page without its data. Until the
+first refresh is complete, the report endpoints answer 503. The model is not persisted; a restarted
+daemon loads everything once. The pages looked up in one refresh share one copy of every user, group
+and watcher (see principals.py); every refresh starts a new table, so renamed users and changed display
+names come in with the next lookup and the table never outgrows one refresh. `--fields minimal` trims
+the records (see projection.py), which keeps the model small.
+
+Endpoints (JSON, compact unless `?indent=N` is given):
+- GET /spaces: The report of get_confluence_spaces.py.
+- GET /permissions-and-restrictions: The report of space_permissions_and_page_restrictions.py.
+- GET /watchers: The report of spaces_and_pages_watchers.py.
+- GET /status: Refresh state, model size and the last refresh.
+- POST /refresh: Starts a refresh now.
+A report is available when at least one of its stages runs (see `--stages`). With `--socket PATH`,
+the daemon listens on a Unix socket instead of a TCP port.
+
+To use this script:
+1. Ensure you have the `requests` library installed (`pip install requests`).
+2. Run the daemon and request the reports, for example:
+   python confluence_daemon.py --port 8800 --interval 900
+   curl http://127.0.0.1:8800/permissions-and-restrictions
+   curl --unix-socket /tmp/confluence.sock http://localhost/watchers
+
+Dependencies:
+- requests: To handle HTTP requests.
+
+Classes:
+- ReportModel: In-memory model of spaces, pages and their lookups, rendering the reports.
+- Refresher: Background thread that refreshes the model.
+- DaemonHandler: HTTP handler serving the reports.
+
+Functions:
+- refresh_model(model, args): Runs one refresh of the model.
+- start_server(model, refresher, args): Starts the HTTP server on a TCP port or a Unix socket.
+
+Usage:
+1. Update the .env file with your Confluence instance details.
+2. Execute the script and point the portal at the local endpoints.
+"""
+
+from requests.auth import HTTPBasicAuth
+import argparse
+import os
+import socketserver
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+from dotenv import load_dotenv
+import confluence_crawl as crawl
+from confluence_client import ConfluenceClient
+from fetch_pool import FetchPool
+from json_codec import dumps
+from principals import PrincipalTable
+from projection import PROJECTIONS
+from snapshot_index import page_version
+import space_permissions_and_page_restrictions as restrictions_export
+import spaces_and_pages_watchers as watchers_export
+
+# Load the .env file
+load_dotenv()
+
+confluence_base_url = os.getenv('CONFLUENCE_BASE_URL')
+username = os.getenv('USERNAME')
+api_token = os.getenv('USER_API_TOKEN')
+
+# The model is the daemon's cache, so its requests bypass the on-disk response cache
+client = ConfluenceClient(auth=HTTPBasicAuth(username, api_token), cache=False)
+crawl.client = restrictions_export.client = watchers_export.client = client
+
+# Report path: report name of confluence_crawl.REPORTS, or 'spaces'
+REPORT_PATHS = {
+    '/spaces': 'spaces',
+    '/permissions-and-restrictions': 'restrictions',
+    '/watchers': 'watchers',
+}
+
+
+# In-memory model of spaces, pages and their lookups, rendering the reports
+class ReportModel:
+    def __init__(self, stage_names):
+        self.stages = [crawl.STAGES[name] for name in stage_names]
+        self.reports = ['spaces'] + [name for name in crawl.REPORTS if any(stage.report == name for stage in self.stages)]
+        self._lock = threading.Lock()
+        # Listed spaces, in listing order
+        self.spaces = []
+        # Space key -> {field: value} of the space lookups
+        self.space_values = {}
+        # Space key -> listed pages (id, title, version), or None if the space has no pages endpoint
+        self.pages = {}
+        # Page ID -> {field: value} of the page lookups, and the version, owning space and time of the lookup
+        self.page_values = {}
+        self.page_versions = {}
+        self.page_spaces = {}
+        self.page_fetched = {}
+        self.generation = 0
+        self.loaded = False
+        # Rendered report bodies, kept until the model changes
+        self._rendered = {}
+        self.status = {"refreshing": False, "refreshes": 0, "last_refresh": None, "last_error": None}
+
+    # Function to get the stages that run for a space
+    def space_stages(self, space):
+        return [stage for stage in self.stages if crawl.REPORTS[stage.report][1](space)]
+
+    # Function to check whether a listed page needs a lookup because it is new, changed or moved
+    def is_changed(self, space_key, page):
+        with self._lock:
+            return (self.page_versions.get(page['id']) != page_version(page)
+                    or self.page_spaces.get(page['id']) != space_key)
+
+    # Function to get when a page was last looked up (0 if never)
+    def fetched_at(self, page_id):
+        with self._lock:
+            return self.page_fetched.get(page_id, 0)
+
+    def set_space_values(self, space_key, values):
+        with self._lock:
+            self.space_values[space_key] = values
+            self.generation += 1
+
+    def set_page_values(self, space_key, page, values):
+        with self._lock:
+            self.page_values[page['id']] = {**self.page_values.get(page['id'], {}), **values}
+            self.page_versions[page['id']] = page_version(page)
+            self.page_spaces[page['id']] = space_key
+            self.page_fetched[page['id']] = time.time()
+            self.generation += 1
+
+    # Function to replace the page list of a space, dropping the pages it no longer lists
+    def set_pages(self, space_key, pages):
+        with self._lock:
+            listed = {page['id'] for page in pages or []}
+            for page in self.pages.get(space_key) or []:
+                if page['id'] not in listed and self.page_spaces.get(page['id']) == space_key:
+                    for values in (self.page_values, self.page_versions, self.page_spaces, self.page_fetched):
+                        values.pop(page['id'], None)
+            self.pages[space_key] = pages
+            self.generation += 1
+
+    # Function to replace the space list at the end of a refresh, dropping the spaces that are gone
+    def set_spaces(self, spaces):
+        listed = {space['key'] for space in spaces}
+        for space_key in [space['key'] for space in self.spaces if space['key'] not in listed]:
+            self.set_pages(space_key, [])
+        with self._lock:
+            for space_key in [space_key for space_key in self.space_values if space_key not in listed]:
+                del self.space_values[space_key]
+            for space_key in [space_key for space_key in self.pages if space_key not in listed]:
+                del self.pages[space_key]
+            self.spaces = spaces
+            self.loaded = True
+            self.generation += 1
+
+    # Function to build the space records of a report, in the shape of its export script
+    def _records(self, name):
+        if name == 'spaces':
+            spaces = [{
+                "space_name": space['name'],
+                "space_id": space['id'],
+                "space_key": space['key'],
+                "space_type": space['type']
+            } for space in self.spaces]
+            return {"total_spaces": len(spaces), "spaces": spaces}
+
+        records = []
+        for space in self.spaces:
+            space_data = {
+                "space_name": space['name'],
+                "space_id": space['id'],
+                "space_type": space['type']
+            }
+            if space['key'] in self.pages and self.pages[space['key']] is None:
+                # Spaces without a pages endpoint are left out, as in the crawl
+                continue
+            stages = [stage for stage in self.space_stages(space) if stage.report == name]
+            page_stages = [stage for stage in stages if stage.level == 'page']
+            for stage in stages:
+                if stage.level == 'space':
+                    space_data[stage.field] = self.space_values.get(space['key'], {}).get(stage.field)
+            if page_stages:
+                space_pages = []
+                for page in self.pages.get(space['key']) or []:
+                    page_data = {
+                        "page_name": page['title'],
+                        "page_id": page['id']
+                    }
+                    values = self.page_values.get(page['id'], {})
+                    for stage in page_stages:
+                        page_data[stage.field] = values.get(stage.field)
+                    space_pages.append(page_data)
+                space_data["space_pages"] = space_pages
+            records.append(space_data)
+        return records
+
+    # Function to get the encoded body of a report, rendering it only when the model changed
+    def render(self, name, indent=None):
+        with self._lock:
+            cached = self._rendered.get((name, indent))
+            if cached is not None and cached[0] == self.generation:
+                return cached[1]
+            generation = self.generation
+            records = self._records(name)
+        # Records are only ever replaced in the model, never changed in place, so they are encoded outside the lock
+        body = dumps(records, indent=indent).encode()
+        with self._lock:
+            self._rendered[(name, indent)] = (generation, body)
+        return body
+
+    def summary(self):
+        with self._lock:
+            return {
+                "loaded": self.loaded,
+                "generation": self.generation,
+                "spaces": len(self.spaces),
+                "pages": len(self.page_values),
+                "reports": self.reports,
+                **self.status,
+            }
+
+
+# Function to run one refresh of the model
+def refresh_model(model, args):
+    started = time.time()
+    listing_host = urlparse(confluence_base_url).netloc
+    # Lookups of this refresh share one copy of every principal; a new table picks up changed principals
+    restrictions_export.principals = PrincipalTable()
+    watchers_export.principals = PrincipalTable()
+    page_stages = [stage for stage in model.stages if stage.level == 'page']
+
+    with FetchPool(max_workers=args.workers, per_host_limit=args.per_host_limit, adaptive=args.adaptive) as pool:
+        if args.adaptive:
+            client.observers.append(pool.observe)
+        try:
+            spaces = restrictions_export.get_all_spaces()
+            stages_of = {space['key']: model.space_stages(space) for space in spaces}
+
+            # Space lookups and page listings go out together, the space lookups are stored first
+            space_futures = {
+                stage.name: crawl.submit_lookups(pool, stage, [key for key, stages in stages_of.items() if stage in stages])
+                for stage in model.stages if stage.level == 'space'
+            }
+            listing_futures = {
+                key: pool.submit(restrictions_export.get_space_pages, key, host=listing_host)
+                for key, stages in stages_of.items() if any(stage.level == 'page' for stage in stages)
+            }
+            for key, stages in stages_of.items():
+                values = {
+                    stage.field: crawl.lookup_result(space_futures[stage.name], key)
+                    for stage in stages if stage.level == 'space'
+                }
+                if values:
+                    model.set_space_values(key, values)
+            listings = {key: future.result() for key, future in listing_futures.items()}
+
+            # New and changed pages first, most recently modified first; then the oldest stale pages
+            changed = []
+            stale = []
+            max_age = args.max_age_hours * 3600
+            for key, pages in listings.items():
+                for page in pages or []:
+                    if model.is_changed(key, page):
+                        changed.append((key, page))
+                    elif model.fetched_at(page['id']) < started - max_age:
+                        stale.append((key, page))
+            changed.sort(key=lambda item: (item[1].get('version') or {}).get('when') or '', reverse=True)
+            stale.sort(key=lambda item: model.fetched_at(item[1]['id']))
+            stale = stale[:args.stale_batch]
+
+            # A space's page list is replaced once all its new and changed pages are in
+            remaining = Counter(key for key, _ in changed)
+            for key, pages in listings.items():
+                if not remaining[key]:
+                    model.set_pages(key, pages)
+
+            lookups = changed + stale
+            round_size = args.workers * 50
+            for start in range(0, len(lookups), round_size):
+                batch = lookups[start:start + round_size]
+                futures = {
+                    stage.name: crawl.submit_lookups(pool, stage, [page['id'] for key, page in batch if stage in stages_of[key]])
+                    for stage in page_stages
+                }
+                for position, (key, page) in enumerate(batch, start):
+                    values = {
+                        stage.field: crawl.lookup_result(futures[stage.name], page['id'])
+                        for stage in page_stages if stage in stages_of[key]
+                    }
+                    model.set_page_values(key, page, values)
+                    if position < len(changed):
+                        remaining[key] -= 1
+                        if not remaining[key]:
+                            model.set_pages(key, listings[key])
+                pool.print_progress(min(start + round_size, len(lookups)), len(lookups), unit='pages')
+
+            model.set_spaces(spaces)
+        finally:
+            if args.adaptive:
+                client.observers.remove(pool.observe)
+
+    elapsed = time.time() - started
+    print(f"Refresh: {len(spaces)} spaces, {len(changed)} new or changed and {len(stale)} stale pages "
+          f"looked up in {elapsed:.1f}s")
+    pool.print_summary()
+    return {"started": time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(started)),
+            "seconds": round(elapsed, 3), "spaces": len(spaces), "changed_pages": len(changed),
+            "stale_pages": len(stale)}
+
+
+# Background thread that refreshes the model every interval, or when a refresh is requested
+class Refresher(threading.Thread):
+    def __init__(self, model, args):
+        super().__init__(name='refresher', daemon=True)
+        self.model = model
+        self.args = args
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+
+    # Function to start a refresh now instead of at the next interval
+    def request_refresh(self):
+        self._wake.set()
+
+    def stop(self):
+        self._stopped.set()
+        self._wake.set()
+
+    def run(self):
+        while not self._stopped.is_set():
+            self._wake.clear()
+            self.model.status["refreshing"] = True
+            try:
+                self.model.status["last_refresh"] = refresh_model(self.model, self.args)
+                self.model.status["last_error"] = None
+            except Exception as e:
+                # The model keeps its data; the next refresh tries again
+                print(f"Error refreshing the model: {e}")
+                self.model.status["last_error"] = str(e)
+            finally:
+                self.model.status["refreshing"] = False
+                self.model.status["refreshes"] += 1
+            self._wake.wait(self.args.interval)
+
+
+# HTTP handler serving the reports from the model
+class DaemonHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are separate writes, which Nagle's algorithm would delay on keep-alive connections
+    disable_nagle_algorithm = True
+    model = None
+    refresher = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_body(self, body, status=200):
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_json(self, value, status=200):
+        self.send_body(dumps(value).encode(), status)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        path = url.path.rstrip('/')
+        if path == '/status':
+            return self.send_json(self.model.summary())
+        name = REPORT_PATHS.get(path)
+        if name is None or name not in self.model.reports:
+            return self.send_json({"message": "Not found", "reports": sorted(REPORT_PATHS)}, status=404)
+        if not self.model.loaded:
+            return self.send_json({"message": "The model is still loading", **self.model.summary()}, status=503)
+        indent = parse_qs(url.query).get('indent')
+        try:
+            indent = int(indent[0]) if indent else None
+        except ValueError:
+            return self.send_json({"message": "indent must be a number"}, status=400)
+        self.send_body(self.model.render(name, indent))
+
+    def do_POST(self):
+        # Requests may carry a body, which is not used
+        self.rfile.read(int(self.headers.get('Content-Length', 0) or 0))
+        if urlparse(self.path).path.rstrip('/') != '/refresh':
+            return self.send_json({"message": "Not found"}, status=404)
+        self.refresher.request_refresh()
+        self.send_json({"message": "Refresh requested", **self.model.summary()}, status=202)
+
+
+# HTTP server on a Unix socket
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+# Function to start the HTTP server on a TCP port or a Unix socket
+def start_server(model, refresher, args):
+    handler = type('ModelHandler', (DaemonHandler,), {'model': model, 'refresher': refresher})
+    if args.socket:
+        if os.path.exists(args.socket):
+            os.remove(args.socket)
+        return ThreadingUnixHTTPServer(args.socket, handler)
+    server = ThreadingHTTPServer((args.host, args.port), handler)
+    server.daemon_threads = True
+    return server
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Keep the Confluence reports warm in memory and serve them over local HTTP.")
+    parser.add_argument('--host', default='127.0.0.1', help="Address to listen on (default: 127.0.0.1)")
+    parser.add_argument('--port', type=int, default=8800, help="Port to listen on (default: 8800)")
+    parser.add_argument('--socket', help="Listen on this Unix socket instead of a TCP port")
+    parser.add_argument('--interval', type=float, default=900, help="Seconds between the end of a refresh and the next one (default: 900)")
+    parser.add_argument('--max-age-hours', type=float, default=24, help="Look up unchanged pages again once their data is this old (default: 24)")
+    parser.add_argument('--stale-batch', type=int, default=1000, help="Most unchanged pages looked up again per refresh (default: 1000)")
+    parser.add_argument('--stages', type=crawl.parse_stages, default=list(crawl.STAGES),
+                        help=f"Comma-separated stages to keep up to date (default: {','.join(crawl.STAGES)})")
+    parser.add_argument('--workers', type=int, default=8, help="Number of concurrent worker threads (default: 8)")
+    parser.add_argument('--per-host-limit', type=int, default=8, help="Maximum concurrent requests per host (default: 8)")
+    parser.add_argument('--adaptive', action='store_true', help="Tune the concurrent requests per host between 1 and --workers, starting at --per-host-limit")
+    parser.add_argument('--fields', choices=PROJECTIONS, default='full', help="Keep full API records (default) or only principals, operations and watcher accounts")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    restrictions_export.fields = watchers_export.fields = args.fields
+
+    model = ReportModel(args.stages)
+    refresher = Refresher(model, args)
+    server = start_server(model, refresher, args)
+    refresher.start()
+    print(f"Serving {', '.join(path for path, name in REPORT_PATHS.items() if name in model.reports)} and /status on "
+          f"{args.socket or f'http://{args.host}:{server.server_address[1]}'}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        refresher.stop()
+        server.server_close()
+        if args.socket and os.path.exists(args.socket):
+            os.remove(args.socket)
+
+if __name__ == "__main__":
+    main()
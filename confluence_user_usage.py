@@ -5,133 +5,173 @@ and the number of users active in the last month, last 2 months, and last 3 mont
 It then saves this information to a JSON file named 'confluence_managed_accounts.json'.
 
 The script performs the following tasks:
-1. Retrieves all managed accounts within the Confluence instance.
+1. Retrieves all managed accounts within the Confluence instance. The next page of accounts is requested
+   in the background while the current one is counted, so fetching and counting overlap.
 2. Filters active users and counts them by domain.
 3. Counts users active in the last 1, 2, and 3 months.
+   All counts are made in a single pass over the accounts (see activity_aggregator.py);
+   other windows can be requested with `--activity-windows`, e.g. `--activity-windows 90,60,30,180,never`.
 4. Exports the gathered data to a JSON file.
 
+With `--history`, every run also appends the status, last activity, product access and domain of
+all managed accounts that changed since the previous run to a SQLite history (see user_history.py),
+which answers trend questions (active users per domain over the last runs, accounts that went
+inactive between runs) without keeping copies of the report.
+
 To use this script:
 1. Ensure you have the `requests` library installed (`pip install requests`).
 2. Run the script.
 
 Dependencies:
 - requests: To handle HTTP requests.
-- json: To handle JSON data.
-- datetime, timedelta: For date manipulations.
-- collections.defaultdict: To handle default dictionary operations.
+- json_stream: To write the JSON report incrementally.
+- activity_aggregator: To count users per domain and activity window in one pass.
+- user_history: To record the accounts of every run in the user history.
 
 Functions:
-- get_managed_accounts(): Retrieves all managed accounts.
-- filter_active_users(accounts): Filters active users and counts them by domain.
-- get_domain_counts(accounts, time_period): Counts users by domain for a specific time period.
+- get_accounts_page(url): Retrieves one page of managed accounts.
+- iter_managed_accounts(url): Yields all managed accounts, prefetching the next page.
+- iter_spooled(spool): Yields the accounts written to the spool file.
+- window_name(days): Returns the report key suffix for an activity window.
+- parse_windows(value): Parses the activity windows option.
 
 Usage:
 1. Ensure the required packages are installed.
 2. Execute the script to retrieve and export managed account information to a JSON file.
 """
 
-import json
-import requests
-from datetime import datetime, timedelta
-from collections import defaultdict
+import argparse
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 import os
+from activity_aggregator import ActivityAggregator
+from confluence_client import ConfluenceClient
+from instrumentation import profile_stage
+from json_codec import dumps, loads, response_json
+from json_stream import JsonObjectWriter
+from user_history import UserHistoryRecorder, default_history_path
 # Load the .env file
 load_dotenv()
 
 # Get the API token
 api_token = os.getenv('API_TOKEN')
 
-# Function to get managed accounts
-def get_managed_accounts():
-    url = f'https://api.atlassian.com/admin/v1/orgs/96k7d9d5-7d30-126a-7718-2bb4404j2a84/users'
-    headers = {
-        'Authorization': f'Bearer {api_token}',
-        'Accept': 'application/json'
-    }
-    managed_accounts = []
-    try:
-        while url:
-            response = requests.get(url, headers=headers)
-            response.raise_for_status()
-            data = response.json()
-            managed_accounts.extend(data.get('data', []))
-            url = data.get('links', {}).get('next', None)
-        return managed_accounts
-    except Exception as e:
-        print(f"Error retrieving managed accounts: {e}")
-        return []
-
-# Function to filter active users and count them by domain
-def filter_active_users(accounts):
-    active_users = defaultdict(list)
-    confluence_domain_counts = defaultdict(int)
-
-    for account in accounts:
-        if account['account_status'] == 'active':
-            if 'product_access' in account:
-                for access in account['product_access']:
-                    if access.get('name') == 'Confluence':
-                        domain = account['email'].split('@')[-1]
-                        confluence_domain_counts[domain] += 1
-                        break
-
-    return confluence_domain_counts
-
-# Function to get domain counts for a specific time period
-def get_domain_counts(accounts, time_period):
-    domain_counts = defaultdict(int)
-    user_list = []
-
-    for account in accounts:
-        if account.get('last_active') and datetime.strptime(account['last_active'].split('T')[0], '%Y-%m-%d') >= time_period:
-            domain = account['email'].split('@')[-1]
-            domain_counts[domain] += 1
-            user_list.append({'name': account.get('name'), 'email': account['email']})
-
-    return domain_counts, user_list
-
-def main():
+client = ConfluenceClient(headers={
+    'Authorization': f'Bearer {api_token}',
+    'Accept': 'application/json'
+})
+
+# Organization users endpoint; ATLASSIAN_ADMIN_URL and ATLASSIAN_ORG_ID override it (e.g. for a mock server)
+admin_base_url = os.getenv('ATLASSIAN_ADMIN_URL', 'https://api.atlassian.com')
+org_id = os.getenv('ATLASSIAN_ORG_ID', '96k7d9d5-7d30-126a-7718-2bb4404j2a84')
+ORG_USERS_URL = f'{admin_base_url}/admin/v1/orgs/{org_id}/users'
+
+# Activity windows in days, in report order, and the names used for them in the report keys
+DEFAULT_WINDOWS = "90,60,30"
+WINDOW_NAMES = {90: "last_3_months", 60: "last_2_months", 30: "last_month"}
+
+# Function to get one page of managed accounts
+def get_accounts_page(url):
+    response = client.get(url)
+    response.raise_for_status()
+    return response_json(response)
+
+# Function to yield managed accounts page by page, requesting the next page while the current one is processed
+def iter_managed_accounts(url=ORG_USERS_URL):
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        future = executor.submit(get_accounts_page, url)
+        while future is not None:
+            data = future.result()
+            next_url = data.get('links', {}).get('next', None)
+            future = executor.submit(get_accounts_page, next_url) if next_url else None
+            yield from data.get('data', [])
+
+# Function to read the spooled accounts from the start of the spool file
+def iter_spooled(spool):
+    spool.seek(0)
+    for line in spool:
+        yield loads(line)
+
+# Function to get the report key suffix for an activity window
+def window_name(days):
+    return WINDOW_NAMES.get(days, f"last_{days}_days")
+
+# Function to parse the activity windows option, e.g. "90,60,30,never"
+def parse_windows(value):
+    windows = []
+    include_never = False
+    for part in value.split(','):
+        part = part.strip()
+        if part == 'never':
+            include_never = True
+        elif part:
+            if not part.isdigit() or int(part) == 0:
+                raise argparse.ArgumentTypeError(f"invalid activity window {part!r}: expected a number of days or 'never'")
+            windows.append(int(part))
+    return windows, include_never
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Report active Confluence users per domain and activity window.")
+    parser.add_argument('--activity-windows', type=parse_windows, default=DEFAULT_WINDOWS,
+                        help=f"Comma-separated activity windows in days, 'never' adds a never-active count (default: {DEFAULT_WINDOWS})")
+    parser.add_argument('--indent', type=int, default=None, help="Indent the JSON report by this many spaces (default: compact)")
+    parser.add_argument('--history', nargs='?', const=default_history_path(),
+                        help="Also append the accounts that changed since the previous run to this user history file (see user_history.py)")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    windows, include_never = args.activity_windows
     try:
-        managed_accounts = get_managed_accounts()
-        active_accounts = [account for account in managed_accounts if account['account_status'] == 'active']
-        confluence_domain_counts = filter_active_users(managed_accounts)
-
-        # Count the number of active users
-        num_active_users = len(active_accounts)
-
-        # Count the number of Confluence users for each domain
-        confluence_users_count = sum(confluence_domain_counts.values())
-
-        # Time periods
-        three_months_ago = datetime.now() - timedelta(days=90)
-        two_months_ago = datetime.now() - timedelta(days=60)
-        one_month_ago = datetime.now() - timedelta(days=30)
-
-        # Get domain counts and user lists for the specified time periods
-        active_in_last_3_months, users_in_last_3_months = get_domain_counts(active_accounts, three_months_ago)
-        active_in_last_2_months, users_in_last_2_months = get_domain_counts(active_accounts, two_months_ago)
-        active_in_last_month, users_in_last_month = get_domain_counts(active_accounts, one_month_ago)
-
-        # Save results to JSON file
-        with open("File Examples/confluence_managed_accounts.json", "w") as json_file:
-            json.dump({
-                "active_users": num_active_users,
-                "confluence_users_count": confluence_users_count,
-                "active_in_last_3_months": len(users_in_last_3_months),
-                "active_in_last_2_months": len(users_in_last_2_months),
-                "active_in_last_month": len(users_in_last_month),
-                "confluence_domain_counts": confluence_domain_counts,
-                "active_in_last_3_months_domain_counts": active_in_last_3_months,
-                "active_in_last_2_months_domain_counts": active_in_last_2_months,
-                "active_in_last_month_domain_counts": active_in_last_month,
-                "users_in_last_3_months": users_in_last_3_months,
-                "users_in_last_2_months": users_in_last_2_months,
-                "users_in_last_month": users_in_last_month,
-                "accounts": active_accounts
-            }, json_file, indent=4)
+        # Accounts are streamed from the API straight into the counters; active accounts are
+        # spooled to a temporary file, which the user lists and the account list are read from
+        aggregator = ActivityAggregator(windows=windows)
+        history = UserHistoryRecorder(args.history) if args.history else None
+        with tempfile.TemporaryFile('w+', encoding='utf-8') as spool:
+            try:
+                for account in iter_managed_accounts():
+                    aggregator.add(account)
+                    if history is not None:
+                        history.add(account)
+                    if account.get('account_status') == 'active':
+                        spool.write(dumps(account) + '\n')
+            except Exception as e:
+                # An incomplete account list would look like removed accounts, so the run is not recorded
+                if history is not None:
+                    history.discard()
+                print(f"Error retrieving managed accounts: {e}")
+                return
+            if history is not None:
+                with profile_stage('write_history'):
+                    history.close()
+
+            with profile_stage('write_report'):
+                confluence_domain_counts = aggregator.confluence_domain_counts()
+                confluence_users_count = sum(confluence_domain_counts.values())
+
+                # Save results to JSON file, streaming the account list instead of serializing it in one piece
+                with JsonObjectWriter("File Examples/confluence_managed_accounts.json", indent=args.indent) as json_file:
+                    json_file.write_field("active_users", aggregator.active_users)
+                    json_file.write_field("confluence_users_count", confluence_users_count)
+                    for days in windows:
+                        json_file.write_field(f"active_in_{window_name(days)}", aggregator.window_user_count(days))
+                    if include_never:
+                        json_file.write_field("never_active", aggregator.never_active)
+                    json_file.write_field("confluence_domain_counts", confluence_domain_counts)
+                    for days in windows:
+                        json_file.write_field(f"active_in_{window_name(days)}_domain_counts", aggregator.window_domain_counts(days))
+                    for days in windows:
+                        with json_file.array_field(f"users_in_{window_name(days)}") as users:
+                            for user in aggregator.iter_window_users(iter_spooled(spool), days):
+                                users.write(user)
+                    with json_file.array_field("accounts") as accounts:
+                        for account in iter_spooled(spool):
+                            accounts.write(account)
 
         print("Managed accounts data saved to 'confluence_managed_accounts.json'")
+        if history is not None:
+            history.print_summary()
 
     except Exception as e:
         print(f"An error occurred: {e}")
@@ -0,0 +1,173 @@
+"""
+This module provides a bounded-concurrency fetch engine shared by the Confluence scripts.
+It fans out API lookups over a thread pool while capping the number of tasks in flight
+against any single host, and it records the time of every task so a throughput summary can be
+printed at the end of a run. A task is one submitted call: it may make several API calls (a
+listing, retries) and its time includes waiting for the client's rate limit, so the summary counts
+tasks, not HTTP requests (see instrumentation.py for per-request metrics).
+
+With `adaptive=True`, the per-host cap is not fixed: it starts at `per_host_limit` and is tuned
+between 1 and `max_workers` by an AdaptiveLimit (see concurrency_limit.py) from the latency and
+429 responses of the API calls. Register `pool.observe` as a ConfluenceClient observer to feed it.
+`print_progress()` shows the current limits and the rate of finished tasks while a run is going.
+When the `with` block exits with an exception, queued tasks are cancelled instead of run.
+
+Classes:
+- FetchPool: Thread pool with a per-host concurrency cap and task time bookkeeping.
+
+Functions:
+- percentile(values, pct): Returns the nearest-rank percentile of a list of numbers.
+
+Usage:
+    with FetchPool(max_workers=16, per_host_limit=8, adaptive=True) as pool:
+        client.observers.append(pool.observe)
+        future = pool.submit(get_page_restrictions, page_id, host=host)
+        restrictions = future.result()
+    pool.print_summary()
+"""
+
+import math
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+from concurrency_limit import AdaptiveLimit
+
+# Seconds between progress lines, and the period the effective rate is measured over
+PROGRESS_INTERVAL = 5.0
+RATE_WINDOW = 10.0
+
+
+# Function to get the nearest-rank percentile of a list of numbers
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+# Thread pool that caps concurrent tasks per host and records their times
+class FetchPool:
+    def __init__(self, max_workers=8, per_host_limit=8, adaptive=False):
+        self.max_workers = max_workers
+        self.per_host_limit = per_host_limit
+        self.adaptive = adaptive
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._host_semaphores = {}
+        self._lock = threading.Lock()
+        self._task_times = []
+        self._errors = 0
+        self._completed = deque()
+        self._started = time.perf_counter()
+        self._finished = None
+        self._last_progress = self._started
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        # After an error, the queued tasks are dropped so the exception surfaces right away
+        self.shutdown(cancel_futures=exc_type is not None)
+        return False
+
+    # Function to get (or create) the semaphore or adaptive limit guarding a host
+    def _host_semaphore(self, host):
+        with self._lock:
+            semaphore = self._host_semaphores.get(host)
+            if semaphore is None:
+                if self.adaptive:
+                    semaphore = AdaptiveLimit(initial=self.per_host_limit, max_limit=self.max_workers)
+                else:
+                    semaphore = threading.BoundedSemaphore(self.per_host_limit)
+                self._host_semaphores[host] = semaphore
+            return semaphore
+
+    # Function to feed a finished API call (a ConfluenceClient RequestEvent) to the adaptive limit of its host
+    def observe(self, event):
+        if not self.adaptive or event.cached:
+            return
+        limit = self._host_semaphores.get(urlparse(event.url).netloc)
+        if limit is not None:
+            limit.on_sample(event.latency, throttled=event.throttled > 0 or event.status == 429)
+
+    # Function to run a call under the host cap and record its time
+    def _run(self, host, fn, args, kwargs):
+        with self._host_semaphore(host):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            except Exception:
+                with self._lock:
+                    self._errors += 1
+                raise
+            finally:
+                finished = time.perf_counter()
+                with self._lock:
+                    self._task_times.append(finished - start)
+                    self._completed.append(finished)
+                    while self._completed[0] < finished - RATE_WINDOW:
+                        self._completed.popleft()
+
+    # Function to schedule fn(*args, **kwargs) against the given host
+    def submit(self, fn, *args, host=None, **kwargs):
+        return self._executor.submit(self._run, host, fn, args, kwargs)
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        self._executor.shutdown(wait=wait, cancel_futures=cancel_futures)
+        if self._finished is None:
+            self._finished = time.perf_counter()
+
+    # Function to summarize task count, throughput and task time percentiles
+    def summary(self):
+        with self._lock:
+            task_times = list(self._task_times)
+            errors = self._errors
+        elapsed = (self._finished or time.perf_counter()) - self._started
+        return {
+            "tasks": len(task_times),
+            "errors": errors,
+            "elapsed_seconds": round(elapsed, 3),
+            "tasks_per_second": round(len(task_times) / elapsed, 2) if elapsed > 0 else 0.0,
+            "p50_task_ms": round(percentile(task_times, 50) * 1000, 1),
+            "p95_task_ms": round(percentile(task_times, 95) * 1000, 1),
+        }
+
+    # Function to get the current concurrency limit per host
+    def limits(self):
+        with self._lock:
+            semaphores = dict(self._host_semaphores)
+        return {
+            host: int(semaphore.limit) if self.adaptive else self.per_host_limit
+            for host, semaphore in semaphores.items()
+        }
+
+    # Function to get the number of tasks finished per second over the last RATE_WINDOW seconds
+    def current_rate(self):
+        now = time.perf_counter()
+        with self._lock:
+            while self._completed and self._completed[0] < now - RATE_WINDOW:
+                self._completed.popleft()
+            finished = len(self._completed)
+        return finished / min(RATE_WINDOW, max(now - self._started, 1e-9))
+
+    # Function to print the progress with the current concurrency limits and rate, at most every PROGRESS_INTERVAL seconds
+    def print_progress(self, done, total, unit='spaces', force=False):
+        now = time.perf_counter()
+        if not force and now - self._last_progress < PROGRESS_INTERVAL:
+            return
+        self._last_progress = now
+        limits = ", ".join(f"{limit} on {host}" for host, limit in self.limits().items()) or "-"
+        print(f"Progress: {done}/{total} {unit}, concurrency {limits}"
+              f"{' (adaptive)' if self.adaptive else ''}, {self.current_rate():.1f} tasks/s")
+
+    def print_summary(self):
+        stats = self.summary()
+        print(
+            f"Throughput: {stats['tasks']} tasks in {stats['elapsed_seconds']}s "
+            f"({stats['tasks_per_second']} tasks/s), "
+            f"task time p50 {stats['p50_task_ms']} ms, p95 {stats['p95_task_ms']} ms, "
+            f"{stats['errors']} failed"
+        )
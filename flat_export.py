@@ -0,0 +1,215 @@
+"""
+This module provides flat (one row per fact) exports of the permissions, restrictions and watchers reports.
+The JSON reports nest restrictions and watchers several levels deep and embed the raw API
+responses. For analysis, the same data is written as three flat tables:
+- space_permissions: One row per (space, principal, operation).
+- page_restrictions: One row per (space, page, restriction operation, user or group).
+- watchers: One row per (space or page, watcher account).
+
+The tables are written as SQLite (one file with indexes on space_key, page_id/content_id and
+account IDs), as Parquet (one file per table, requires `pyarrow`) or as CSV (one file per table).
+Rows are buffered and written in batches while the export runs, so the flat export never holds
+the whole tenant in memory.
+
+Classes:
+- FlatExporter: Streams flat rows of exported space records to SQLite, Parquet or CSV, and merges SQLite shards.
+
+Functions:
+- iter_operation_restrictions(restrictions): Yields (operation, restrictions) from a restrictions response.
+- space_permission_rows(space_key, space_id, permissions): Yields the rows of a space's permissions.
+- page_restriction_rows(space_key, page_id, page_name, restrictions): Yields the rows of a page's restrictions.
+- watcher_rows(space_key, content_type, content_id, watchers): Yields the rows of a space's or page's watchers.
+
+Usage:
+    with FlatExporter("File Examples/confluence_permissions.sqlite") as exporter:
+        exporter.write_space(space_key, space_data)
+"""
+
+import csv
+import os
+import sqlite3
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+FLAT_FORMATS = ('sqlite', 'parquet', 'csv')
+BATCH_SIZE = 5000
+
+# Table name: columns
+TABLES = {
+    'space_permissions': ('space_key', 'space_id', 'principal_type', 'principal_id', 'operation', 'target_type'),
+    'page_restrictions': ('space_key', 'page_id', 'page_name', 'operation', 'subject_type', 'subject_id', 'subject_name'),
+    'watchers': ('space_key', 'content_type', 'content_id', 'account_id', 'display_name', 'permission_type'),
+}
+
+# Indexed columns per table (SQLite only)
+INDEXES = {
+    'space_permissions': ('space_key', 'principal_id'),
+    'page_restrictions': ('space_key', 'page_id', 'subject_id'),
+    'watchers': ('space_key', 'content_id', 'account_id'),
+}
+
+
+# Function to yield (operation, restrictions) from a restrictions response, keyed by operation or as a result list
+def iter_operation_restrictions(restrictions):
+    if not isinstance(restrictions, dict):
+        return
+    if isinstance(restrictions.get('results'), list):
+        entries = restrictions['results']
+    else:
+        entries = [value for key, value in restrictions.items() if not key.startswith('_')]
+    for entry in entries:
+        if isinstance(entry, dict) and isinstance(entry.get('restrictions'), dict):
+            yield entry.get('operation'), entry['restrictions']
+
+
+# Function to yield the rows of a space's permissions
+def space_permission_rows(space_key, space_id, permissions):
+    for permission in (permissions or {}).get('results', []):
+        principal = permission.get('principal') or {}
+        operation = permission.get('operation') or {}
+        yield (space_key, space_id, principal.get('type'), principal.get('id'),
+               operation.get('key'), operation.get('targetType'))
+
+
+# Function to yield the rows of a page's restrictions
+def page_restriction_rows(space_key, page_id, page_name, restrictions):
+    for operation, subjects in iter_operation_restrictions(restrictions):
+        for user in (subjects.get('user') or {}).get('results', []):
+            yield (space_key, page_id, page_name, operation, 'user', user.get('accountId'), user.get('displayName'))
+        for group in (subjects.get('group') or {}).get('results', []):
+            yield (space_key, page_id, page_name, operation, 'group', group.get('id') or group.get('name'), group.get('name'))
+
+
+# Function to yield the rows of a space's or page's watchers
+def watcher_rows(space_key, content_type, content_id, watchers):
+    for connection in ((watchers or {}).get('data') or {}).values():
+        for node in (connection or {}).get('nodes') or []:
+            yield (space_key, content_type, content_id, node.get('accountId'),
+                   node.get('displayName'), node.get('permissionType'))
+
+
+# Streams flat rows of exported space records to SQLite, Parquet or CSV
+class FlatExporter:
+    def __init__(self, path, fmt='sqlite', batch_size=BATCH_SIZE, file_suffix=''):
+        if fmt not in FLAT_FORMATS:
+            raise ValueError(f"Unknown flat export format '{fmt}' (choose from {', '.join(FLAT_FORMATS)})")
+        if fmt == 'parquet' and pyarrow is None:
+            raise RuntimeError("The Parquet export needs pyarrow (pip install pyarrow)")
+        self.path = path
+        self.fmt = fmt
+        self.batch_size = batch_size
+        # Added to the Parquet and CSV file names, so several shards can write to the same directory
+        self.file_suffix = file_suffix
+        self.counts = {table: 0 for table in TABLES}
+        self._buffers = {table: [] for table in TABLES}
+        self._writers = {}
+        self._files = []
+        self._conn = None
+
+        if fmt == 'sqlite':
+            if os.path.exists(path):
+                os.remove(path)
+            self._conn = sqlite3.connect(path)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('PRAGMA synchronous=NORMAL')
+            for table, columns in TABLES.items():
+                self._conn.execute(f"CREATE TABLE {table} ({', '.join(columns)})")
+        else:
+            os.makedirs(path, exist_ok=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    # Function to add the rows of one exported space record (restrictions or watchers report)
+    def write_space(self, space_key, space_data):
+        if "space_permissions" in space_data:
+            self._add('space_permissions', space_permission_rows(space_key, space_data.get("space_id"), space_data["space_permissions"]))
+        if "space_watchers" in space_data:
+            self._add('watchers', watcher_rows(space_key, 'space', space_key, space_data["space_watchers"]))
+        for page in space_data.get("space_pages") or []:
+            if "page_restrictions" in page:
+                self._add('page_restrictions', page_restriction_rows(space_key, page["page_id"], page["page_name"], page["page_restrictions"]))
+            if "page_watchers" in page:
+                self._add('watchers', watcher_rows(space_key, 'page', page["page_id"], page["page_watchers"]))
+
+    def _add(self, table, rows):
+        buffer = self._buffers[table]
+        buffer.extend(rows)
+        if len(buffer) >= self.batch_size:
+            self._flush(table)
+
+    # Function to write the buffered rows of a table
+    def _flush(self, table):
+        rows = self._buffers[table]
+        if not rows:
+            return
+        columns = TABLES[table]
+        if self.fmt == 'sqlite':
+            self._conn.executemany(
+                f"INSERT INTO {table} VALUES ({', '.join('?' for _ in columns)})", rows
+            )
+            self._conn.commit()
+        elif self.fmt == 'parquet':
+            schema = pyarrow.schema([(column, pyarrow.string()) for column in columns])
+            batch = pyarrow.table({
+                column: [None if row[position] is None else str(row[position]) for row in rows]
+                for position, column in enumerate(columns)
+            }, schema=schema)
+            writer = self._writers.get(table)
+            if writer is None:
+                writer = pyarrow.parquet.ParquetWriter(os.path.join(self.path, f"{table}{self.file_suffix}.parquet"), schema)
+                self._writers[table] = writer
+            writer.write_table(batch)
+        else:
+            writer = self._writers.get(table)
+            if writer is None:
+                csv_file = open(os.path.join(self.path, f"{table}{self.file_suffix}.csv"), 'w', newline='', encoding='utf-8')
+                self._files.append(csv_file)
+                writer = csv.writer(csv_file)
+                writer.writerow(columns)
+                self._writers[table] = writer
+            writer.writerows(rows)
+        self.counts[table] += len(rows)
+        self._buffers[table] = []
+
+    # Function to copy all rows of another SQLite flat export (e.g. a shard) into this one
+    def append_sqlite(self, path):
+        for table in TABLES:
+            self._flush(table)
+        self._conn.execute('ATTACH DATABASE ? AS shard', (path,))
+        for table in TABLES:
+            cursor = self._conn.execute(f"INSERT INTO main.{table} SELECT * FROM shard.{table}")
+            self.counts[table] += cursor.rowcount
+        self._conn.commit()
+        self._conn.execute('DETACH DATABASE shard')
+
+    def print_summary(self):
+        rows = ", ".join(f"{count} {table}" for table, count in self.counts.items() if count)
+        print(f"Flat export: {rows or 'no'} rows written to '{self.path}'")
+
+    def close(self):
+        for table in TABLES:
+            self._flush(table)
+        if self._conn is not None:
+            # Indexes are built once at the end, which is faster than maintaining them during the inserts
+            for table, columns in INDEXES.items():
+                for column in columns:
+                    self._conn.execute(f"CREATE INDEX IF NOT EXISTS {table}_{column} ON {table} ({column})")
+            self._conn.commit()
+            self._conn.close()
+            self._conn = None
+        if self.fmt == 'parquet':
+            for writer in self._writers.values():
+                writer.close()
+        for csv_file in self._files:
+            csv_file.close()
+        self._writers = {}
+        self._files = []
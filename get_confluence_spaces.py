@@ -24,11 +24,13 @@ Usage:
 2. Execute the script to retrieve and export space data to a JSON file.
 """
 
-import requests
 from requests.auth import HTTPBasicAuth
 import json
 from dotenv import load_dotenv
 import os
+from confluence_client import ConfluenceClient
+from instrumentation import profile_stage
+from paginator import SPACE_LIMIT, iter_results
 
 # Load the .env file
 load_dotenv()
@@ -38,42 +40,35 @@ confluence_base_url = os.getenv('CONFLUENCE_BASE_URL')
 username = os.getenv('USERNAME')
 api_token = os.getenv('USER_API_TOKEN')
 
-print(api_token)
+client = ConfluenceClient(auth=HTTPBasicAuth(username, api_token))
 
 # Function to get all spaces with pagination
 def get_all_spaces():
     url = f'{confluence_base_url}/rest/api/space'
-    params = {'limit': 50} # Limit the number of spaces per page
-    spaces = []
-    while url:
-        response = requests.get(url, params=params, auth=HTTPBasicAuth(username, api_token))
-        response.raise_for_status()
-        data = response.json()
-        spaces.extend(data['results'])
-        url = data['_links'].get('next')
-    return spaces
+    return list(iter_results(client, url, limit=SPACE_LIMIT))
 
 def main():
     result = []
 
     spaces = get_all_spaces()
-    for space in spaces:
-        space_data = {
-            "space_name": space['name'],
-            "space_id": space['id'],
-            "space_key": space['key'],
-            "space_type": space['type']
+    with profile_stage('write_output'):
+        for space in spaces:
+            space_data = {
+                "space_name": space['name'],
+                "space_id": space['id'],
+                "space_key": space['key'],
+                "space_type": space['type']
+            }
+
+            result.append(space_data)
+
+        output_data = {
+            "total_spaces": len(result),
+            "spaces": result
         }
 
-        result.append(space_data)
-
-    output_data = {
-        "total_spaces": len(result),
-        "spaces": result
-    }
-
-    with open("File Examples/confluence_spaces.json", "w") as json_file:
-        json.dump(output_data, json_file, indent=4)
+        with open("File Examples/confluence_spaces.json", "w") as json_file:
+            json.dump(output_data, json_file, indent=4)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,164 @@
+"""
+This module provides request batching for the Confluence GraphQL endpoint (`/cgraphql`).
+Instead of sending one query per page, N lookups of the same field are packed into a single
+GraphQL document where every lookup gets its own alias and variable:
+
+    query ContentWatchersBatch($first: Int, $k0: ID!, $k1: ID!) {
+        k0: contentWatchers(contentId: $k0, first: $first) { ... }
+        k1: contentWatchers(contentId: $k1, first: $first) { ... }
+    }
+
+Connections are followed to the end: after the first round, every lookup whose `pageInfo`
+reports `hasNextPage` is queried again with its own `after` cursor, and those follow-up lookups
+for many pages are packed into the same batched documents. Each round therefore costs a few
+requests for the whole set of pages rather than one request per page per extra page of results.
+
+The document text depends only on the field, the batch size and whether cursors are passed, so
+it is built once and reused. The batch size tunes itself: it grows while batches succeed quickly and is halved
+when a batch fails or is slow. A failed batch is split in half and retried until the failing
+lookup is isolated, so one bad page never fails its neighbours. A BatchSizer can be shared by
+lookups running on several threads.
+
+Classes:
+- BatchError: Raised by a batch sender when the whole batch failed.
+- BatchSizer: Adaptive batch size, safe to share between threads.
+
+Functions:
+- build_batch_query(operation_name, field, argument, argument_type, selection, fragments, size):
+  Returns the aliased GraphQL document for a batch of `size` lookups.
+- batch_alias(position): Returns the alias (and variable name) used for a lookup in a batch.
+- cursor_variable(position): Returns the name of the `after` cursor variable of a lookup in a batch.
+- execute_batched(keys, send_batch, sizer, on_error): Runs lookups in batches, yielding (key, result).
+- execute_paginated(keys, send_batch, sizer, on_error, get_connection): Runs batched lookups and
+  follows every connection's cursor until all pages are fetched, yielding (key, merged result).
+"""
+
+import threading
+import time
+from collections import deque
+from functools import lru_cache
+
+DEFAULT_BATCH_SIZE = 25
+MAX_BATCH_SIZE = 100
+SLOW_BATCH_SECONDS = 10.0
+
+
+# Raised by a batch sender when the whole batch failed
+class BatchError(Exception):
+    def __init__(self, message, status_code=None, errors=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.errors = errors
+
+
+# Function to get the alias (and variable name) used for a lookup in a batch
+def batch_alias(position):
+    return f"k{position}"
+
+
+# Function to get the name of the after cursor variable of a lookup in a batch
+def cursor_variable(position):
+    return f"a{position}"
+
+
+# Function to build the aliased GraphQL document for a batch of lookups
+@lru_cache(maxsize=None)
+def build_batch_query(operation_name, field, argument, argument_type, selection, fragments, size, with_cursor=False):
+    variables = ["$first: Int"]
+    lookups = []
+    for position in range(size):
+        alias = batch_alias(position)
+        variables.append(f"${alias}: {argument_type}")
+        arguments = f"{argument}: ${alias}, first: $first"
+        if with_cursor:
+            variables.append(f"${cursor_variable(position)}: String")
+            arguments += f", after: ${cursor_variable(position)}"
+        lookups.append(f"{alias}: {field}({arguments}) {{ {selection} }}")
+    return f"query {operation_name}({', '.join(variables)}) {{ {' '.join(lookups)} }} {fragments}"
+
+
+# Adaptive batch size: grows while batches succeed quickly, halves on failures and slow batches
+class BatchSizer:
+    def __init__(self, initial=DEFAULT_BATCH_SIZE, maximum=MAX_BATCH_SIZE, minimum=1, slow_seconds=SLOW_BATCH_SECONDS):
+        self.size = initial
+        self.maximum = maximum
+        self.minimum = minimum
+        self.slow_seconds = slow_seconds
+        # Batches of the fetch pool's worker threads report to the same sizer
+        self._lock = threading.Lock()
+
+    def on_success(self, elapsed):
+        with self._lock:
+            if elapsed > self.slow_seconds:
+                self.size = max(self.minimum, self.size // 2)
+            else:
+                self.size = min(self.maximum, self.size + max(1, self.size // 4))
+
+    def on_failure(self):
+        with self._lock:
+            self.size = max(self.minimum, self.size // 2)
+
+
+# Function to run lookups in batches, splitting failed batches until the failing key is isolated
+def execute_batched(keys, send_batch, sizer, on_error):
+    keys = list(keys)
+    retry = deque()
+    position = 0
+    while position < len(keys) or retry:
+        if retry:
+            chunk = retry.popleft()
+        else:
+            chunk = keys[position:position + sizer.size]
+            position += len(chunk)
+
+        start = time.perf_counter()
+        error = None
+        try:
+            results = send_batch(chunk)
+        except BatchError as e:
+            results = {}
+            error = e
+        failed = [key for key in chunk if key not in results]
+
+        if failed:
+            sizer.on_failure()
+        else:
+            sizer.on_success(time.perf_counter() - start)
+
+        for key in chunk:
+            if key in results:
+                yield key, results[key]
+
+        if len(chunk) == 1 and failed:
+            yield failed[0], on_error(failed[0], error or BatchError("No result returned"))
+        elif len(failed) == 1:
+            retry.appendleft(failed)
+        elif failed:
+            middle = len(failed) // 2
+            retry.appendleft(failed[middle:])
+            retry.appendleft(failed[:middle])
+
+
+# Function to run batched lookups and follow every connection's cursor until all pages are fetched
+def execute_paginated(keys, send_batch, sizer, on_error, get_connection):
+    results = {}
+    pending = [(key, None) for key in keys]
+    while pending:
+        next_round = []
+        for (key, after), result in execute_batched(pending, send_batch, sizer, on_error):
+            connection = get_connection(result)
+            if after is None:
+                results[key] = result
+            elif connection is not None:
+                merged = get_connection(results[key])
+                merged['nodes'].extend(connection.get('nodes') or [])
+                merged['pageInfo'] = connection.get('pageInfo')
+
+            page_info = (connection or {}).get('pageInfo') or {}
+            cursor = page_info.get('endCursor')
+            if page_info.get('hasNextPage') and cursor and cursor != after and connection.get('nodes'):
+                next_round.append((key, cursor))
+        pending = next_round
+
+    for key in keys:
+        yield key, results[key]
@@ -0,0 +1,325 @@
+"""
+This module provides request instrumentation and stage profiling for the Confluence scripts.
+Every API call made through ConfluenceClient is reported to the client's observers. The
+`Instrumentation` observer rolls the calls up per endpoint template (IDs and keys replaced by
+placeholders, e.g. `/rest/api/content/{id}/restriction`) and records:
+- the number of calls per HTTP status,
+- a latency histogram (time spent in HTTP exchanges, retries included),
+- response bytes, retries and time spent waiting because of throttling (rate limiter, Retry-After),
+- responses served from the response cache.
+
+Scripts also mark their local processing stages (assembling records, writing JSON, counting)
+with `profile_stage(name)`. The wall time of every stage is added to the report, which shows
+whether a slow run was caused by API latency, by throttling or by local processing. Optionally the
+stages are profiled with cProfile or pyinstrument.
+
+Configuration (environment variables, all optional; nothing is recorded unless one is set):
+- CONFLUENCE_METRICS: Path of the JSON metrics report written when the script exits.
+- CONFLUENCE_METRICS_PROMETHEUS: Path of the same metrics in Prometheus text format.
+- CONFLUENCE_PROFILE: `cprofile` or `pyinstrument` to profile the local processing stages.
+- CONFLUENCE_PROFILE_DIR: Directory for the profiles (default: current directory).
+
+Classes:
+- RequestEvent: One API call as reported by ConfluenceClient.
+- Histogram: Fixed-bucket latency histogram.
+- Instrumentation: Per-endpoint metrics, stage timings and profiles.
+
+Functions:
+- endpoint_template(url): Returns the endpoint template of a URL.
+- default_instrumentation(): Returns the instrumentation configured by the environment, or None.
+- profile_stage(name): Context manager that times (and optionally profiles) a local processing stage.
+
+Usage:
+    CONFLUENCE_METRICS="File Examples/metrics.json" python space_permissions_and_page_restrictions.py
+"""
+
+import atexit
+import cProfile
+import io
+import json
+import os
+import pstats
+import re
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+from urllib.parse import parse_qs, urlparse
+
+try:
+    import pyinstrument
+except ImportError:
+    pyinstrument = None
+
+# One API call as reported by ConfluenceClient; status is None when the call raised
+RequestEvent = namedtuple('RequestEvent', 'method url status latency bytes retries throttle_wait cached throttled',
+                          defaults=(0,))
+
+# Upper bounds of the latency histogram buckets in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Path segments replaced by placeholders in endpoint templates
+TEMPLATE_RULES = (
+    (re.compile(r'/rest/api/space/[^/]+(?=/)'), '/rest/api/space/{key}'),
+    (re.compile(r'/api/v2/spaces/[^/]+(?=/)'), '/api/v2/spaces/{id}'),
+    (re.compile(r'/admin/v1/orgs/[^/]+(?=/)'), '/admin/v1/orgs/{org}'),
+    (re.compile(r'/\d+(?=/|$)'), '/{id}'),
+)
+
+_default_instrumentation = None
+_default_lock = threading.Lock()
+
+
+# Function to get the endpoint template of a URL, e.g. /rest/api/content/{id}/restriction
+def endpoint_template(url):
+    parsed = urlparse(url)
+    path = parsed.path
+    for pattern, replacement in TEMPLATE_RULES:
+        path = pattern.sub(replacement, path)
+    path = path.rstrip('/') or '/'
+    # GraphQL calls share one path, so the operation name is part of the template
+    operation = parse_qs(parsed.query).get('q')
+    if operation:
+        path += f"?q={operation[0]}"
+    return path
+
+
+def _is_pyinstrument(profile):
+    return pyinstrument is not None and isinstance(profile, pyinstrument.Profiler)
+
+
+def _start_profile(profile):
+    if _is_pyinstrument(profile):
+        profile.start()
+    else:
+        profile.enable()
+
+
+def _stop_profile(profile):
+    if _is_pyinstrument(profile):
+        profile.stop()
+    else:
+        profile.disable()
+
+
+# Fixed-bucket latency histogram
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        position = 0
+        while position < len(self.buckets) and value > self.buckets[position]:
+            position += 1
+        self.counts[position] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    # Function to estimate a percentile as the upper bound of the bucket it falls in
+    def percentile(self, pct):
+        if not self.count:
+            return 0.0
+        rank = pct / 100 * self.count
+        seen = 0
+        for position, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                return min(self.buckets[position], self.max) if position < len(self.buckets) else self.max
+        return self.max
+
+    def cumulative(self):
+        total = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            yield bound, total
+
+
+# Per-endpoint metrics, stage timings and profiles
+class Instrumentation:
+    def __init__(self, report_path=None, prometheus_path=None, profiler=None, profile_dir='.'):
+        self.report_path = report_path
+        self.prometheus_path = prometheus_path
+        self.profiler = profiler
+        self.profile_dir = profile_dir
+        self._lock = threading.Lock()
+        self._endpoints = {}
+        self._stages = {}
+        self._profiles = {}
+        self._started = time.perf_counter()
+
+    # Function to record one API call (registered as a ConfluenceClient observer)
+    def record(self, event):
+        key = (event.method, endpoint_template(event.url))
+        status = str(event.status) if event.status is not None else 'error'
+        with self._lock:
+            stats = self._endpoints.get(key)
+            if stats is None:
+                stats = {"statuses": {}, "latency": Histogram(), "bytes": 0, "retries": 0,
+                         "throttle_wait": 0.0, "cache_hits": 0}
+                self._endpoints[key] = stats
+            stats["statuses"][status] = stats["statuses"].get(status, 0) + 1
+            stats["bytes"] += event.bytes
+            stats["retries"] += event.retries
+            stats["throttle_wait"] += event.throttle_wait
+            if event.cached:
+                stats["cache_hits"] += 1
+            else:
+                stats["latency"].observe(event.latency)
+
+    # Function to time (and optionally profile) a local processing stage
+    @contextmanager
+    def stage(self, name):
+        profile = self._stage_profile(name) if threading.current_thread() is threading.main_thread() else None
+        if profile is not None:
+            _start_profile(profile)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            if profile is not None:
+                _stop_profile(profile)
+            with self._lock:
+                seconds, calls = self._stages.get(name, (0.0, 0))
+                self._stages[name] = (seconds + elapsed, calls + 1)
+
+    def _stage_profile(self, name):
+        if self.profiler is None:
+            return None
+        profile = self._profiles.get(name)
+        if profile is None:
+            if self.profiler == 'pyinstrument':
+                if pyinstrument is None:
+                    print("Warning: pyinstrument is not installed, falling back to cProfile")
+                    self.profiler = 'cprofile'
+                else:
+                    profile = pyinstrument.Profiler()
+            if profile is None:
+                profile = cProfile.Profile()
+            self._profiles[name] = profile
+        return profile
+
+    # Function to summarize the metrics as a JSON-serializable report
+    def report(self):
+        with self._lock:
+            endpoints = []
+            for (method, template), stats in sorted(self._endpoints.items(), key=lambda item: item[0][1]):
+                latency = stats["latency"]
+                endpoints.append({
+                    "method": method,
+                    "endpoint": template,
+                    "requests": sum(stats["statuses"].values()),
+                    "statuses": dict(stats["statuses"]),
+                    "cache_hits": stats["cache_hits"],
+                    "retries": stats["retries"],
+                    "bytes": stats["bytes"],
+                    "latency_seconds_total": round(latency.sum, 3),
+                    "latency_ms": {
+                        "p50": round(latency.percentile(50) * 1000, 1),
+                        "p95": round(latency.percentile(95) * 1000, 1),
+                        "p99": round(latency.percentile(99) * 1000, 1),
+                        "max": round(latency.max * 1000, 1),
+                    },
+                    "latency_histogram": {
+                        ("+Inf" if bound == float('inf') else str(bound)): count for bound, count in latency.cumulative()
+                    },
+                    "throttle_wait_seconds": round(stats["throttle_wait"], 3),
+                })
+            stages = {name: {"seconds": round(seconds, 3), "calls": calls} for name, (seconds, calls) in self._stages.items()}
+        return {
+            "elapsed_seconds": round(time.perf_counter() - self._started, 3),
+            "latency_seconds_total": round(sum(endpoint["latency_seconds_total"] for endpoint in endpoints), 3),
+            "throttle_wait_seconds_total": round(sum(endpoint["throttle_wait_seconds"] for endpoint in endpoints), 3),
+            "stages": stages,
+            "endpoints": endpoints,
+        }
+
+    # Function to render the metrics in the Prometheus text exposition format
+    def prometheus(self):
+        report = self.report()
+        lines = [
+            "# HELP confluence_requests_total API calls per endpoint and status.",
+            "# TYPE confluence_requests_total counter",
+        ]
+        for endpoint in report["endpoints"]:
+            labels = f'method="{endpoint["method"]}",endpoint="{endpoint["endpoint"]}"'
+            for status, count in endpoint["statuses"].items():
+                lines.append(f'confluence_requests_total{{{labels},status="{status}"}} {count}')
+        for name, key, help_text in (
+            ("confluence_cache_hits_total", "cache_hits", "API calls answered from the response cache."),
+            ("confluence_request_retries_total", "retries", "Retries of API calls."),
+            ("confluence_response_bytes_total", "bytes", "Response body bytes."),
+            ("confluence_throttle_wait_seconds_total", "throttle_wait_seconds", "Seconds spent waiting because of throttling."),
+        ):
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} counter"]
+            for endpoint in report["endpoints"]:
+                lines.append(f'{name}{{method="{endpoint["method"]}",endpoint="{endpoint["endpoint"]}"}} {endpoint[key]}')
+        lines += [
+            "# HELP confluence_request_duration_seconds Latency of API calls.",
+            "# TYPE confluence_request_duration_seconds histogram",
+        ]
+        for endpoint in report["endpoints"]:
+            labels = f'method="{endpoint["method"]}",endpoint="{endpoint["endpoint"]}"'
+            for bound, count in endpoint["latency_histogram"].items():
+                lines.append(f'confluence_request_duration_seconds_bucket{{{labels},le="{bound}"}} {count}')
+            lines.append(f'confluence_request_duration_seconds_sum{{{labels}}} {endpoint["latency_seconds_total"]}')
+            lines.append(f'confluence_request_duration_seconds_count{{{labels}}} {endpoint["latency_histogram"]["+Inf"]}')
+        lines += [
+            "# HELP confluence_stage_seconds_total Wall time of local processing stages.",
+            "# TYPE confluence_stage_seconds_total counter",
+        ]
+        for name, stage in report["stages"].items():
+            lines.append(f'confluence_stage_seconds_total{{stage="{name}"}} {stage["seconds"]}')
+        return "\n".join(lines) + "\n"
+
+    # Function to write the configured report files and profiles
+    def write(self):
+        if self.report_path:
+            with open(self.report_path, 'w') as report_file:
+                json.dump(self.report(), report_file, indent=4)
+            print(f"Request metrics saved to '{self.report_path}'")
+        if self.prometheus_path:
+            with open(self.prometheus_path, 'w') as prometheus_file:
+                prometheus_file.write(self.prometheus())
+        for name, profile in self._profiles.items():
+            path = os.path.join(self.profile_dir, f"profile_{name}")
+            if _is_pyinstrument(profile):
+                with open(path + '.html', 'w') as profile_file:
+                    profile_file.write(profile.output_html())
+            else:
+                profile.dump_stats(path + '.prof')
+                summary = io.StringIO()
+                pstats.Stats(profile, stream=summary).sort_stats('cumulative').print_stats(10)
+                print(f"Profile of stage '{name}' saved to '{path}.prof'\n{summary.getvalue()}")
+
+
+# Function to get the instrumentation configured by the environment (shared by all clients), or None
+def default_instrumentation():
+    global _default_instrumentation
+    report_path = os.getenv('CONFLUENCE_METRICS')
+    prometheus_path = os.getenv('CONFLUENCE_METRICS_PROMETHEUS')
+    profiler = (os.getenv('CONFLUENCE_PROFILE') or '').lower() or None
+    if not (report_path or prometheus_path or profiler):
+        return None
+    with _default_lock:
+        if _default_instrumentation is None:
+            _default_instrumentation = Instrumentation(report_path, prometheus_path, profiler,
+                                                       os.getenv('CONFLUENCE_PROFILE_DIR', '.'))
+            atexit.register(_default_instrumentation.write)
+        return _default_instrumentation
+
+
+# Function to time (and optionally profile) a local processing stage of a script
+@contextmanager
+def profile_stage(name):
+    instrumentation = default_instrumentation()
+    if instrumentation is None:
+        yield
+        return
+    with instrumentation.stage(name):
+        yield
@@ -0,0 +1,60 @@
+"""
+This module provides the JSON codec used to decode API responses and to encode exports and stored records.
+When `orjson` is installed it is used for decoding and for compact or 2-space indented encoding,
+which is several times faster than the standard library on large responses and records. Without
+it (or with `CONFLUENCE_JSON_CODEC=json`), the standard `json` module is used. Other indentations
+are always encoded by the standard library, so the output layout does not depend on the codec.
+Both codecs write non-ASCII characters as UTF-8 rather than escaping them, so the encoded text
+should be written to files opened with `encoding='utf-8'` (or encoded to UTF-8 bytes).
+
+Compact output has no whitespace between items (`{"a":1,"b":[1,2]}`).
+
+Environment variables:
+- CONFLUENCE_JSON_CODEC: `auto` (default, orjson when installed) or `json` (standard library only).
+
+Functions:
+- loads(data): Decodes JSON from bytes or str.
+- dumps(value, indent, sort_keys): Encodes a value as a JSON string, compact unless indent is given.
+- response_json(response): Decodes the body of an HTTP response.
+
+Usage:
+    data = response_json(client.get(url))
+    text = dumps(record)
+"""
+
+import json
+import os
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Name of the codec in use: 'orjson' or 'json'
+CODEC = 'orjson' if orjson is not None and os.getenv('CONFLUENCE_JSON_CODEC', 'auto').lower() != 'json' else 'json'
+
+
+# Function to decode JSON from bytes or str
+def loads(data):
+    if CODEC == 'orjson':
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+# Function to encode a value as a JSON string, compact unless an indentation is given
+def dumps(value, indent=None, sort_keys=False):
+    if CODEC == 'orjson' and indent in (None, 2):
+        option = orjson.OPT_NON_STR_KEYS
+        if indent == 2:
+            option |= orjson.OPT_INDENT_2
+        if sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        return orjson.dumps(value, option=option).decode()
+    if indent is None:
+        return json.dumps(value, separators=(',', ':'), sort_keys=sort_keys, ensure_ascii=False)
+    return json.dumps(value, indent=indent, sort_keys=sort_keys, ensure_ascii=False)
+
+
+# Function to decode the body of an HTTP response
+def response_json(response):
+    return loads(response.content)
@@ -0,0 +1,214 @@
+"""
+This module provides streaming JSON writers for the Confluence export scripts.
+Records are written to disk as soon as they are finished instead of being collected into one
+large Python list and dumped at the end, so memory use stays flat regardless of tenant size
+and a crash part way through a crawl keeps everything written so far.
+
+Two output formats are supported:
+- json: An incremental JSON writer that produces exactly the same file as
+  `json.dump(..., indent=indent)` would for the full result. It is compact (no whitespace) by
+  default; `indent=4` gives the indented layout of the original scripts.
+- jsonl: JSON Lines, one compact record per line. Every line is valid on its own, so the file
+  remains usable even if the run is interrupted.
+
+Records are encoded with the codec of json_codec.py (orjson when installed). Files are UTF-8.
+`iter_records()` reads either format back one record at a time, without loading the whole file.
+
+Classes:
+- JsonArrayWriter: Writes a JSON array one item at a time.
+- JsonLinesWriter: Writes one JSON record per line.
+- JsonObjectWriter: Writes a JSON object one field at a time, with optional streamed array fields.
+
+Functions:
+- output_path(path, output_format): Returns the output file name for the chosen format.
+- open_record_writer(path, output_format, indent): Opens a JsonArrayWriter or JsonLinesWriter.
+- iter_records(path): Yields the records of a JSON array or JSON Lines file one at a time.
+
+Usage:
+    with open_record_writer("File Examples/data.json", "json") as writer:
+        for record in records:
+            writer.write(record)
+"""
+
+import json
+import os
+
+from json_codec import dumps, loads
+
+OUTPUT_FORMATS = ('json', 'jsonl')
+# Characters read at a time when streaming a JSON array
+READ_CHUNK = 1 << 20
+
+
+# Function to indent every line after the first by the given prefix
+def _indent_continuation(text, prefix):
+    return text.replace('\n', '\n' + prefix)
+
+
+# Function to get the output file name for the chosen format
+def output_path(path, output_format):
+    if output_format == 'jsonl':
+        return os.path.splitext(path)[0] + '.jsonl'
+    return path
+
+
+# Writes a JSON array one item at a time, formatted like json.dump(indent=indent), or compact without indent
+class JsonArrayWriter:
+    def __init__(self, path=None, indent=4, fp=None, level=0):
+        self._owns_file = fp is None
+        self._fp = open(path, 'w', encoding='utf-8') if fp is None else fp
+        self._indent = indent
+        self._prefix = ' ' * (indent * level) if indent is not None else ''
+        self._item_prefix = self._prefix + (' ' * indent if indent is not None else '')
+        self.count = 0
+        self._closed = False
+        self._fp.write('[')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    def write(self, item):
+        separator = ',' if self.count else ''
+        if self._indent is None:
+            self._fp.write(f"{separator}{dumps(item)}")
+        else:
+            text = dumps(item, indent=self._indent)
+            self._fp.write(f"{separator}\n{self._item_prefix}{_indent_continuation(text, self._item_prefix)}")
+        self.count += 1
+        self._fp.flush()
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        if self.count and self._indent is not None:
+            self._fp.write(f"\n{self._prefix}")
+        self._fp.write(']')
+        if self._owns_file:
+            self._fp.close()
+        else:
+            self._fp.flush()
+
+
+# Writes one compact JSON record per line
+class JsonLinesWriter:
+    def __init__(self, path, mode='w'):
+        self._fp = open(path, mode, encoding='utf-8')
+        self.count = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    def write(self, item):
+        self._fp.write(dumps(item) + '\n')
+        self._fp.flush()
+        self.count += 1
+
+    def close(self):
+        self._fp.close()
+
+
+# Writes a JSON object one field at a time, formatted like json.dump(indent=indent), or compact without indent
+class JsonObjectWriter:
+    def __init__(self, path, indent=4):
+        self._fp = open(path, 'w', encoding='utf-8')
+        self._indent = indent
+        self._prefix = ' ' * indent if indent is not None else ''
+        self._fields = 0
+        self._fp.write('{')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    # Function to write the key of the next field
+    def _write_key(self, key):
+        separator = ',' if self._fields else ''
+        if self._indent is None:
+            self._fp.write(f"{separator}{dumps(key)}:")
+        else:
+            self._fp.write(f"{separator}\n{self._prefix}{dumps(key)}: ")
+        self._fields += 1
+
+    def write_field(self, key, value):
+        self._write_key(key)
+        text = dumps(value, indent=self._indent)
+        self._fp.write(_indent_continuation(text, self._prefix) if self._indent is not None else text)
+
+    # Function to start a field whose array value is streamed item by item
+    def array_field(self, key):
+        self._write_key(key)
+        return JsonArrayWriter(fp=self._fp, indent=self._indent, level=1)
+
+    def close(self):
+        if self._fields and self._indent is not None:
+            self._fp.write('\n')
+        self._fp.write('}')
+        self._fp.close()
+
+
+# Function to open a record writer for the chosen output format
+def open_record_writer(path, output_format='json', indent=None):
+    if output_format == 'jsonl':
+        return JsonLinesWriter(output_path(path, output_format))
+    return JsonArrayWriter(path, indent=indent)
+
+
+# Function to yield the items of a JSON array file one at a time, reading it in chunks
+def _iter_array_items(path, chunk_size=READ_CHUNK):
+    decoder = json.JSONDecoder()
+    with open(path, encoding='utf-8') as fp:
+        buffer = ''
+        while not buffer.strip():
+            chunk = fp.read(chunk_size)
+            if not chunk:
+                break
+            buffer += chunk
+        buffer = buffer.lstrip()
+        if not buffer.startswith('['):
+            raise ValueError(f"'{path}' is not a JSON array")
+        position = 1
+        eof = False
+        while True:
+            # Skip the whitespace and the separator before the next item
+            while position < len(buffer) and buffer[position] in ' \t\r\n,':
+                position += 1
+            if position < len(buffer) and buffer[position] == ']':
+                return
+            try:
+                if position == len(buffer):
+                    raise json.JSONDecodeError("Unexpected end of buffer", buffer, position)
+                item, position = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                # The item is cut off by the end of the buffer; read at least as much again as is buffered,
+                # so an item much larger than a chunk is not decoded over and over
+                chunk = fp.read(max(chunk_size, len(buffer) - position))
+                eof = not chunk
+                buffer = buffer[position:] + chunk
+                position = 0
+                continue
+            yield item
+
+
+# Function to yield the records of a JSON array (.json) or JSON Lines (.jsonl) file one at a time
+def iter_records(path):
+    if path.endswith('.jsonl'):
+        with open(path, 'rb') as records_file:
+            for line in records_file:
+                if line.strip():
+                    yield loads(line)
+        return
+    yield from _iter_array_items(path)
@@ -0,0 +1,397 @@
+"""
+This module provides a local mock of the Confluence Cloud and Atlassian admin APIs used by the
+scripts in this repository, serving a synthetic tenant. It is used by benchmark.py to measure the
+scripts without a live tenant, and can be started on its own for manual runs.
+
+Served endpoints:
+- GET /rest/api/space: Space listing.
+- GET /rest/api/space/{key}/content/page: Page listing of a space.
+- GET /rest/api/content?spaceKey={key}: Content listing of a space.
+- GET /rest/api/content/search?cql=...: CQL search for `space = "KEY"` or `id in (...)`, with expanded restrictions.
+- GET and DELETE /rest/api/content/{id}/restriction/: Page restrictions.
+- GET /api/v2/spaces/{key}/permission: Space permissions.
+- POST /cgraphql: Space and page watchers, including aliased batch queries and `after` cursors.
+- GET /admin/v1/orgs/{org}/users: Managed accounts of the organization.
+- GET /_mock/stats: Number of requests served (and throttled) per endpoint.
+
+The tenant size, the latency per request, the share of requests answered with 429 and the
+largest page size of the listings are configurable. The data is generated from the space and page
+numbers, so every run against the same settings sees the same tenant.
+
+Classes:
+- MockTenant: Synthetic tenant data and request statistics.
+- MockHandler: HTTP handler serving the mock endpoints.
+
+Functions:
+- start_server(tenant, port): Starts the mock server on a background thread and returns it.
+
+Usage:
+    python mock_confluence.py --port 8765 --spaces 50 --pages 200 --latency 0.02
+    # then point the scripts at it:
+    CONFLUENCE_BASE_URL=http://127.0.0.1:8765 CONFLUENCE_GRAPHQL_URL=http://127.0.0.1:8765/cgraphql \\
+        ATLASSIAN_ADMIN_URL=http://127.0.0.1:8765 python get_confluence_spaces.py
+"""
+
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlparse
+
+# Matches one (possibly aliased) watcher lookup of a GraphQL document
+WATCHERS_LOOKUP = re.compile(
+    r'(?:(\w+): )?(contentWatchers|spaceWatchers)\(\s*(?:contentId|spaceKey): \$(\w+)'
+    r'(?:, first: \$first)?(?:, after: \$(\w+))?'
+)
+
+
+# Matches the space and page ID clauses of the CQL queries sent by content_search.py
+CQL_SPACE = re.compile(r'space\s*=\s*"?([\w-]+)"?')
+CQL_IDS = re.compile(r'id\s+in\s*\(([^)]*)\)')
+
+
+# Synthetic tenant data and request statistics
+class MockTenant:
+    def __init__(self, spaces=20, pages=100, users=1000, max_watchers=40, latency=0.01,
+                 latency_per_item=0.001, throttle_rate=0.0, retry_after=1, max_limit=250,
+                 total_size=False, seed=0):
+        self.spaces = spaces
+        self.pages = pages
+        self.users = users
+        self.max_watchers = max_watchers
+        self.latency = latency
+        self.latency_per_item = latency_per_item
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.max_limit = max_limit
+        self.total_size = total_size
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.requests = {}
+        self.throttled = 0
+
+    # Function to count a request and decide whether it is throttled
+    def record(self, endpoint):
+        with self._lock:
+            self.requests[endpoint] = self.requests.get(endpoint, 0) + 1
+            if self.throttle_rate and self._random.random() < self.throttle_rate:
+                self.throttled += 1
+                return True
+        return False
+
+    def stats(self):
+        with self._lock:
+            return {"requests": sum(self.requests.values()), "throttled": self.throttled,
+                    "endpoints": dict(self.requests)}
+
+    def space(self, index):
+        return {
+            "id": 1000 + index,
+            "key": f"SP{index}",
+            "name": f"Space {index}",
+            "type": "personal" if index % 10 == 9 else "global",
+            "status": "current",
+        }
+
+    def space_index(self, key):
+        if key.startswith('SP') and key[2:].isdigit() and int(key[2:]) < self.spaces:
+            return int(key[2:])
+        return None
+
+    def page(self, space_index, position):
+        page_id = (space_index + 1) * 1_000_000 + position
+        return {
+            "id": str(page_id),
+            "type": "page",
+            "status": "current",
+            "title": f"Page {position} of space {space_index}",
+            "version": {"number": 1 + page_id % 3, "when": "2024-01-01T00:00:00.000Z"},
+        }
+
+    def restrictions(self, page_id):
+        users = []
+        groups = []
+        if page_id % 4 == 0:
+            users.append({"type": "known", "accountId": f"account-{page_id % 97}", "displayName": f"User {page_id % 97}"})
+        if page_id % 10 == 0:
+            groups.append({"type": "group", "name": f"group-{page_id % 7}", "id": f"group-id-{page_id % 7}"})
+        result = {}
+        for operation in ('read', 'update'):
+            result[operation] = {
+                "operation": operation,
+                "restrictions": {
+                    "user": {"results": users, "start": 0, "limit": 200, "size": len(users)},
+                    "group": {"results": groups, "start": 0, "limit": 200, "size": len(groups)},
+                },
+            }
+        result["_links"] = {"base": "", "context": ""}
+        return result
+
+    def permissions(self, space_index):
+        return {
+            "results": [
+                {"id": str(space_index * 10 + n), "principal": {"type": principal, "id": f"{principal}-{n}"},
+                 "operation": {"key": operation, "targetType": "space"}}
+                for n, (principal, operation) in enumerate((("user", "read"), ("group", "read"), ("group", "administer")))
+            ],
+            "_links": {},
+        }
+
+    def watchers(self, number, first, after, minimal=False):
+        total = number % (self.max_watchers + 1)
+        start = int(after) if after else 0
+        end = min(total, start + (first or 20))
+        if minimal:
+            # The minimal selection asks for no profile pictures and no __typename
+            nodes = [{"accountId": f"account-{n % 97}", "displayName": f"User {n % 97}", "permissionType": "INTERNAL"}
+                     for n in range(start, end)]
+            return {"count": total, "nodes": nodes,
+                    "pageInfo": {"hasNextPage": end < total, "endCursor": str(end) if nodes else None}}
+        nodes = [
+            {"accountId": f"account-{n % 97}", "__typename": "KnownUser", "displayName": f"User {n % 97}",
+             "permissionType": "INTERNAL", "profilePicture": {"path": f"/avatar/{n % 97}", "__typename": "Icon"}}
+            for n in range(start, end)
+        ]
+        return {"count": total, "nodes": nodes,
+                "pageInfo": {"hasNextPage": end < total, "endCursor": str(end) if nodes else None, "__typename": "PageInfo"},
+                "__typename": "PaginatedPersonList"}
+
+    def account(self, position):
+        last_active = datetime.now(timezone.utc) - timedelta(days=position * 7 % 240)
+        account = {
+            "account_id": f"account-{position}",
+            "account_type": "atlassian",
+            "account_status": "active" if position % 5 else "inactive",
+            "name": f"User {position}",
+            "email": f"user{position}@domain{position % 6}.example",
+            "product_access": [{"key": "confluence", "name": "Confluence"}] if position % 3 else [],
+        }
+        if position % 11:
+            account["last_active"] = last_active.strftime('%Y-%m-%dT%H:%M:%S.000Z')
+        return account
+
+
+# HTTP handler serving the mock endpoints
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are separate writes; with Nagle's algorithm on a keep-alive connection,
+    # the body would wait for the client's delayed ACK (about 40 ms per request)
+    disable_nagle_algorithm = True
+    tenant = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, body, status=200, headers=None):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def send_empty(self, status, headers=None):
+        self.send_response(status)
+        self.send_header('Content-Length', '0')
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+
+    # Function to count the request, apply the latency and answer 429 when the request is throttled
+    def begin(self, endpoint, items=1):
+        throttled = self.tenant.record(endpoint)
+        time.sleep(self.tenant.latency + self.tenant.latency_per_item * max(0, items - 1))
+        if throttled:
+            self.send_json({"message": "Rate limit exceeded"}, status=429,
+                           headers={"Retry-After": str(self.tenant.retry_after)})
+        return not throttled
+
+    # Function to answer one page of an offset-paginated listing
+    def send_listing(self, path, query, items, extra_params=None):
+        start = int(query.get('start', ['0'])[0])
+        limit = min(int(query.get('limit', ['25'])[0]), self.tenant.max_limit)
+        results = items[start:start + limit]
+        links = {"base": f"http://{self.headers.get('Host')}"}
+        if start + limit < len(items):
+            links["next"] = f"{path}?{urlencode({**(extra_params or {}), 'start': start + limit, 'limit': limit})}"
+        body = {"results": results, "start": start, "limit": limit, "size": len(results), "_links": links}
+        if self.tenant.total_size:
+            body["totalSize"] = len(items)
+        self.send_json(body)
+
+    # Function to get the pages matching a CQL search, with the requested expansions
+    def search_results(self, query):
+        tenant = self.tenant
+        cql = query.get('cql', [''])[0]
+        pages = []
+        space_match = CQL_SPACE.search(cql)
+        ids_match = CQL_IDS.search(cql)
+        if space_match:
+            index = tenant.space_index(space_match.group(1))
+            if index is not None:
+                pages = [tenant.page(index, n) for n in range(tenant.pages)]
+        elif ids_match:
+            for page_id in (int(value) for value in ids_match.group(1).split(',') if value.strip().isdigit()):
+                index, position = divmod(page_id, 1_000_000)
+                if 1 <= index <= tenant.spaces and position < tenant.pages:
+                    pages.append(tenant.page(index - 1, position))
+        if 'restrictions' in query.get('expand', [''])[0]:
+            for page in pages:
+                restrictions = tenant.restrictions(int(page['id']))
+                del restrictions['_links']
+                page['restrictions'] = restrictions
+        return pages
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        path = url.path.rstrip('/')
+        tenant = self.tenant
+
+        if path == '/_mock/stats':
+            return self.send_json(tenant.stats())
+
+        if path == '/rest/api/space':
+            if self.begin('space_listing'):
+                self.send_listing(url.path, query, [tenant.space(i) for i in range(tenant.spaces)])
+            return
+
+        match = re.fullmatch(r'/rest/api/space/([^/]+)/content/page', path)
+        if match:
+            if self.begin('page_listing'):
+                index = tenant.space_index(match.group(1))
+                if index is None:
+                    return self.send_json({"message": "Space not found"}, status=404)
+                params = {key: values[0] for key, values in query.items() if key not in ('start', 'limit')}
+                self.send_listing(url.path, query, [tenant.page(index, n) for n in range(tenant.pages)], params)
+            return
+
+        if path == '/rest/api/content':
+            if self.begin('content_listing'):
+                index = tenant.space_index(query.get('spaceKey', [''])[0])
+                pages = [tenant.page(index, n) for n in range(tenant.pages)] if index is not None else []
+                params = {key: values[0] for key, values in query.items() if key not in ('start', 'limit')}
+                self.send_listing(url.path, query, pages, params)
+            return
+
+        if path == '/rest/api/content/search':
+            if self.begin('content_search'):
+                self.send_listing(url.path, query, self.search_results(query),
+                                  {key: values[0] for key, values in query.items() if key not in ('start', 'limit')})
+            return
+
+        match = re.fullmatch(r'/rest/api/content/(\d+)/restriction', path)
+        if match:
+            if self.begin('restrictions'):
+                self.send_json(tenant.restrictions(int(match.group(1))))
+            return
+
+        match = re.fullmatch(r'/api/v2/spaces/([^/]+)/permission', path)
+        if match:
+            if self.begin('permissions'):
+                index = tenant.space_index(match.group(1))
+                if index is None:
+                    return self.send_json({"message": "Space not found"}, status=404)
+                self.send_json(tenant.permissions(index))
+            return
+
+        if re.fullmatch(r'/admin/v1/orgs/[^/]+/users', path):
+            if self.begin('org_users'):
+                cursor = int(query.get('cursor', ['0'])[0])
+                limit = min(100, tenant.max_limit)
+                data = [tenant.account(n) for n in range(cursor, min(tenant.users, cursor + limit))]
+                links = {}
+                if cursor + limit < tenant.users:
+                    links["next"] = f"http://{self.headers.get('Host')}{url.path}?cursor={cursor + limit}"
+                self.send_json({"data": data, "links": links})
+            return
+
+        self.begin('unknown')
+        self.send_json({"message": f"No mock for {url.path}"}, status=404)
+
+    def do_DELETE(self):
+        if re.fullmatch(r'/rest/api/content/(\d+)/restriction', urlparse(self.path).path.rstrip('/')):
+            if self.begin('remove_restrictions'):
+                self.send_empty(204)
+            return
+        self.begin('unknown')
+        self.send_json({"message": "Not found"}, status=404)
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        if urlparse(self.path).path.rstrip('/') != '/cgraphql':
+            self.begin('unknown')
+            return self.send_json({"message": "Not found"}, status=404)
+
+        variables = body.get('variables') or {}
+        lookups = list(WATCHERS_LOOKUP.finditer(body.get('query', '')))
+        if not self.begin('graphql', items=len(lookups)):
+            return
+        minimal = 'profilePicture' not in body.get('query', '')
+        data = {}
+        for lookup in lookups:
+            alias, field, key_variable, after_variable = lookup.groups()
+            key = variables.get(key_variable)
+            after = variables.get(after_variable) if after_variable else variables.get('after')
+            if field == 'spaceWatchers':
+                index = self.tenant.space_index(str(key))
+                number = index * 13 + 5 if index is not None else 0
+            else:
+                number = int(key)
+            data[alias or field] = self.tenant.watchers(number, variables.get('first'), after, minimal)
+        self.send_json({"data": data})
+
+
+# Function to start the mock server on a background thread and return it (port 0 picks a free port)
+def start_server(tenant, port=0, host='127.0.0.1'):
+    handler = type('TenantHandler', (MockHandler,), {'tenant': tenant})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+# Function to add the tenant options to an argument parser (shared with benchmark.py)
+def add_tenant_arguments(parser):
+    parser.add_argument('--spaces', type=int, default=20, help="Number of spaces (default: 20)")
+    parser.add_argument('--pages', type=int, default=100, help="Pages per space (default: 100)")
+    parser.add_argument('--users', type=int, default=1000, help="Managed accounts in the organization (default: 1000)")
+    parser.add_argument('--max-watchers', type=int, default=40, help="Most watchers per space or page (default: 40)")
+    parser.add_argument('--latency', type=float, default=0.01, help="Seconds added to every request (default: 0.01)")
+    parser.add_argument('--latency-per-item', type=float, default=0.001, help="Extra seconds per additional lookup in a batched GraphQL query (default: 0.001)")
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help="Share of requests answered with 429 (default: 0)")
+    parser.add_argument('--retry-after', type=float, default=1, help="Retry-After seconds sent with a 429 (default: 1)")
+    parser.add_argument('--max-limit', type=int, default=250, help="Largest page size of the listings (default: 250)")
+    parser.add_argument('--total-size', action='store_true', help="Report totalSize in the listings")
+
+
+# Function to build a tenant from the parsed tenant options
+def tenant_from_args(args):
+    return MockTenant(spaces=args.spaces, pages=args.pages, users=args.users, max_watchers=args.max_watchers,
+                      latency=args.latency, latency_per_item=args.latency_per_item,
+                      throttle_rate=args.throttle_rate, retry_after=args.retry_after,
+                      max_limit=args.max_limit, total_size=args.total_size)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve a synthetic Confluence tenant for local runs and benchmarks.")
+    parser.add_argument('--port', type=int, default=8765, help="Port to listen on (default: 8765)")
+    add_tenant_arguments(parser)
+    args = parser.parse_args(argv)
+    server = start_server(tenant_from_args(args), port=args.port)
+    print(f"Mock Confluence listening on http://127.0.0.1:{server.server_address[1]} (Ctrl+C to stop)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+This module provides the shared paginator for Confluence REST listings (spaces, pages, content).
+Listings are always read to the end: the paginator requests the largest allowed `limit` and
+follows `_links.next` until the last page. When a response reports `totalSize`, the offsets of
+all remaining pages are known up front and are fetched in parallel (in order) instead of one
+after another, so full enumerations of very large spaces finish quickly.
+
+Every page is yielded together with the URL of the following page. That URL can be stored as a
+cursor (see checkpoint.py) and passed back in as `cursor` to continue an interrupted listing.
+
+Functions:
+- iter_pages(client, url, params, limit, cursor, parallel): Yields (results, next_url) for every page of a listing.
+- iter_results(client, url, params, limit, parallel): Yields every result of a listing.
+- next_page_url(url, data): Returns the absolute URL of the next page of a listing, or None.
+
+Usage:
+    for space in iter_results(client, f'{confluence_base_url}/rest/api/space', limit=SPACE_LIMIT):
+        ...
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qsl, urlencode, urlparse, urlunparse
+
+from json_codec import response_json
+
+# Largest page sizes accepted by the REST API; smaller pages returned by the server are handled too
+SPACE_LIMIT = 250
+CONTENT_LIMIT = 250
+PARALLEL_PAGES = 4
+
+
+# Function to get the absolute URL of the next page of a listing, or None
+def next_page_url(url, data):
+    links = data.get('_links') or {}
+    next_link = links.get('next')
+    if not next_link:
+        return None
+    if next_link.startswith('http'):
+        return next_link
+    if links.get('base'):
+        return links['base'].rstrip('/') + next_link
+    parsed = urlparse(url)
+    return f"{parsed.scheme}://{parsed.netloc}{next_link}"
+
+
+# Function to build the URL of the page starting at the given offset
+def _offset_url(url, params, start, limit):
+    parsed = urlparse(url)
+    query = dict(parse_qsl(parsed.query))
+    query.update(params or {})
+    query.update({'start': start, 'limit': limit})
+    return urlunparse(parsed._replace(query=urlencode(query)))
+
+
+# Function to get one page of a listing
+def _get_page(client, url, params=None):
+    response = client.get(url, params=params)
+    response.raise_for_status()
+    return response_json(response)
+
+
+# Function to yield (results, next_url) for every page of a listing
+def iter_pages(client, url, params=None, limit=CONTENT_LIMIT, cursor=None, parallel=PARALLEL_PAGES):
+    if cursor:
+        data = _get_page(client, cursor)
+        request_url = cursor
+    else:
+        data = _get_page(client, url, params={**(params or {}), 'limit': limit})
+        request_url = url
+
+    total = data.get('totalSize')
+    page_size = data.get('limit') or len(data.get('results', [])) or limit
+    if total is not None and parallel > 1 and page_size:
+        # The offsets of all remaining pages are known, so fetch them in parallel
+        first_start = data.get('start', 0)
+        offsets = list(range(first_start + page_size, total, page_size))
+        urls = [_offset_url(url, params, offset, page_size) for offset in offsets]
+        yield data.get('results', []), urls[0] if urls else None
+        with ThreadPoolExecutor(max_workers=parallel) as executor:
+            for position, page in enumerate(executor.map(lambda page_url: _get_page(client, page_url), urls)):
+                yield page.get('results', []), urls[position + 1] if position + 1 < len(urls) else None
+        return
+
+    while True:
+        next_url = next_page_url(request_url, data)
+        yield data.get('results', []), next_url
+        if not next_url:
+            return
+        data = _get_page(client, next_url)
+        request_url = next_url
+
+
+# Function to yield every result of a listing
+def iter_results(client, url, params=None, limit=CONTENT_LIMIT, parallel=PARALLEL_PAGES):
+    for results, _ in iter_pages(client, url, params=params, limit=limit, parallel=parallel):
+        yield from results
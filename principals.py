@@ -0,0 +1,198 @@
+"""
+This module provides the interned principal table of the permissions and restrictions and watchers reports.
+The same user or group is named on many pages, and every restriction and watcher lookup returns
+its own copy of the account (accountId, displayName, profile data). With a principal table, every
+user and group is kept once: lookups share one dict per principal while the run goes, and the
+report names each principal by its index in the table, which is written once next to the report.
+
+Principals are keyed by `accountId` for users and watchers and by `id` (or `name`) for groups.
+In the report, the `results` of restricted users and groups and the `nodes` of watcher connections
+then hold table indexes instead of objects, for example `"user": {"results": [0, 17]}`. Principals
+without an ID are left in place. The table is a JSON array next to the report
+(`<report>.principals.json`), where entry N is the principal with index N.
+
+Classes:
+- PrincipalTable: Interns users and groups and references them by table index.
+- PrincipalReferenceWriter: Record writer that references principals by table index and writes the table.
+
+Functions:
+- principals_path(report_path): Returns the principal table file of a report.
+- reference_writer(writer, table, report_path, indent): Wraps a record writer if a table is given.
+- load_principals(report_path): Loads the principal table of a report, or None if it has none.
+- resolve_space(space_data, principals): Replaces the table indexes of a space record by the principals.
+
+Usage:
+    principals = PrincipalTable()
+    restrictions = principals.share_restrictions(restrictions)
+    with reference_writer(open_record_writer(path), principals, path) as writer:
+        writer.write(space_data)
+"""
+
+import os
+import threading
+
+from json_codec import dumps, loads
+
+
+# Function to get the principal table file of a report
+def principals_path(report_path):
+    return os.path.splitext(report_path)[0] + '.principals.json'
+
+
+# Function to get the key a principal is interned under, or None if it has no ID
+def principal_key(kind, principal):
+    if not isinstance(principal, dict):
+        return None
+    value = principal.get('accountId') if kind == 'user' else principal.get('id') or principal.get('name')
+    return None if value is None else (kind, value)
+
+
+# Function to map every restricted user and group of a restrictions response, keyed by operation or as a result list
+def map_restrictions(restrictions, fn):
+    if not isinstance(restrictions, dict):
+        return restrictions
+
+    def map_entry(entry):
+        if not isinstance(entry, dict) or not isinstance(entry.get('restrictions'), dict):
+            return entry
+        subjects = dict(entry['restrictions'])
+        for kind in ('user', 'group'):
+            listing = subjects.get(kind)
+            if isinstance(listing, dict) and isinstance(listing.get('results'), list):
+                subjects[kind] = {**listing, 'results': [fn(kind, subject) for subject in listing['results']]}
+        return {**entry, 'restrictions': subjects}
+
+    if isinstance(restrictions.get('results'), list):
+        return {**restrictions, 'results': [map_entry(entry) for entry in restrictions['results']]}
+    return {key: value if key.startswith('_') else map_entry(value) for key, value in restrictions.items()}
+
+
+# Function to map every watcher of a watchers lookup result
+def map_watchers(watchers, fn):
+    if not isinstance(watchers, dict) or not isinstance(watchers.get('data'), dict):
+        return watchers
+    data = {}
+    for field, connection in watchers['data'].items():
+        if isinstance(connection, dict) and isinstance(connection.get('nodes'), list):
+            connection = {**connection, 'nodes': [fn('user', node) for node in connection['nodes']]}
+        data[field] = connection
+    return {**watchers, 'data': data}
+
+
+# Function to map every principal of a space record (restrictions and watchers of the space and its pages)
+def map_space(space_data, fn):
+    record = dict(space_data)
+    if "space_watchers" in record:
+        record["space_watchers"] = map_watchers(record["space_watchers"], fn)
+    if isinstance(record.get("space_pages"), list):
+        pages = []
+        for page in record["space_pages"]:
+            page = dict(page)
+            if "page_restrictions" in page:
+                page["page_restrictions"] = map_restrictions(page["page_restrictions"], fn)
+            if "page_watchers" in page:
+                page["page_watchers"] = map_watchers(page["page_watchers"], fn)
+            pages.append(page)
+        record["space_pages"] = pages
+    return record
+
+
+# Interns users and groups and references them by their index in the table
+class PrincipalTable:
+    def __init__(self):
+        # Principals in index order; indexes are given out as records are written, so the table follows the report
+        self.principals = []
+        self._indexes = {}
+        self._copies = {}
+        self._lock = threading.Lock()
+
+    # Function to get the shared copy of a principal, keeping the first copy seen
+    def _shared(self, kind, principal):
+        key = principal_key(kind, principal)
+        if key is None:
+            return principal
+        with self._lock:
+            return self._copies.setdefault(key, principal)
+
+    # Function to get the table index of a principal, adding it on first sight (the principal itself if it has no ID)
+    def _reference(self, kind, principal):
+        key = principal_key(kind, principal)
+        if key is None:
+            return principal
+        with self._lock:
+            index = self._indexes.get(key)
+            if index is None:
+                index = self._indexes[key] = len(self.principals)
+                self.principals.append(self._copies.get(key, principal))
+            return index
+
+    # Function to replace the users and groups of a restrictions response by their shared copies
+    def share_restrictions(self, restrictions):
+        return map_restrictions(restrictions, self._shared)
+
+    # Function to replace the watchers of a watchers lookup result by their shared copies
+    def share_watchers(self, watchers):
+        return map_watchers(watchers, self._shared)
+
+    # Function to get a copy of a space record with its principals replaced by table indexes
+    def reference_space(self, space_data):
+        return map_space(space_data, self._reference)
+
+    def write(self, path, indent=None):
+        with open(path, 'w', encoding='utf-8') as table_file:
+            table_file.write(dumps(self.principals, indent=indent))
+
+    def print_summary(self, path):
+        print(f"Principal table: {len(self.principals)} users and groups written to '{path}'")
+
+
+# Writes space records with their principals replaced by table indexes, and the table when it is closed
+class PrincipalReferenceWriter:
+    def __init__(self, writer, table, path, indent=None):
+        self._writer = writer
+        self.table = table
+        self.path = path
+        self._indent = indent
+        self._closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    @property
+    def count(self):
+        return self._writer.count
+
+    def write(self, space_data):
+        self._writer.write(self.table.reference_space(space_data))
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._writer.close()
+        self.table.write(self.path, self._indent)
+
+
+# Function to wrap a record writer so it references principals by table index, if a table is given
+def reference_writer(writer, table, report_path, indent=None):
+    if table is None:
+        return writer
+    return PrincipalReferenceWriter(writer, table, principals_path(report_path), indent)
+
+
+# Function to load the principal table of a report, or None if the report has none
+def load_principals(report_path):
+    path = principals_path(report_path)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'rb') as table_file:
+        return loads(table_file.read())
+
+
+# Function to replace the table indexes of a space record by the principals they reference
+def resolve_space(space_data, principals):
+    return map_space(space_data, lambda kind, value: principals[value] if isinstance(value, int) else value)
@@ -0,0 +1,65 @@
+"""
+This module provides the field projections that keep only the fields the reports use.
+The REST API returns full content, user and permission objects (with links, expandable markers
+and profile pictures) and the v1 endpoints have no parameter to select fields, so records are
+trimmed after decoding, before they are kept in memory, checkpointed or written.
+
+Two projections are supported:
+- full: API responses are exported as they are (the default).
+- minimal: Restrictions keep the operation and the accountId/displayName of users and the
+  name/id of groups; space permissions keep the principal and operation. The watcher lookups use
+  a minimal GraphQL selection (see spaces_and_pages_watchers.py).
+
+Page listings are always reduced to the fields the scripts read (id, title and version), since
+they are never exported as they are.
+
+Functions:
+- project_page(page): Keeps the id, title and version of a listed page.
+- project_restrictions(restrictions, projection): Trims a page restrictions response.
+- project_permissions(permissions, projection): Trims a space permissions response.
+
+Usage:
+    page_data["page_restrictions"] = project_restrictions(restrictions, 'minimal')
+"""
+
+from flat_export import iter_operation_restrictions
+
+PROJECTIONS = ('full', 'minimal')
+
+
+# Function to keep the id, title and version (number and time) of a listed page
+def project_page(page):
+    projected = {'id': page['id'], 'title': page.get('title')}
+    version = page.get('version')
+    if version:
+        projected['version'] = {'number': version.get('number'), 'when': version.get('when')}
+    return projected
+
+
+# Function to trim a page restrictions response to the restricted users and groups per operation
+def project_restrictions(restrictions, projection='full'):
+    if projection == 'full' or not isinstance(restrictions, dict):
+        return restrictions
+    trimmed = {}
+    for operation, subjects in iter_operation_restrictions(restrictions):
+        users = (subjects.get('user') or {}).get('results') or []
+        groups = (subjects.get('group') or {}).get('results') or []
+        trimmed[operation] = {
+            "operation": operation,
+            "restrictions": {
+                "user": {"results": [{"accountId": user.get('accountId'), "displayName": user.get('displayName')}
+                                     for user in users]},
+                "group": {"results": [{"name": group.get('name'), "id": group.get('id')} for group in groups]},
+            },
+        }
+    return trimmed
+
+
+# Function to trim a space permissions response to the principal and operation of every permission
+def project_permissions(permissions, projection='full'):
+    if projection == 'full' or not isinstance(permissions, dict):
+        return permissions
+    return {"results": [
+        {"principal": permission.get('principal'), "operation": permission.get('operation')}
+        for permission in permissions.get('results', [])
+    ]}
@@ -3,32 +3,61 @@ This script is designed to interact with Confluence Cloud's REST API to remove a
 The EMA team can use this script to clean up restrictions in a phased approach.
 
 The script performs the following tasks:
-1. Retrieves all pages within the specified Confluence space.
-2. Iterates through each page and removes any restrictions.
+1. Retrieves all pages within the specified Confluence spaces, or reads a list of page IDs from a file.
+2. Removes the restrictions of every page on a pool of concurrent workers, capped to a maximum request rate.
+3. Records the outcome for every page (success or failure, with the error) in a JSON Lines audit log.
+
+Transient errors are retried by the client (see confluence_client.py); a page that still fails is
+recorded as failed and never stops the rest of the run. A space whose listing fails is recorded as a
+failed entry too, and every page already submitted is still written to the audit log.
+With `--dry-run` no restrictions are removed: the current restrictions of every page are fetched
+and the audit log lists the pages that would change and which users and groups would lose their restrictions.
+
+With `--search`, the pages are read with a CQL content search that expands their restrictions
+(see content_search.py). Pages without restrictions are then recorded as unchanged without any
+request, only restricted pages are cleaned up, and a dry run needs no request per page at all.
 
 To use this script:
-1. Replace the placeholder values for `confluence_base_url`, `username`, `api_token`, and `space_key` with your Confluence Cloud instance details and the target space key.
-2. Ensure you have the `requests` library installed (`pip install requests`).
-3. Run the script.
+1. Ensure you have the `requests` library installed (`pip install requests`).
+2. Run the script with the spaces or pages to clean up, for example:
+   python remove_page_restrictions.py --space ABC --space DEF --dry-run
+   python remove_page_restrictions.py --page-ids pages.txt --workers 8 --rate 5
+   python remove_page_restrictions.py --space ABC --search
+   Without `--space` or `--page-ids`, the `space_key` defined in this script is used.
 
 Dependencies:
 - requests: To handle HTTP requests.
 
 Functions:
 - get_all_pages_in_space(space_key): Retrieves all pages in the specified Confluence space.
+- read_page_ids(path): Reads page IDs from a file, one per line.
+- get_page_restrictions(page_id): Retrieves the restrictions of the specified page.
+- summarize_restrictions(restrictions): Lists the users and groups restricted per operation.
 - remove_restrictions(page_id): Removes all restrictions from the specified page.
+- process_page(page, dry_run): Removes (or reports) the restrictions of one page and returns its audit record.
+- iter_search_pages(cql, key): Retrieves pages with their restrictions from a CQL search.
 
 The script uses basic authentication with the Confluence Cloud API.
 
 Usage:
 1. Update the script with your Confluence instance details.
-2. Execute the script to remove all restrictions from pages in the specified space.
+2. Execute the script to remove all restrictions from pages in the specified spaces.
 """
 
 import requests
 from requests.auth import HTTPBasicAuth
+import argparse
+from concurrent.futures import FIRST_COMPLETED, wait
+from datetime import datetime, timezone
+from urllib.parse import urlparse
 from dotenv import load_dotenv
 import os
+from confluence_client import ConfluenceClient, TokenBucket
+from content_search import IDS_PER_QUERY, iter_search_results, page_ids_cql, restrictions_truncated, space_pages_cql
+from fetch_pool import FetchPool
+from json_codec import response_json
+from json_stream import JsonLinesWriter
+from paginator import CONTENT_LIMIT, iter_results
 
 # Load the .env file
 load_dotenv()
@@ -36,35 +65,202 @@ load_dotenv()
 confluence_base_url = os.getenv('CONFLUENCE_BASE_URL')
 username = os.getenv('USERNAME')
 api_token = os.getenv('USER_API_TOKEN')
+
+client = ConfluenceClient(auth=HTTPBasicAuth(username, api_token))
 space_key = 'SPACE_KEY'
 
+AUDIT_LOG = "File Examples/remove_page_restrictions_audit.jsonl"
+
 # Function to get all pages in the space
 def get_all_pages_in_space(space_key):
     url = f"{confluence_base_url}/rest/api/content"
     params = {
         'spaceKey': space_key,
-        'type': 'page',
-        'limit': 200
+        'type': 'page'
     }
-    response = requests.get(url, params=params, auth=HTTPBasicAuth(username, api_token))
+    return list(iter_results(client, url, params=params, limit=CONTENT_LIMIT))
+
+# Function to read page IDs from a file, one per line (blank lines and # comments are ignored)
+def read_page_ids(path):
+    with open(path) as page_ids_file:
+        for line in page_ids_file:
+            page_id = line.split('#', 1)[0].strip()
+            if page_id:
+                yield page_id
+
+# Function to get the restrictions of a page
+def get_page_restrictions(page_id):
+    url = f"{confluence_base_url}/rest/api/content/{page_id}/restriction/"
+    response = client.get(url)
     response.raise_for_status()
-    return response.json()['results']
+    return response_json(response)
+
+# Function to list the users and groups restricted per operation
+def summarize_restrictions(restrictions):
+    summary = {}
+    for operation, restriction in restrictions.items():
+        if operation.startswith('_') or not isinstance(restriction, dict):
+            continue
+        subjects = restriction.get('restrictions', {})
+        users = [user.get('accountId') for user in subjects.get('user', {}).get('results', [])]
+        groups = [group.get('name') for group in subjects.get('group', {}).get('results', [])]
+        if users or groups:
+            summary[operation] = {"users": users, "groups": groups}
+    return summary
 
 # Function to remove restrictions from a page
 def remove_restrictions(page_id):
     url = f"{confluence_base_url}/rest/api/content/{page_id}/restriction/"
-    response = requests.delete(url, auth=HTTPBasicAuth(username, api_token))
+    response = client.delete(url)
     response.raise_for_status()
     print(f"Removed restrictions for page ID: {page_id}")
 
-def main():
+# Function to start the audit record of a page (or of a space listing, without a page)
+def audit_record(page, action):
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "space_key": page.get('space_key'),
+        "page_id": page.get('id'),
+        "page_title": page.get('title'),
+        "action": action,
+    }
+
+# Function to record an error in an audit record
+def record_failure(record, error):
+    status_code = getattr(getattr(error, 'response', None), 'status_code', None)
+    record.update({"status": "failed", "error": str(error), "http_status": status_code})
+    return record
+
+# Function to remove (or, in a dry run, report) the restrictions of a page and return its audit record
+def process_page(page, dry_run=False):
+    record = audit_record(page, "dry_run" if dry_run else "remove")
+    # Restrictions from a search are used as they are, unless the expanded lists may be incomplete
+    known_restrictions = page.get('restrictions')
+    if known_restrictions is not None and restrictions_truncated(known_restrictions):
+        known_restrictions = None
+    if known_restrictions is not None and not summarize_restrictions(known_restrictions):
+        if dry_run:
+            record["restrictions"] = {}
+        record["status"] = "unchanged"
+        return record
+    # The client already retries throttled and transient failures, so a failure here is final
     try:
-        pages = get_all_pages_in_space(space_key)
-        for page in pages:
+        if dry_run:
+            restrictions = summarize_restrictions(
+                known_restrictions if known_restrictions is not None else get_page_restrictions(page['id'])
+            )
+            record["restrictions"] = restrictions
+            record["status"] = "would_change" if restrictions else "unchanged"
+        else:
             remove_restrictions(page['id'])
-        print("All page restrictions removed successfully.")
+            record["status"] = "ok"
     except requests.exceptions.RequestException as e:
-        print(f"Error: {e}")
+        record_failure(record, e)
+    return record
+
+# Function to yield the pages of a CQL search with their expanded restrictions
+def iter_search_pages(cql, key=None):
+    for page in iter_search_results(client, confluence_base_url, cql):
+        yield {'id': page['id'], 'title': page.get('title'), 'space_key': key, 'restrictions': page.get('restrictions') or {}}
+
+# Function to yield the pages to process for the requested spaces or page ID file
+def iter_target_pages(args):
+    if args.page_ids:
+        if not args.search:
+            for page_id in read_page_ids(args.page_ids):
+                yield {'id': page_id}
+            return
+        page_ids = list(read_page_ids(args.page_ids))
+        for start in range(0, len(page_ids), IDS_PER_QUERY):
+            chunk = page_ids[start:start + IDS_PER_QUERY]
+            found = set()
+            try:
+                for page in iter_search_pages(page_ids_cql(chunk)):
+                    found.add(page['id'])
+                    yield page
+            except requests.exceptions.RequestException as e:
+                print(f"Error: Search failed, processing {len(chunk) - len(found)} pages one by one: {e}")
+            # Pages the search does not return (e.g. not indexed yet) are processed one by one
+            for page_id in chunk:
+                if page_id not in found:
+                    yield {'id': page_id}
+        return
+    for key in args.space or [space_key]:
+        # A space whose listing fails is yielded as a listing error, after the pages listed before the error
+        try:
+            if args.search:
+                yield from iter_search_pages(space_pages_cql(key), key)
+                continue
+            pages = get_all_pages_in_space(key)
+        except requests.exceptions.RequestException as e:
+            yield {'space_key': key, 'listing_error': e}
+            continue
+        for page in pages:
+            yield {'id': page['id'], 'title': page.get('title'), 'space_key': key}
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Remove Confluence page restrictions in bulk.")
+    targets = parser.add_mutually_exclusive_group()
+    targets.add_argument('--space', action='append', help="Space key to clean up (can be given several times)")
+    targets.add_argument('--page-ids', help="File with one page ID per line")
+    parser.add_argument('--dry-run', action='store_true', help="Only report which pages would change")
+    parser.add_argument('--search', action='store_true', help="Find the pages and their restrictions with a CQL search and only clean up restricted pages")
+    parser.add_argument('--workers', type=int, default=4, help="Number of concurrent worker threads (default: 4)")
+    parser.add_argument('--rate', type=float, default=None, help="Maximum requests per second (default: adaptive)")
+    parser.add_argument('--audit-log', default=AUDIT_LOG, help=f"JSON Lines audit log (default: {AUDIT_LOG})")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.rate:
+        client.bucket = TokenBucket(rate=args.rate, max_rate=args.rate)
+    host = urlparse(confluence_base_url).netloc
+    counts = {}
+    # Pages in flight; submission waits for results once this many are pending
+    max_pending = args.workers * 50
+
+    with JsonLinesWriter(args.audit_log, mode='a') as audit, \
+            FetchPool(max_workers=args.workers, per_host_limit=args.workers) as pool:
+        pending = {}
+
+        def write_record(record):
+            audit.write(record)
+            counts[record["status"]] = counts.get(record["status"], 0) + 1
+            if record["status"] == "failed":
+                target = f"page ID {record['page_id']}" if record['page_id'] else f"space {record['space_key']}"
+                print(f"Error: Could not process {target}: {record['error']}")
+
+        # Function to write the audit records of the finished pages, waiting for one if block is set
+        def write_finished(block):
+            done, _ = wait(pending, timeout=None if block else 0, return_when=FIRST_COMPLETED)
+            for future in done:
+                page = pending.pop(future)
+                try:
+                    record = future.result()
+                except Exception as e:
+                    record = record_failure(audit_record(page, "dry_run" if args.dry_run else "remove"), e)
+                write_record(record)
+
+        # Records are written as pages finish; if listing stops with an error, the submitted pages are still recorded
+        try:
+            for page in iter_target_pages(args):
+                if 'listing_error' in page:
+                    write_record(record_failure(audit_record(page, "list"), page['listing_error']))
+                    continue
+                pending[pool.submit(process_page, page, args.dry_run, host=host)] = page
+                write_finished(block=len(pending) >= max_pending)
+        finally:
+            while pending:
+                write_finished(block=True)
+
+    summary = ", ".join(f"{count} {status}" for status, count in sorted(counts.items()))
+    if args.dry_run:
+        print(f"Dry run finished: {summary or 'no pages'}. Details in '{args.audit_log}'")
+    elif counts.get("failed"):
+        print(f"Finished with failures: {summary}. Details in '{args.audit_log}'")
+    else:
+        print("All page restrictions removed successfully.")
+    pool.print_summary()
 
 if __name__ == "__main__":
     main()
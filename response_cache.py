@@ -0,0 +1,222 @@
+"""
+This module provides the on-disk HTTP response cache shared by all Confluence scripts.
+Scripts that run one after another (spaces, watchers, restrictions) list the same spaces and
+pages; with the cache, the second script in the same hour reads those listings from disk
+instead of downloading them again.
+
+Responses are stored in a SQLite file, keyed by method, URL, query parameters, a hash of the
+request body and a hash of the credentials the request was sent with, so a user never reads
+a response fetched for another user. Only endpoints with a time-to-live (TTL) are cached; by default those are the space
+and page listings. A cached response is served as-is while it is younger than its TTL. After
+that it is revalidated with `If-None-Match` / `If-Modified-Since` when the server sent an `ETag`
+or `Last-Modified` header, so an unchanged listing costs a `304 Not Modified` instead of the full body.
+The cache is bounded in size and evicts the least recently used responses first.
+
+Configuration (environment variables, all optional):
+- CONFLUENCE_CACHE: Set to 0 to disable the cache (default: 1).
+- CONFLUENCE_CACHE_PATH: Cache file (default: .confluence_cache.sqlite).
+- CONFLUENCE_CACHE_TTL: Time-to-live of cached listings in seconds (default: 3600).
+- CONFLUENCE_CACHE_MAX_MB: Maximum cache size in megabytes (default: 256).
+
+Classes:
+- ResponseCache: SQLite response cache with per-endpoint TTLs, LRU eviction and revalidation data.
+
+Functions:
+- default_ttls(listing_ttl): Returns the default (URL pattern, TTL) rules.
+- auth_identity(auth, headers): Returns a hash of the credentials a request is sent with.
+- cache_key(method, url, params, body, identity): Returns the cache key of a request.
+- default_cache(): Returns the cache configured by the environment, or None when disabled.
+
+Usage:
+    client = ConfluenceClient(auth=auth, cache=ResponseCache('listings.sqlite'))
+"""
+
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from urllib.parse import parse_qsl, urlencode, urlparse, urlunparse
+
+import requests
+from requests.auth import HTTPBasicAuth
+from requests.structures import CaseInsensitiveDict
+
+DEFAULT_CACHE_PATH = '.confluence_cache.sqlite'
+DEFAULT_LISTING_TTL = 3600
+DEFAULT_MAX_MB = 256
+# Headers worth keeping with a cached response
+STORED_HEADERS = ('Content-Type', 'ETag', 'Last-Modified')
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+# Function to get the default (URL pattern, TTL in seconds) rules: space and page listings
+def default_ttls(listing_ttl=DEFAULT_LISTING_TTL):
+    return (
+        (r'/rest/api/space/?$', listing_ttl),
+        (r'/rest/api/space/[^/]+/content(/page)?/?$', listing_ttl),
+        (r'/rest/api/content/?$', listing_ttl),
+    )
+
+
+# Function to get a hash of the credentials of a request (basic auth and Authorization header)
+def auth_identity(auth=None, headers=None):
+    parts = []
+    if isinstance(auth, tuple):
+        parts.append(':'.join(str(value) for value in auth))
+    elif isinstance(auth, HTTPBasicAuth):
+        parts.append(f"{auth.username}:{auth.password}")
+    elif auth is not None:
+        parts.append(repr(auth))
+    authorization = (headers or {}).get('Authorization')
+    if authorization:
+        parts.append(str(authorization))
+    return hashlib.sha256('\n'.join(parts).encode()).hexdigest() if parts else ''
+
+
+# Function to build the cache key of a request from its method, URL, parameters, body and credentials hash
+def cache_key(method, url, params=None, body=None, identity=''):
+    parsed = urlparse(url)
+    query = parse_qsl(parsed.query, keep_blank_values=True)
+    query.extend((str(key), str(value)) for key, value in (params or {}).items())
+    normalized = urlunparse(parsed._replace(query=urlencode(sorted(query)), fragment=''))
+    if body is not None and not isinstance(body, bytes):
+        body = json.dumps(body, sort_keys=True).encode() if not isinstance(body, str) else body.encode()
+    body_hash = hashlib.sha256(body).hexdigest() if body else ''
+    return hashlib.sha256(f"{method.upper()} {normalized} {body_hash} {identity}".encode()).hexdigest()
+
+
+# SQLite response cache with per-endpoint TTLs, LRU eviction and revalidation data
+class ResponseCache:
+    def __init__(self, path=DEFAULT_CACHE_PATH, ttls=None, max_bytes=DEFAULT_MAX_MB * 1024 * 1024):
+        self.path = path
+        self.ttls = [(re.compile(pattern), ttl) for pattern, ttl in (ttls if ttls is not None else default_ttls())]
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                url TEXT NOT NULL,
+                status INTEGER NOT NULL,
+                headers TEXT NOT NULL,
+                body BLOB NOT NULL,
+                stored_at REAL NOT NULL,
+                accessed_at REAL NOT NULL,
+                size INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at);
+        """)
+        self._size = self._conn.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+        self._evict()
+        self._conn.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    # Function to get the TTL of a URL; 0 means the endpoint is not cached
+    def ttl_for(self, url):
+        path = urlparse(url).path
+        for pattern, ttl in self.ttls:
+            if pattern.search(path):
+                return ttl
+        return 0
+
+    # Function to get a cached entry as (response, age in seconds), or None
+    def lookup(self, key):
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT url, status, headers, body, stored_at FROM responses WHERE key = ?', (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute('UPDATE responses SET accessed_at = ? WHERE key = ?', (time.time(), key))
+            self._conn.commit()
+        url, status, headers, body, stored_at = row
+        return self._build_response(url, status, json.loads(headers), body), time.time() - stored_at
+
+    # Function to store a successful response, evicting the least recently used entries over the size limit
+    def store(self, key, response):
+        headers = {name: response.headers[name] for name in STORED_HEADERS if name in response.headers}
+        body = response.content
+        now = time.time()
+        with self._lock:
+            previous = self._conn.execute('SELECT size FROM responses WHERE key = ?', (key,)).fetchone()
+            self._conn.execute(
+                'INSERT OR REPLACE INTO responses (key, url, status, headers, body, stored_at, accessed_at, size) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (key, response.url, response.status_code, json.dumps(headers), body, now, now, len(body)),
+            )
+            self._size += len(body) - (previous[0] if previous else 0)
+            self._evict()
+            self._conn.commit()
+
+    # Function to mark a cached entry as fresh again after a 304 Not Modified
+    def refresh(self, key):
+        now = time.time()
+        with self._lock:
+            self._conn.execute('UPDATE responses SET stored_at = ?, accessed_at = ? WHERE key = ?', (now, now, key))
+            self._conn.commit()
+
+    # Function to drop all cached responses
+    def clear(self):
+        with self._lock:
+            self._conn.execute('DELETE FROM responses')
+            self._conn.commit()
+            self._size = 0
+
+    def _evict(self):
+        while self._size > self.max_bytes:
+            rows = self._conn.execute(
+                'SELECT key, size FROM responses ORDER BY accessed_at LIMIT 100'
+            ).fetchall()
+            if not rows:
+                self._size = 0
+                return
+            for key, size in rows:
+                self._conn.execute('DELETE FROM responses WHERE key = ?', (key,))
+                self._size -= size
+                if self._size <= self.max_bytes:
+                    return
+
+    @staticmethod
+    def _build_response(url, status, headers, body):
+        response = requests.Response()
+        response.status_code = status
+        response.headers = CaseInsensitiveDict(headers)
+        response._content = body
+        response.url = url
+        response.encoding = 'utf-8'
+        return response
+
+
+# Function to get the cache configured by the environment (shared by all clients), or None when disabled
+def default_cache():
+    global _default_cache
+    if os.getenv('CONFLUENCE_CACHE', '1').lower() in ('0', 'false', 'no', 'off'):
+        return None
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = ResponseCache(
+                path=os.getenv('CONFLUENCE_CACHE_PATH', DEFAULT_CACHE_PATH),
+                ttls=default_ttls(float(os.getenv('CONFLUENCE_CACHE_TTL', str(DEFAULT_LISTING_TTL)))),
+                max_bytes=int(float(os.getenv('CONFLUENCE_CACHE_MAX_MB', str(DEFAULT_MAX_MB))) * 1024 * 1024),
+            )
+        return _default_cache
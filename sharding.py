@@ -0,0 +1,78 @@
+"""
+This module provides the helpers for sharded crawls (see confluence_crawl.py).
+Spaces are assigned to one of N shards by a stable hash of their space key, so every process
+or machine that crawls shard i of N picks the same spaces, without coordination. Each shard
+writes its part of a report as JSON Lines, with every space record stored together with its
+position in the full space listing. The merge step interleaves the shard files back into
+listing order and writes the usual report.
+
+Functions:
+- parse_shard(value): Parses a shard option such as "2/4" into (index, count).
+- shard_of(space_key, count): Returns the shard (1 to count) a space belongs to.
+- shard_suffix(index, count): Returns the suffix that marks a shard's partial output files.
+- shard_path(path, index, count, extension): Returns the file name of a shard's partial output.
+- missing_shards(paths): Returns the shard outputs that do not exist.
+- iter_shard_records(path): Yields (position, record) from a shard's partial output.
+- merge_shards(paths, writer): Writes the records of all shards to a record writer in listing order.
+
+Usage:
+    if shard_of(space['key'], count) == index:
+        ...
+"""
+
+import argparse
+import heapq
+import os
+import zlib
+
+from json_codec import loads
+
+
+# Function to parse a shard option such as "2/4" (shard 2 of 4) into (index, count)
+def parse_shard(value):
+    try:
+        index, count = (int(part) for part in value.split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid shard '{value}', expected i/N such as 1/4")
+    if count < 1 or not 1 <= index <= count:
+        raise argparse.ArgumentTypeError(f"invalid shard '{value}', i must be between 1 and N")
+    return index, count
+
+
+# Function to get the shard (1 to count) a space belongs to; crc32 is stable across processes and machines
+def shard_of(space_key, count):
+    return zlib.crc32(space_key.encode('utf-8')) % count + 1
+
+
+# Function to get the suffix that marks a shard's partial output files
+def shard_suffix(index, count):
+    return f".shard-{index}-of-{count}"
+
+
+# Function to get the file name of a shard's partial output
+def shard_path(path, index, count, extension=None):
+    base, original_extension = os.path.splitext(path)
+    return f"{base}{shard_suffix(index, count)}{original_extension if extension is None else extension}"
+
+
+# Function to get the shard outputs that do not exist
+def missing_shards(paths):
+    return [path for path in paths if not os.path.exists(path)]
+
+
+# Function to yield (position, record) from a shard's partial output
+def iter_shard_records(path):
+    with open(path, 'rb') as shard_file:
+        for line in shard_file:
+            position, record = loads(line)
+            yield position, record
+
+
+# Function to write the records of all shards to a record writer in listing order
+def merge_shards(paths, writer):
+    missing = missing_shards(paths)
+    if missing:
+        raise FileNotFoundError(f"Missing shard output(s): {', '.join(missing)}")
+    for _, record in heapq.merge(*(iter_shard_records(path) for path in paths), key=lambda item: item[0]):
+        writer.write(record)
+    return writer.count
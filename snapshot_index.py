@@ -0,0 +1,162 @@
+"""
+This module provides the local snapshot index used by incremental restriction exports.
+The index is a SQLite file keyed by page ID that stores, for every page seen by the previous
+runs, its space, its version number and last-modified time (from the content listing's
+`version` field) and the exported page record. An incremental run compares the listing with
+the index and only re-fetches pages that are new, have a newer version, or whose stored
+record is older than the configured maximum age. Everything else is served from the index,
+so the export is still a complete snapshot.
+
+Changing page restrictions does not always create a new page version, which is why stored
+records also expire after `max_age_days` and are then fetched again regardless of version.
+
+Classes:
+- SnapshotIndex: SQLite index of page versions and exported page records.
+
+Functions:
+- default_snapshot_path(output_file): Returns the snapshot index file used for an export.
+- page_version(page): Returns the (version number, last-modified time) of a listed page.
+- same_content(a, b): Compares two JSON values independent of key order.
+
+Usage:
+    with SnapshotIndex(default_snapshot_path(OUTPUT_FILE)) as index:
+        record = index.current_record(page_id, *page_version(page), max_age_days=7)
+"""
+
+import os
+import sqlite3
+import threading
+import time
+
+from json_codec import dumps, loads
+
+COMMIT_EVERY = 500
+
+
+# Function to get the snapshot index file used for an export
+def default_snapshot_path(output_file):
+    return os.path.splitext(output_file)[0] + '.snapshot.sqlite'
+
+
+# Function to get the (version number, last-modified time) of a listed page
+def page_version(page):
+    version = page.get('version') or {}
+    return version.get('number'), version.get('when')
+
+
+# Function to compare two JSON values independent of key order
+def same_content(a, b):
+    return dumps(a, sort_keys=True) == dumps(b, sort_keys=True)
+
+
+# SQLite index of page versions and exported page records
+class SnapshotIndex:
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._uncommitted = 0
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS pages (
+                page_id TEXT PRIMARY KEY,
+                space_key TEXT NOT NULL,
+                version INTEGER,
+                last_modified TEXT,
+                fetched_at REAL NOT NULL,
+                run_id INTEGER NOT NULL,
+                record TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS pages_space_key ON pages (space_key);
+            CREATE TABLE IF NOT EXISTS spaces (
+                space_key TEXT PRIMARY KEY,
+                permissions TEXT
+            );
+            CREATE TABLE IF NOT EXISTS runs (
+                run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                started_at REAL NOT NULL
+            );
+        """)
+        self.run_id = self._conn.execute('INSERT INTO runs (started_at) VALUES (?)', (time.time(),)).lastrowid
+        self._conn.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    # Function to run a write statement and commit every COMMIT_EVERY writes
+    def _write(self, sql, params=()):
+        with self._lock:
+            self._conn.execute(sql, params)
+            self._uncommitted += 1
+            if self._uncommitted >= COMMIT_EVERY:
+                self._conn.commit()
+                self._uncommitted = 0
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def commit(self):
+        with self._lock:
+            self._conn.commit()
+            self._uncommitted = 0
+
+    def close(self):
+        self.commit()
+        self._conn.close()
+
+    # Function to get the stored record of a page if it is still current, marking it as seen
+    def current_record(self, page_id, version, last_modified, max_age_days=None):
+        rows = self._query(
+            'SELECT version, last_modified, fetched_at, record FROM pages WHERE page_id = ?', (page_id,)
+        )
+        if not rows:
+            return None
+        stored_version, stored_modified, fetched_at, record = rows[0]
+        if version is None or stored_version != version or stored_modified != last_modified:
+            return None
+        if max_age_days is not None and time.time() - fetched_at > max_age_days * 86400:
+            return None
+        self.touch(page_id)
+        return loads(record)
+
+    def get_record(self, page_id):
+        rows = self._query('SELECT record FROM pages WHERE page_id = ?', (page_id,))
+        return loads(rows[0][0]) if rows else None
+
+    # Function to store a freshly fetched page record and return the previous one, if any
+    def store_page(self, space_key, page_id, version, last_modified, record):
+        previous = self.get_record(page_id)
+        self._write(
+            'INSERT OR REPLACE INTO pages (page_id, space_key, version, last_modified, fetched_at, run_id, record) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (page_id, space_key, version, last_modified, time.time(), self.run_id, dumps(record)),
+        )
+        return previous
+
+    # Function to store the permissions of a space and return (existed, previous permissions)
+    def store_space(self, space_key, permissions):
+        rows = self._query('SELECT permissions FROM spaces WHERE space_key = ?', (space_key,))
+        self._write(
+            'INSERT OR REPLACE INTO spaces (space_key, permissions) VALUES (?, ?)',
+            (space_key, dumps(permissions)),
+        )
+        return bool(rows), loads(rows[0][0]) if rows else None
+
+    # Function to mark a stored page as seen in this run
+    def touch(self, page_id):
+        self._write('UPDATE pages SET run_id = ? WHERE page_id = ?', (self.run_id, page_id))
+
+    # Function to remove and return the pages of a space that were not seen in this run
+    def pop_removed_pages(self, space_key):
+        removed = self._query(
+            'SELECT page_id, record FROM pages WHERE space_key = ? AND run_id != ?',
+            (space_key, self.run_id),
+        )
+        self._write('DELETE FROM pages WHERE space_key = ? AND run_id != ?', (space_key, self.run_id))
+        return [(page_id, loads(record)) for page_id, record in removed]
@@ -8,18 +8,61 @@ The script performs the following tasks:
 3. Retrieves all pages within the space and their respective page restrictions.
 4. Exports the gathered data to a JSON file.
 
+Space permissions, page listings and page restrictions are fetched concurrently through a
+bounded thread pool (see fetch_pool.py). The number of worker threads and the maximum number
+of concurrent requests per host can be set with `--workers` and `--per-host-limit`. With
+`--adaptive`, the number of concurrent requests per host is tuned while the run goes: it starts
+at `--per-host-limit`, grows while latency stays flat and backs off on 429s or a rising p95,
+up to `--workers` (see concurrency_limit.py). Progress lines show the current limit and rate.
+The per-space lookups run a few spaces ahead of the space being written and the page restrictions
+in flight are bounded, so memory stays flat however many spaces and pages the tenant has.
+A throughput summary (lookups/s, p50/p95 lookup time) is printed at the end of the run.
+
+Each space record is written to the output file as soon as its pages are finished (see json_stream.py).
+`--output-format json` (default) produces the usual JSON array, `--output-format jsonl` writes
+one space per line to a `.jsonl` file. With `--flat-export`, the permissions and restrictions are
+also written as flat, indexed tables (see flat_export.py). With `--access-index`, the run also builds
+the inverted index from users and groups to spaces and pages, queried with access_index.py.
+
+With `--search`, the pages of a space are read with a CQL content search that expands the page
+restrictions into the results (see content_search.py), so a space costs a few paged search
+requests instead of a listing plus one restrictions request per page. Only pages whose expanded
+restrictions may be incomplete are requested one by one. `--restricted-only` leaves pages without
+restrictions out of the output.
+
+The output is compact JSON by default; `--indent 4` gives the indented layout of earlier versions.
+With `--fields minimal`, permissions and restrictions are trimmed to the principals and operations
+before they are checkpointed, indexed and written (see projection.py). With `--intern-principals`,
+every restricted user and group is kept once in a principal table written next to the report, and
+the pages reference them by table index (see principals.py).
+
+Progress is recorded in a checkpoint file (see checkpoint.py). If a run is interrupted, start it
+again with `--resume` to skip the spaces and pages that are already finished.
+
+Every run updates a snapshot index keyed by page ID and page version (see snapshot_index.py) and
+writes the pages and space permissions that changed since the previous run to a JSON Lines diff file.
+With `--incremental`, restrictions are only re-fetched for pages that are new, have a new version
+in the content listing, or were last fetched more than `--max-age-days` ago; all other pages are
+taken from the index, so the output is still the full merged snapshot.
+
 To use this script:
 1. Ensure you have the `requests` library installed (`pip install requests`).
 2. Run the script.
 
 Dependencies:
 - requests: To handle HTTP requests.
-- json: To handle JSON data.
+- json_codec: To decode and encode JSON data (orjson when installed).
 
 Functions:
 - get_all_spaces(): Retrieves all spaces in the Confluence instance.
 - get_space_permissions(space_id): Retrieves permissions for a specific space.
 - get_page_restrictions(page_id): Retrieves page restrictions for a specific page.
+- get_space_pages(space_key): Retrieves the pages of a specific space.
+- iter_space_pages(space_key, cursor): Retrieves the pages of a specific space page by page.
+- list_space_pages(space_key, checkpoint): Retrieves the pages of a space, reusing the checkpointed listing.
+- search_space_pages(space_key): Retrieves the pages of a space with their restrictions from a CQL search.
+- share_principals(restrictions): Replaces the users and groups of restrictions by their shared copies.
+- record_page_change(diff, space_key, page_data, previous): Records a new or changed page in the diff file.
 
 Usage:
 1. Update the script with your Confluence instance details.
@@ -28,9 +71,26 @@ Usage:
 
 import requests
 from requests.auth import HTTPBasicAuth
-import json
+import argparse
+from collections import deque
+from contextlib import nullcontext
+from urllib.parse import urlparse
 from dotenv import load_dotenv
 import os
+from checkpoint import CheckpointStore, default_checkpoint_path
+from json_codec import response_json
+from content_search import RESTRICTIONS_EXPAND, has_restrictions, iter_search_results, restrictions_truncated, space_pages_cql
+from confluence_client import ConfluenceClient
+from concurrent.futures import Future, wait
+from fetch_pool import FetchPool
+from access_index import AccessIndexBuilder, default_access_index_path
+from flat_export import FLAT_FORMATS, FlatExporter
+from instrumentation import profile_stage
+from json_stream import OUTPUT_FORMATS, JsonLinesWriter, open_record_writer, output_path
+from paginator import CONTENT_LIMIT, SPACE_LIMIT, iter_pages, iter_results
+from principals import PrincipalTable, principals_path, reference_writer
+from projection import PROJECTIONS, project_page, project_permissions, project_restrictions
+from snapshot_index import SnapshotIndex, default_snapshot_path, page_version, same_content
 
 # Load the .env file
 load_dotenv()
@@ -39,72 +99,287 @@ confluence_base_url = os.getenv('CONFLUENCE_BASE_URL')
 username = os.getenv('USERNAME')
 api_token = os.getenv('USER_API_TOKEN')
 
+client = ConfluenceClient(auth=HTTPBasicAuth(username, api_token))
+
+OUTPUT_FILE = "File Examples/confluence_permissions_and_restrictions_data.json"
+DIFF_FILE = "File Examples/confluence_permissions_and_restrictions_diff.jsonl"
+
+# Projection applied to permissions and restrictions, set from --fields
+fields = 'full'
+# Interned principal table, set from --intern-principals
+principals = None
+
 # Function to get all spaces
 def get_all_spaces():
     url = f'{confluence_base_url}/rest/api/space'
-    response = requests.get(url, auth=HTTPBasicAuth(username, api_token))
-    response.raise_for_status()
-    return response.json()['results']
+    return list(iter_results(client, url, limit=SPACE_LIMIT))
 
 # Function to get space permissions
 def get_space_permissions(space_id):
     url = f'{confluence_base_url}/api/v2/spaces/{space_id}/permission'
-    response = requests.get(url, auth=HTTPBasicAuth(username, api_token))
+    response = client.get(url)
     if response.status_code == 404:
         print(f"Error: Permissions endpoint for space '{space_id}' not found (404)")
         return {}
     response.raise_for_status()
-    return response.json()
+    return project_permissions(response_json(response), fields)
 
 # Function to get page restrictions
 def get_page_restrictions(page_id):
     url = f'{confluence_base_url}/rest/api/content/{page_id}/restriction/'
-    response = requests.get(url, auth=HTTPBasicAuth(username, api_token))
+    response = client.get(url)
     if response.status_code == 404:
         print(f"Error: Restrictions endpoint for page '{page_id}' not found (404)")
         return {}
     response.raise_for_status()
-    return response.json()
-
-def main():
-    result = []
-
-    spaces = get_all_spaces()
-    for space in spaces:
-        space_data = {
-            "space_name": space['name'],
-            "space_id": space['id'],
-            "space_type": space['type']
-        }
-
-        if space['type'] != 'personal' and space['name'] != "Cloud Acceleration Service":
-            permissions = get_space_permissions(space['key'])
-            space_data["space_permissions"] = permissions
-
-            url = f"{confluence_base_url}/rest/api/space/{space['key']}/content/page"
-            pages_response = requests.get(url, auth=HTTPBasicAuth(username, api_token))
-            if pages_response.status_code == 404:
-                print(f"Error: Pages endpoint for space '{space['key']}' not found (404)")
+    return share_principals(project_restrictions(response_json(response), fields))
+
+# Function to replace the users and groups of restrictions by their shared copies when principals are interned
+def share_principals(restrictions):
+    return restrictions if principals is None else principals.share_restrictions(restrictions)
+
+# Function to get the pages of a space listing page by page as (pages, next_url), optionally from a cursor
+def iter_space_pages(space_key, cursor=None):
+    url = f"{confluence_base_url}/rest/api/space/{space_key}/content/page"
+    for pages, next_url in iter_pages(client, url, params={'expand': 'version'}, limit=CONTENT_LIMIT, cursor=cursor):
+        yield [project_page(page) for page in pages], next_url
+
+# Function to check whether a listing failed because the space has no pages endpoint
+def is_missing_pages_endpoint(error, space_key):
+    if error.response is not None and error.response.status_code == 404:
+        print(f"Error: Pages endpoint for space '{space_key}' not found (404)")
+        return True
+    return False
+
+# Function to get the pages of a space, or None if the space has no pages endpoint
+def get_space_pages(space_key):
+    try:
+        return [page for pages, _ in iter_space_pages(space_key) for page in pages]
+    except requests.exceptions.HTTPError as e:
+        if is_missing_pages_endpoint(e, space_key):
+            return None
+        raise
+
+# Function to get the pages of a space, continuing the listing recorded in the checkpoint
+def list_space_pages(space_key, checkpoint):
+    pages, listing_done = checkpoint.listed_pages(space_key)
+    if listing_done:
+        return pages
+    try:
+        for batch, next_url in iter_space_pages(space_key, checkpoint.get_cursor(space_key)):
+            checkpoint.save_listing(space_key, batch, cursor=next_url, done=next_url is None)
+            pages.extend(batch)
+    except requests.exceptions.HTTPError as e:
+        if is_missing_pages_endpoint(e, space_key):
+            return None
+        raise
+    return pages
+
+# Function to get the pages of a space with their restrictions from a CQL search, or None if the search failed with 404
+def search_space_pages(space_key):
+    try:
+        return list(iter_search_results(client, confluence_base_url, space_pages_cql(space_key),
+                                        expand=f'{RESTRICTIONS_EXPAND},version'))
+    except requests.exceptions.HTTPError as e:
+        if is_missing_pages_endpoint(e, space_key):
+            return None
+        raise
+
+# Function to get a future that already holds its result, for restrictions that came with the search results
+def resolved_future(value):
+    future = Future()
+    future.set_result(value)
+    return future
+
+# Function to decide whether permissions and restrictions are collected for a space
+def is_space_included(space):
+    return space['type'] != 'personal' and space['name'] != "Cloud Acceleration Service"
+
+# Function to record a re-fetched page in the diff file if it is new or its restrictions changed
+def record_page_change(diff, space_key, page_data, previous):
+    if previous is None:
+        diff.write({"change": "page_added", "space_key": space_key, "page_id": page_data["page_id"],
+                    "page_name": page_data["page_name"], "current": page_data["page_restrictions"]})
+    elif not same_content(previous["page_restrictions"], page_data["page_restrictions"]):
+        diff.write({"change": "page_restrictions_changed", "space_key": space_key, "page_id": page_data["page_id"],
+                    "page_name": page_data["page_name"], "previous": previous["page_restrictions"],
+                    "current": page_data["page_restrictions"]})
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Export Confluence space permissions and page restrictions.")
+    parser.add_argument('--workers', type=int, default=8, help="Number of concurrent worker threads (default: 8)")
+    parser.add_argument('--per-host-limit', type=int, default=8, help="Maximum concurrent requests per host (default: 8)")
+    parser.add_argument('--adaptive', action='store_true', help="Tune the concurrent requests per host between 1 and --workers, starting at --per-host-limit")
+    parser.add_argument('--output-format', choices=OUTPUT_FORMATS, default='json', help="Write a JSON array (default) or JSON Lines, one space per line")
+    parser.add_argument('--indent', type=int, default=None, help="Indent the JSON array by this many spaces (default: compact)")
+    parser.add_argument('--fields', choices=PROJECTIONS, default='full', help="Export full API responses (default) or only the principals and operations")
+    parser.add_argument('--intern-principals', action='store_true', help="Write every user and group once to a principal table and reference them by index in the report")
+    parser.add_argument('--resume', action='store_true', help="Continue an interrupted run from its checkpoint instead of starting over")
+    parser.add_argument('--checkpoint', default=default_checkpoint_path(OUTPUT_FILE), help="Checkpoint file (default: next to the output file)")
+    parser.add_argument('--incremental', action='store_true', help="Only re-fetch restrictions of pages that changed since the previous run")
+    parser.add_argument('--max-age-days', type=float, default=7, help="In incremental mode, re-fetch pages whose stored restrictions are older than this (default: 7)")
+    parser.add_argument('--snapshot', default=default_snapshot_path(OUTPUT_FILE), help="Snapshot index file (default: next to the output file)")
+    parser.add_argument('--diff-file', default=DIFF_FILE, help=f"File listing what changed since the previous run (default: {DIFF_FILE})")
+    parser.add_argument('--search', action='store_true', help="Read pages and their restrictions with a CQL search instead of one request per page")
+    parser.add_argument('--restricted-only', action='store_true', help="Only write pages that have restrictions")
+    parser.add_argument('--flat-export', help="Also write flat tables (one row per permission, restriction subject and watcher) to this SQLite file or, for parquet/csv, directory")
+    parser.add_argument('--flat-format', choices=FLAT_FORMATS, default='sqlite', help="Format of the flat export (default: sqlite; parquet needs pyarrow)")
+    parser.add_argument('--access-index', nargs='?', const=default_access_index_path(OUTPUT_FILE),
+                        help="Also build the user/group to spaces and pages index (see access_index.py) in this file (default: next to the output file)")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    global fields, principals
+    args = parse_args(argv)
+    fields = args.fields
+    principals = PrincipalTable() if args.intern_principals else None
+    host = urlparse(confluence_base_url).netloc
+
+    with CheckpointStore(args.checkpoint, resume=args.resume) as checkpoint, \
+            SnapshotIndex(args.snapshot) as index, \
+            JsonLinesWriter(args.diff_file, mode='a' if args.resume else 'w') as diff, \
+            reference_writer(open_record_writer(OUTPUT_FILE, args.output_format, indent=args.indent),
+                             principals, OUTPUT_FILE, args.indent) as writer, \
+            (FlatExporter(args.flat_export, args.flat_format) if args.flat_export else nullcontext()) as flat, \
+            (AccessIndexBuilder(args.access_index) if args.access_index else nullcontext()) as access_index, \
+            FetchPool(max_workers=args.workers, per_host_limit=args.per_host_limit, adaptive=args.adaptive) as pool:
+        if args.adaptive:
+            client.observers.append(pool.observe)
+        spaces = get_all_spaces()
+
+        # Spaces whose page restrictions are in flight, kept in output order; at most this many
+        # spaces and pages are pending, so memory does not grow with the size of the tenant
+        pending = deque()
+        pending_pages = 0
+        max_pending_pages = args.workers * 50
+        max_pending_spaces = args.workers * 4
+
+        # The per-space lookups run ahead of the space being processed, at most max_pending_spaces spaces
+        lookup_spaces = deque(space['key'] for space in spaces
+                              if is_space_included(space) and not checkpoint.is_space_done(space['key']))
+        space_futures = {}
+
+        def submit_space_lookups():
+            while lookup_spaces and len(space_futures) < max_pending_spaces:
+                space_key = lookup_spaces.popleft()
+                space_futures[space_key] = (
+                    pool.submit(get_space_permissions, space_key, host=host),
+                    pool.submit(search_space_pages, space_key, host=host) if args.search
+                    else pool.submit(list_space_pages, space_key, checkpoint, host=host),
+                )
+
+        def finish_space():
+            nonlocal pending_pages
+            space_key, space_data, page_futures = pending.popleft()
+            if page_futures is None:
+                with profile_stage('write_space'):
+                    writer.write(space_data)
+                    if flat is not None:
+                        flat.write_space(space_key, space_data)
+                    if access_index is not None:
+                        access_index.add_space(space_key, space_data)
+                pool.print_progress(writer.count, len(spaces))
+                return
+            # Wait for the API calls first, so the stage below only measures local processing
+            wait([restrictions_future for _, restrictions_future, _ in page_futures if restrictions_future is not None])
+            with profile_stage('write_space'):
+                space_pages = []
+                for page_data, restrictions_future, version in page_futures:
+                    if restrictions_future is not None:
+                        page_data["page_restrictions"] = restrictions_future.result()
+                        checkpoint.save_page(space_key, page_data["page_id"], page_data)
+                        previous = index.store_page(space_key, page_data["page_id"], *version, page_data)
+                        record_page_change(diff, space_key, page_data, previous)
+                    if not args.restricted_only or has_restrictions(page_data.get("page_restrictions")):
+                        space_pages.append(page_data)
+                pending_pages -= len(page_futures)
+                space_data["space_pages"] = space_pages
+
+                for page_id, previous in index.pop_removed_pages(space_key):
+                    diff.write({"change": "page_removed", "space_key": space_key, "page_id": page_id,
+                                "page_name": previous["page_name"], "previous": previous["page_restrictions"]})
+                existed, previous_permissions = index.store_space(space_key, space_data["space_permissions"])
+                if existed and not same_content(previous_permissions, space_data["space_permissions"]):
+                    diff.write({"change": "space_permissions_changed", "space_key": space_key,
+                                "previous": previous_permissions, "current": space_data["space_permissions"]})
+
+                checkpoint.mark_space_done(space_key, space_data)
+                writer.write(space_data)
+                if flat is not None:
+                    flat.write_space(space_key, space_data)
+                if access_index is not None:
+                    access_index.add_space(space_key, space_data)
+            pool.print_progress(writer.count, len(spaces))
+
+        for space in spaces:
+            while pending_pages > max_pending_pages or len(pending) >= max_pending_spaces:
+                finish_space()
+            submit_space_lookups()
+            space_data = {
+                "space_name": space['name'],
+                "space_id": space['id'],
+                "space_type": space['type']
+            }
+
+            if not is_space_included(space):
+                pending.append((space['key'], space_data, None))
+                continue
+
+            if space['key'] not in space_futures:
+                # Spaces without lookups are the ones finished in the checkpoint
+                pending.append((space['key'], checkpoint.load_space(space['key']), None))
+                continue
+
+            permissions_future, pages_future = space_futures.pop(space['key'])
+            space_data["space_permissions"] = permissions_future.result()
+            pages = pages_future.result()
+            if pages is None:
                 continue
-            pages_response.raise_for_status()
-            pages = pages_response.json()['results']
 
-            space_pages = []
+            completed_pages = checkpoint.completed_pages(space['key'])
+            page_futures = []
             for page in pages:
+                if page['id'] in completed_pages:
+                    index.touch(page['id'])
+                    page_futures.append((completed_pages[page['id']], None, None))
+                    continue
+                version = page_version(page)
+                if args.search and not restrictions_truncated(page.get('restrictions')):
+                    page_data = {
+                        "page_name": page['title'],
+                        "page_id": page['id']
+                    }
+                    restrictions = share_principals(project_restrictions(page.get('restrictions') or {}, fields))
+                    page_futures.append((page_data, resolved_future(restrictions), version))
+                    continue
+                if args.incremental:
+                    stored_record = index.current_record(page['id'], *version, max_age_days=args.max_age_days)
+                    if stored_record is not None:
+                        stored_record["page_name"] = page['title']
+                        page_futures.append((stored_record, None, None))
+                        continue
                 page_data = {
                     "page_name": page['title'],
                     "page_id": page['id']
                 }
+                page_futures.append((page_data, pool.submit(get_page_restrictions, page['id'], host=host), version))
+            pending.append((space['key'], space_data, page_futures))
+            pending_pages += len(page_futures)
 
-                restrictions = get_page_restrictions(page['id'])
-                page_data["page_restrictions"] = restrictions
-                space_pages.append(page_data)
-
-            space_data["space_pages"] = space_pages
-        result.append(space_data)
+        while pending:
+            finish_space()
 
-    with open("File Examples/confluence_permissions_and_restrictions_data.json", "w") as json_file:
-        json.dump(result, json_file, indent=4)
+    # The run finished, so there is nothing left to resume
+    os.remove(args.checkpoint)
+    print(f"Exported {writer.count} spaces to '{output_path(OUTPUT_FILE, args.output_format)}', "
+          f"{diff.count} changes to '{args.diff_file}'")
+    pool.print_summary()
+    if principals is not None:
+        principals.print_summary(principals_path(OUTPUT_FILE))
+    if flat is not None:
+        flat.print_summary()
+    if access_index is not None:
+        access_index.print_summary()
 
 if __name__ == "__main__":
     main()
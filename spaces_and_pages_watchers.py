@@ -8,29 +8,73 @@ The script performs the following tasks:
 3. Retrieves all pages within the space and their respective page watchers using the GraphQL API.
 4. Exports the gathered data to a JSON file.
 
+Watcher lookups are batched: many space keys or page IDs are packed into one aliased GraphQL
+query (see graphql_batch.py). The batch size tunes itself and failed batches are split until the
+failing lookup is isolated, which cuts the number of requests by one to two orders of magnitude.
+Watcher lists are complete: connections with more watchers than fit in one response are followed
+by cursor, and the follow-up pages of many spaces or pages share the same batched queries.
+
+The page watcher batches of several spaces run concurrently on a bounded thread pool (see
+fetch_pool.py), set with `--workers` and `--per-host-limit`. With `--adaptive`, the number of
+concurrent batches is tuned while the run goes: it grows while latency stays flat and backs off
+on 429s or a rising p95 (see concurrency_limit.py). Progress lines show the current limit and rate.
+
+Each space record is written to the output file as soon as its pages are finished (see json_stream.py).
+`--output-format json` (default) produces the usual JSON array, `--output-format jsonl` writes
+one space per line to a `.jsonl` file. With `--flat-export`, the watchers are also written as
+flat, indexed tables (see flat_export.py).
+
+The output is compact JSON by default; `--indent 4` gives the indented layout of earlier versions.
+With `--fields minimal`, the GraphQL queries only select the account ID, display name and
+permission type of each watcher (no profile pictures or `__typename` markers), which shrinks
+both the responses and the export. With `--intern-principals`, every watcher is kept once in a
+principal table written next to the report, and the watcher lists reference them by table index
+(see principals.py).
+
+Progress is recorded in a checkpoint file (see checkpoint.py). If a run is interrupted, start it
+again with `--resume` to skip the spaces and pages that are already finished.
+
 To use this script:
 1. Ensure you have the `requests` library installed (`pip install requests`).
 2. Run the script.
 
 Dependencies:
 - requests: To handle HTTP requests.
-- json: To handle JSON data.
+- json_codec: To decode and encode JSON data (orjson when installed).
 
 Functions:
 - get_all_spaces(): Retrieves all spaces in the Confluence instance.
 - get_space_watchers(space_key): Retrieves watchers for a specific space using the GraphQL API.
 - get_page_watchers(page_id): Retrieves page watchers for a specific page using the GraphQL API.
+- get_watchers(kind, keys): Retrieves the complete watchers of many spaces or pages in batched GraphQL queries.
+- get_page_watchers_chunk(page_ids): Retrieves the watchers of a chunk of pages as (page ID, watchers) pairs.
+- send_watchers_batch(kind, keys): Sends one batched watchers query.
+- list_space_pages(space_key, checkpoint): Retrieves the pages of a space, reusing the checkpointed listing.
 
 Usage:
 1. Update the script with your Confluence instance details.
 2. Execute the script to retrieve and export space watchers and page watchers to a JSON file.
 """
 
-import requests
 from requests.auth import HTTPBasicAuth
-import json
+import argparse
+from collections import deque
+from concurrent.futures import wait
+from contextlib import nullcontext
+from urllib.parse import urlparse
 from dotenv import load_dotenv
 import os
+from checkpoint import CheckpointStore, default_checkpoint_path
+from fetch_pool import FetchPool
+from flat_export import FLAT_FORMATS, FlatExporter
+from confluence_client import ConfluenceClient
+from instrumentation import profile_stage
+from graphql_batch import MAX_BATCH_SIZE, BatchError, BatchSizer, batch_alias, build_batch_query, cursor_variable, execute_paginated
+from json_codec import dumps, response_json
+from json_stream import OUTPUT_FORMATS, open_record_writer, output_path
+from paginator import CONTENT_LIMIT, SPACE_LIMIT, iter_pages, iter_results
+from principals import PrincipalTable, principals_path, reference_writer
+from projection import PROJECTIONS, project_page
 
 # Load the .env file
 load_dotenv()
@@ -39,176 +83,312 @@ confluence_base_url = os.getenv('CONFLUENCE_BASE_URL')
 username = os.getenv('USERNAME')
 api_token = os.getenv('USER_API_TOKEN')
 
+client = ConfluenceClient(auth=HTTPBasicAuth(username, api_token))
+
+OUTPUT_FILE = "File Examples/confluence_space_and_page_watchers_data.json"
+
+# Projection of the watcher lookups, set from --fields
+fields = 'full'
+# Interned principal table, set from --intern-principals
+principals = None
+
 # Function to get all spaces
 def get_all_spaces():
     url = f'{confluence_base_url}/rest/api/space'
-    response = requests.get(url, auth=HTTPBasicAuth(username, api_token))
-    response.raise_for_status()
-    return response.json()['results']
+    return list(iter_results(client, url, limit=SPACE_LIMIT))
 
-# Function to get space watchers
-def get_space_watchers(space_key):
-    url = f'https://euema.atlassian.net/cgraphql?q=SpaceWatchersQuery'
-    payload = {
-        "operationName": "SpaceWatchersQuery",
-        "variables": {
-            "first": 20,
-            "spaceKey": space_key
-        },
-        "query": """query SpaceWatchersQuery($spaceKey: String, $spaceId: ID, $offset: Int, $after: String, $first: Int = 20) {
-            spaceWatchers(
-                spaceKey: $spaceKey
-                spaceId: $spaceId
-                offset: $offset
-                after: $after
-                first: $first
-            ) {
-                count
-                nodes {
-                    ...userNodeFragment
-                    __typename
-                }
-                pageInfo {
-                    hasNextPage
-                    endCursor
-                    __typename
-                }
-                __typename
-            }
-        }
-        fragment userNodeFragment on Person {
-            ... on KnownUser {
-                accountId
-                __typename
-            }
-            ... on UnknownUser {
-                accountId
-                __typename
-            }
-            ... on User {
-                accountId
-                __typename
-            }
-            displayName
-            permissionType
-            profilePicture {
-                path
-                __typename
-            }
-            __typename
-        }"""
+# GraphQL endpoint of the Confluence site; CONFLUENCE_GRAPHQL_URL overrides it (e.g. for a mock server)
+GRAPHQL_URL = os.getenv('CONFLUENCE_GRAPHQL_URL', 'https://euema.atlassian.net/cgraphql')
+# Largest number of watchers requested per connection page; further pages are followed by cursor
+WATCHERS_PAGE_SIZE = 100
+
+# Selection and fragment shared by the space and page watcher lookups
+WATCHERS_SELECTION = """count
+    nodes {
+        ...userNodeFragment
+        __typename
+    }
+    pageInfo {
+        hasNextPage
+        endCursor
+        __typename
     }
+    __typename"""
 
-    headers = {
-        "Content-Type": "application/json"
+USER_NODE_FRAGMENT = """fragment userNodeFragment on Person {
+    ... on KnownUser {
+        accountId
+        __typename
     }
+    ... on UnknownUser {
+        accountId
+        __typename
+    }
+    ... on User {
+        accountId
+        __typename
+    }
+    displayName
+    permissionType
+    profilePicture {
+        path
+        __typename
+    }
+    __typename
+}"""
 
-    response = requests.post(url, auth=HTTPBasicAuth(username, api_token), headers=headers, data=json.dumps(payload))
+# Selection and fragment of the minimal projection: only the fields the reports use
+MINIMAL_WATCHERS_SELECTION = """count
+    nodes {
+        ...userNodeFragment
+    }
+    pageInfo {
+        hasNextPage
+        endCursor
+    }"""
 
-    if response.status_code == 404:
-        print(f"Error: Space watchers for space '{space_key}' not found (404)")
-        return {}
-    response.raise_for_status()
-    return response.json()
+MINIMAL_USER_NODE_FRAGMENT = """fragment userNodeFragment on Person {
+    ... on KnownUser {
+        accountId
+    }
+    ... on UnknownUser {
+        accountId
+    }
+    ... on User {
+        accountId
+    }
+    displayName
+    permissionType
+}"""
 
-# Function to get page watchers
-def get_page_watchers(page_id):
-    url = f'https://euema.atlassian.net/cgraphql?q=ContentWatchersQuery'
+# Selection and fragment per projection
+WATCHER_SELECTIONS = {
+    'full': (WATCHERS_SELECTION, USER_NODE_FRAGMENT),
+    'minimal': (MINIMAL_WATCHERS_SELECTION, MINIMAL_USER_NODE_FRAGMENT),
+}
+
+# Operation name, GraphQL field, argument name and argument type per kind of watcher lookup
+WATCHER_QUERIES = {
+    'space': ("SpaceWatchersQuery", "spaceWatchers", "spaceKey", "String"),
+    'page': ("ContentWatchersQuery", "contentWatchers", "contentId", "ID!"),
+}
+
+# Batch sizes are tuned separately for space and page lookups and kept for the whole run; the pool threads share them
+batch_sizers = {kind: BatchSizer() for kind in WATCHER_QUERIES}
+
+# Function to send one batched watchers query for (key, after cursor) items and return the results keyed by item
+def send_watchers_batch(kind, items):
+    operation_name, field, argument, argument_type = WATCHER_QUERIES[kind]
+    with_cursor = any(after is not None for _, after in items)
+    selection, fragment = WATCHER_SELECTIONS[fields]
+    query = build_batch_query(operation_name, field, argument, argument_type,
+                              selection, fragment, len(items), with_cursor)
+    variables = {"first": WATCHERS_PAGE_SIZE}
+    for position, (key, after) in enumerate(items):
+        variables[batch_alias(position)] = key
+        if with_cursor:
+            variables[cursor_variable(position)] = after
     payload = {
-        "operationName": "ContentWatchersQuery",
-        "variables": {
-            "first": 20,
-            "contentId": page_id
-        },
-        "query": """query ContentWatchersQuery($contentId: ID!, $offset: Int, $after: String, $first: Int = 20) {
-            contentWatchers(
-                contentId: $contentId
-                offset: $offset
-                after: $after
-                first: $first
-            ) {
-                count
-                nodes {
-                    ...userNodeFragment
-                    __typename
-                }
-                pageInfo {
-                    hasNextPage
-                    endCursor
-                    __typename
-                }
-                __typename
-            }
-        }
-        fragment userNodeFragment on Person {
-            ... on KnownUser {
-                accountId
-                __typename
-            }
-            ... on UnknownUser {
-                accountId
-                __typename
-            }
-            ... on User {
-                accountId
-                __typename
-            }
-            displayName
-            permissionType
-            profilePicture {
-                path
-                __typename
-            }
-            __typename
-        }"""
+        "operationName": operation_name,
+        "variables": variables,
+        "query": query
     }
 
     headers = {
         "Content-Type": "application/json"
     }
 
-    response = requests.post(url, auth=HTTPBasicAuth(username, api_token), headers=headers, data=json.dumps(payload))
+    response = client.post(f'{GRAPHQL_URL}?q={operation_name}', headers=headers, data=dumps(payload).encode())
+    if not response.ok:
+        raise BatchError(f"{operation_name} failed with status {response.status_code}", status_code=response.status_code)
+
+    body = response_json(response)
+    data = body.get('data') or {}
+    errors = body.get('errors') or []
+    if len(items) == 1:
+        # A single lookup is returned as-is, including any GraphQL errors
+        result = {"data": {field: data.get(batch_alias(0))}}
+        if errors:
+            result["errors"] = errors
+        return {items[0]: result}
 
-    if response.status_code == 404:
-        print(f"Error: Watchers for page '{page_id}' not found (404)")
+    failed_aliases = {error['path'][0] for error in errors if error.get('path')}
+    if errors and not failed_aliases:
+        raise BatchError(f"{operation_name} returned errors", errors=errors)
+
+    results = {}
+    for position, item in enumerate(items):
+        alias = batch_alias(position)
+        if alias not in failed_aliases and data.get(alias) is not None:
+            results[item] = {"data": {field: data[alias]}}
+    return results
+
+# Function to handle a watcher lookup that failed on its own
+def watchers_lookup_failed(kind, item, error):
+    key, _ = item
+    if error.status_code == 404:
+        if kind == 'space':
+            print(f"Error: Space watchers for space '{key}' not found (404)")
+        else:
+            print(f"Error: Watchers for page '{key}' not found (404)")
         return {}
-    response.raise_for_status()
-    return response.json()
-
-def main():
-    result = []
-
-    spaces = get_all_spaces()
-    for space in spaces:
-        space_data = {
-            "space_name": space['name'],
-            "space_id": space['id'],
-            "space_type": space['type']
-        }
-
-        space_watchers = get_space_watchers(space['key'])
-        space_data["space_watchers"] = space_watchers
-
-        space_pages = []
-        pages_response = requests.get(f"{confluence_base_url}/rest/api/space/{space['key']}/content/page", auth=HTTPBasicAuth(username, api_token))
-        pages_response.raise_for_status()
-        pages = pages_response.json()['results']
-
-        for page in pages:
-            page_data = {
-                "page_name": page['title'],
-                "page_id": page['id']
+    raise error
+
+# Function to get the watchers connection out of a lookup result
+def watchers_connection(kind, result):
+    _, field, _, _ = WATCHER_QUERIES[kind]
+    return ((result or {}).get('data') or {}).get(field)
+
+# Function to get the complete watchers of many spaces or pages in batched GraphQL queries, yielding (key, watchers)
+def get_watchers(kind, keys):
+    results = execute_paginated(
+        keys,
+        lambda batch: send_watchers_batch(kind, batch),
+        batch_sizers[kind],
+        lambda item, error: watchers_lookup_failed(kind, item, error),
+        lambda result: watchers_connection(kind, result),
+    )
+    if principals is None:
+        return results
+    # Watchers are shared once a lookup is complete, after its connection pages have been merged
+    return ((key, principals.share_watchers(watchers)) for key, watchers in results)
+
+# Function to get space watchers
+def get_space_watchers(space_key):
+    return dict(get_watchers('space', [space_key]))[space_key]
+
+# Function to get page watchers
+def get_page_watchers(page_id):
+    return dict(get_watchers('page', [page_id]))[page_id]
+
+# Function to get the watchers of a chunk of pages as a list of (page ID, watchers); one chunk fills one batch
+def get_page_watchers_chunk(page_ids):
+    return list(get_watchers('page', page_ids))
+
+# Function to get the pages of a space, continuing the listing recorded in the checkpoint
+def list_space_pages(space_key, checkpoint):
+    pages, listing_done = checkpoint.listed_pages(space_key)
+    if listing_done:
+        return pages
+    url = f"{confluence_base_url}/rest/api/space/{space_key}/content/page"
+    for batch, next_url in iter_pages(client, url, limit=CONTENT_LIMIT, cursor=checkpoint.get_cursor(space_key)):
+        batch = [project_page(page) for page in batch]
+        checkpoint.save_listing(space_key, batch, cursor=next_url, done=next_url is None)
+        pages.extend(batch)
+    return pages
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Export Confluence space and page watchers.")
+    parser.add_argument('--workers', type=int, default=8, help="Number of concurrent worker threads (default: 8)")
+    parser.add_argument('--per-host-limit', type=int, default=8, help="Maximum concurrent requests per host (default: 8)")
+    parser.add_argument('--adaptive', action='store_true', help="Tune the concurrent requests per host between 1 and --workers, starting at --per-host-limit")
+    parser.add_argument('--output-format', choices=OUTPUT_FORMATS, default='json', help="Write a JSON array (default) or JSON Lines, one space per line")
+    parser.add_argument('--indent', type=int, default=None, help="Indent the JSON array by this many spaces (default: compact)")
+    parser.add_argument('--fields', choices=PROJECTIONS, default='full', help="Select full watcher records (default) or only account ID, display name and permission type")
+    parser.add_argument('--intern-principals', action='store_true', help="Write every watcher once to a principal table and reference them by index in the report")
+    parser.add_argument('--resume', action='store_true', help="Continue an interrupted run from its checkpoint instead of starting over")
+    parser.add_argument('--checkpoint', default=default_checkpoint_path(OUTPUT_FILE), help="Checkpoint file (default: next to the output file)")
+    parser.add_argument('--flat-export', help="Also write flat tables (one row per permission, restriction subject and watcher) to this SQLite file or, for parquet/csv, directory")
+    parser.add_argument('--flat-format', choices=FLAT_FORMATS, default='sqlite', help="Format of the flat export (default: sqlite; parquet needs pyarrow)")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    global fields, principals
+    args = parse_args(argv)
+    fields = args.fields
+    principals = PrincipalTable() if args.intern_principals else None
+
+    with CheckpointStore(args.checkpoint, resume=args.resume) as checkpoint, \
+            reference_writer(open_record_writer(OUTPUT_FILE, args.output_format, indent=args.indent),
+                             principals, OUTPUT_FILE, args.indent) as writer, \
+            (FlatExporter(args.flat_export, args.flat_format) if args.flat_export else nullcontext()) as flat, \
+            FetchPool(max_workers=args.workers, per_host_limit=args.per_host_limit, adaptive=args.adaptive) as pool:
+        if args.adaptive:
+            client.observers.append(pool.observe)
+        host = urlparse(GRAPHQL_URL).netloc
+        spaces = get_all_spaces()
+
+        # Space watchers are cheap to batch across all spaces up front
+        space_keys = [space['key'] for space in spaces if not checkpoint.is_space_done(space['key'])]
+        space_watchers = dict(get_watchers('space', space_keys))
+
+        # Spaces whose page watchers are in flight, kept in output order
+        pending = deque()
+        pending_pages = 0
+        max_pending_pages = args.workers * 50
+
+        def finish_space():
+            nonlocal pending_pages
+            space_key, space_data, pages, completed_pages, new_pages, futures = pending.popleft()
+            if pages is None:
+                with profile_stage('write_space'):
+                    writer.write(space_data)
+                    if flat is not None:
+                        flat.write_space(space_key, space_data)
+                pool.print_progress(writer.count, len(spaces))
+                return
+            # Wait for the API calls first, so the stage below only measures local processing
+            wait(futures)
+            with profile_stage('write_space'):
+                for future in futures:
+                    for page_id, page_watchers in future.result():
+                        new_pages[page_id]["page_watchers"] = page_watchers
+                        checkpoint.save_page(space_key, page_id, new_pages[page_id])
+                pending_pages -= len(new_pages)
+                space_data["space_pages"] = [
+                    completed_pages.get(page['id']) or new_pages[page['id']] for page in pages
+                ]
+                checkpoint.mark_space_done(space_key, space_data)
+                writer.write(space_data)
+                if flat is not None:
+                    flat.write_space(space_key, space_data)
+            pool.print_progress(writer.count, len(spaces))
+
+        for space in spaces:
+            if checkpoint.is_space_done(space['key']):
+                pending.append((space['key'], checkpoint.load_space(space['key']), None, None, None, None))
+                continue
+
+            space_data = {
+                "space_name": space['name'],
+                "space_id": space['id'],
+                "space_type": space['type']
             }
 
-            page_watchers = get_page_watchers(page['id'])
-            page_data["page_watchers"] = page_watchers
-            space_pages.append(page_data)
+            space_data["space_watchers"] = space_watchers.pop(space['key'])
+
+            pages = list_space_pages(space['key'], checkpoint)
+            completed_pages = checkpoint.completed_pages(space['key'])
+            new_pages = {}
+            for page in pages:
+                if page['id'] not in completed_pages:
+                    new_pages[page['id']] = {
+                        "page_name": page['title'],
+                        "page_id": page['id']
+                    }
+
+            page_ids = list(new_pages)
+            futures = [
+                pool.submit(get_page_watchers_chunk, page_ids[start:start + MAX_BATCH_SIZE], host=host)
+                for start in range(0, len(page_ids), MAX_BATCH_SIZE)
+            ]
+            pending.append((space['key'], space_data, pages, completed_pages, new_pages, futures))
+            pending_pages += len(new_pages)
+
+            while pending_pages > max_pending_pages:
+                finish_space()
 
-        space_data["space_pages"] = space_pages
-        result.append(space_data)
+        while pending:
+            finish_space()
 
-    with open("File Examples/confluence_space_and_page_watchers_data.json", "w") as json_file:
-        json.dump(result, json_file, indent=4)
+    # The run finished, so there is nothing left to resume
+    os.remove(args.checkpoint)
+    print(f"Exported {writer.count} spaces to '{output_path(OUTPUT_FILE, args.output_format)}'")
+    pool.print_summary()
+    if principals is not None:
+        principals.print_summary(principals_path(OUTPUT_FILE))
+    if flat is not None:
+        flat.print_summary()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
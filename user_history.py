@@ -0,0 +1,370 @@
+"""
+This module provides the history of managed accounts recorded by confluence_user_usage.py.
+Every run of the usage report overwrites `confluence_managed_accounts.json`, so trends used to
+need old copies of the report. With `--history`, each run also appends a compact snapshot of all
+managed accounts to a SQLite file, and the queries below answer trend questions from that file
+without reading any export again.
+
+Per account, a snapshot keeps the account status, the `last_active` date as epoch days (days since
+1970-01-01), a bitmask of the products the account can access and its email domain. Statuses,
+products and domains are interned into small integer IDs; a history holds at most 63 distinct
+products, one bit each. Only accounts whose values changed since the previous run are stored: the
+`changes` table has one row per account and run in which something changed, clustered by account
+(WITHOUT ROWID), and the state of an account at any run is its last change up to that run. An
+account that is no longer listed gets a change with a NULL status. A run is only recorded once all
+accounts were read; a failed run leaves the history unchanged.
+
+Classes:
+- UserHistoryRecorder: Appends the accounts of one run to the history.
+- UserHistory: Queries the history.
+
+Functions:
+- default_history_path(): Returns the default history file.
+- epoch_day(last_active): Returns the epoch day of a last_active timestamp, or None.
+
+Usage:
+    python user_history.py runs
+    python user_history.py active-per-domain --runs 6 --days 30
+    python user_history.py went-inactive --days 90
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import time
+from datetime import date, datetime
+
+from activity_aggregator import window_cutoff_day
+
+HISTORY_FILE = "File Examples/confluence_user_history.sqlite"
+BATCH_SIZE = 5000
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+# Product N is bit N - 1 of a signed 64-bit SQLite INTEGER, so bit 63 (the sign bit) is never used
+MAX_PRODUCTS = 63
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS runs (id INTEGER PRIMARY KEY, taken_at TEXT, accounts INTEGER, changed INTEGER);
+    CREATE TABLE IF NOT EXISTS statuses (id INTEGER PRIMARY KEY, name TEXT UNIQUE);
+    CREATE TABLE IF NOT EXISTS products (id INTEGER PRIMARY KEY, name TEXT UNIQUE);
+    CREATE TABLE IF NOT EXISTS domains (id INTEGER PRIMARY KEY, name TEXT UNIQUE);
+    CREATE TABLE IF NOT EXISTS accounts (id INTEGER PRIMARY KEY, account_id TEXT UNIQUE, name TEXT, email TEXT);
+    CREATE TABLE IF NOT EXISTS changes (
+        account INTEGER, run INTEGER, status INTEGER, last_active INTEGER, products INTEGER, domain INTEGER,
+        PRIMARY KEY (account, run)
+    ) WITHOUT ROWID;
+    CREATE TABLE IF NOT EXISTS latest (
+        account INTEGER PRIMARY KEY, status INTEGER, last_active INTEGER, products INTEGER, domain INTEGER
+    );
+"""
+
+# State of every account at a run: its last change up to that run (SQLite takes the bare columns from the MAX(run) row)
+STATE_AT_RUN = """
+    SELECT account, MAX(run) AS run, status, last_active, products, domain
+    FROM changes WHERE run <= ? GROUP BY account
+"""
+
+
+# Function to get the default history file
+def default_history_path():
+    return HISTORY_FILE
+
+
+# Function to get the epoch day of a last_active timestamp, or None if the account was never active
+def epoch_day(last_active):
+    if not last_active:
+        return None
+    return datetime.strptime(last_active.split('T')[0], '%Y-%m-%d').toordinal() - EPOCH_ORDINAL
+
+
+# Function to get the first epoch day that counts as active within a window ending at a run, or None without a window
+def cutoff_epoch_day(taken_at, days):
+    if days is None:
+        return None
+    return window_cutoff_day(datetime.fromisoformat(taken_at), days) - EPOCH_ORDINAL
+
+
+# Appends the accounts of one run to the history
+class UserHistoryRecorder:
+    def __init__(self, path, taken_at=None, batch_size=BATCH_SIZE):
+        self.path = path
+        self.taken_at = (taken_at or datetime.now()).isoformat(timespec='seconds')
+        self.batch_size = batch_size
+        self._conn = sqlite3.connect(path)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.executescript(SCHEMA)
+        self._conn.execute('CREATE TEMP TABLE current (account INTEGER PRIMARY KEY, status INTEGER, '
+                           'last_active INTEGER, products INTEGER, domain INTEGER)')
+        # Interned values: name -> integer ID
+        self._interned = {
+            table: dict(self._conn.execute(f'SELECT name, id FROM {table}'))
+            for table in ('statuses', 'products', 'domains')
+        }
+        self._accounts = dict(self._conn.execute('SELECT account_id, id FROM accounts'))
+        self._account_rows = []
+        self._rows = []
+        self._parsed_days = {}
+        self.run_id = None
+        self.counts = {'accounts': 0, 'changed': 0}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+        return False
+
+    # Function to get the ID of an interned status, product or domain, adding it on first use
+    def _intern(self, table, name):
+        value_id = self._interned[table].get(name)
+        if value_id is None:
+            value_id = self._conn.execute(f'INSERT INTO {table} (name) VALUES (?)', (name,)).lastrowid
+            self._interned[table][name] = value_id
+        return value_id
+
+    # Function to convert a last_active timestamp to an epoch day, parsing each date once
+    def _day(self, last_active):
+        if not last_active:
+            return None
+        date_part = last_active.split('T')[0]
+        day = self._parsed_days.get(date_part)
+        if day is None:
+            day = self._parsed_days[date_part] = epoch_day(date_part)
+        return day
+
+    def add(self, account):
+        account_id = account.get('account_id')
+        if not account_id:
+            return
+        account_key = self._accounts.get(account_id)
+        if account_key is None:
+            account_key = self._accounts[account_id] = len(self._accounts) + 1
+        self._account_rows.append((account_key, account_id, account.get('name'), account.get('email')))
+
+        products = 0
+        for access in account.get('product_access') or []:
+            if access.get('name'):
+                # Product IDs start at 1, product N is bit N - 1
+                product_id = self._intern('products', access['name'])
+                if product_id > MAX_PRODUCTS:
+                    raise ValueError(f"User history '{self.path}' already has {MAX_PRODUCTS} products, "
+                                     f"cannot record product '{access['name']}'")
+                products |= 1 << (product_id - 1)
+        status = self._intern('statuses', account['account_status']) if account.get('account_status') else None
+        domain = self._intern('domains', (account.get('email') or '').split('@')[-1])
+        self._rows.append((account_key, status, self._day(account.get('last_active')), products, domain))
+        self.counts['accounts'] += 1
+        if len(self._rows) >= self.batch_size:
+            self._flush()
+
+    def _flush(self):
+        # Names and emails are only written for new accounts or when they changed
+        self._conn.executemany("""
+            INSERT INTO accounts (id, account_id, name, email) VALUES (?, ?, ?, ?)
+            ON CONFLICT (id) DO UPDATE SET name = excluded.name, email = excluded.email
+            WHERE name IS NOT excluded.name OR email IS NOT excluded.email
+        """, self._account_rows)
+        self._conn.executemany('INSERT OR REPLACE INTO current VALUES (?, ?, ?, ?, ?)', self._rows)
+        self._account_rows = []
+        self._rows = []
+
+    def print_summary(self):
+        print(f"User history: run {self.run_id}, {self.counts['changed']} of {self.counts['accounts']} accounts "
+              f"changed, written to '{self.path}'")
+
+    # Function to store the changes of the run against the latest state and make the run visible
+    def close(self):
+        if self._conn is None:
+            return
+        self._flush()
+        run = self._conn.execute('INSERT INTO runs (taken_at, accounts) VALUES (?, ?)',
+                                 (self.taken_at, self.counts['accounts'])).lastrowid
+        self._conn.execute("""
+            INSERT INTO changes (account, run, status, last_active, products, domain)
+            SELECT c.account, ?, c.status, c.last_active, c.products, c.domain
+            FROM current c LEFT JOIN latest l ON l.account = c.account
+            WHERE l.account IS NULL OR l.status IS NOT c.status OR l.last_active IS NOT c.last_active
+               OR l.products IS NOT c.products OR l.domain IS NOT c.domain
+        """, (run,))
+        # Accounts that are no longer listed keep their last values with a NULL status
+        self._conn.execute("""
+            INSERT INTO changes (account, run, status, last_active, products, domain)
+            SELECT l.account, ?, NULL, l.last_active, l.products, l.domain
+            FROM latest l
+            WHERE l.status IS NOT NULL AND NOT EXISTS (SELECT 1 FROM current c WHERE c.account = l.account)
+        """, (run,))
+        self._conn.execute("""
+            INSERT OR REPLACE INTO latest (account, status, last_active, products, domain)
+            SELECT account, status, last_active, products, domain FROM changes WHERE run = ?
+        """, (run,))
+        self.counts['changed'] = self._conn.execute('SELECT COUNT(*) FROM changes WHERE run = ?', (run,)).fetchone()[0]
+        self._conn.execute('UPDATE runs SET changed = ? WHERE id = ?', (self.counts['changed'], run))
+        self._conn.commit()
+        self._conn.close()
+        self._conn = None
+        self.run_id = run
+
+    # Function to abandon the run, keeping the history as it was
+    def discard(self):
+        if self._conn is None:
+            return
+        self._conn.rollback()
+        self._conn.close()
+        self._conn = None
+
+
+# Queries the user history
+class UserHistory:
+    def __init__(self, path):
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"User history '{path}' not found, run confluence_user_usage.py with --history first")
+        self.path = path
+        self._conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    # Function to get the runs as (run ID, time, accounts, changed accounts), the latest `limit` runs in run order
+    def runs(self, limit=None):
+        rows = self._conn.execute('SELECT id, taken_at, accounts, changed FROM runs ORDER BY id DESC LIMIT ?',
+                                  (-1 if limit is None else limit,)).fetchall()
+        return rows[::-1]
+
+    # Function to get the ID of a status, or 0 (no status) if it was never seen
+    def _status_id(self, name):
+        row = self._conn.execute('SELECT id FROM statuses WHERE name = ?', (name,)).fetchone()
+        return row[0] if row else 0
+
+    # Function to get the product bit of a product name, or None if it was never seen
+    def _product_bit(self, name):
+        row = self._conn.execute('SELECT id FROM products WHERE name = ? COLLATE NOCASE', (name,)).fetchone()
+        return 1 << (row[0] - 1) if row else None
+
+    # Function to count the active accounts per domain at each of the latest runs, optionally active within days and with a product
+    def active_per_domain(self, runs=5, days=None, product=None):
+        active = self._status_id('active')
+        bit = 0
+        if product is not None:
+            bit = self._product_bit(product)
+            if bit is None:
+                return [(run, taken_at, {}) for run, taken_at, _, _ in self.runs(runs)]
+        results = []
+        for run, taken_at, _, _ in self.runs(runs):
+            cutoff = cutoff_epoch_day(taken_at, days)
+            rows = self._conn.execute(f"""
+                SELECT d.name, COUNT(*) FROM ({STATE_AT_RUN}) s JOIN domains d ON d.id = s.domain
+                WHERE s.status = ? AND (? IS NULL OR s.last_active >= ?) AND (? = 0 OR s.products & ?)
+                GROUP BY s.domain ORDER BY d.name
+            """, (run, active, cutoff, cutoff, bit, bit)).fetchall()
+            results.append((run, taken_at, dict(rows)))
+        return results
+
+    # Function to list the accounts that were active at one run and no longer at a later one (default: the last two runs), or None without two runs
+    def went_inactive(self, from_run=None, to_run=None, days=None):
+        latest = [run for run, _, _, _ in self.runs(2)]
+        if len(latest) < 2 and (from_run is None or to_run is None):
+            return None
+        from_run = latest[0] if from_run is None else from_run
+        to_run = latest[-1] if to_run is None else to_run
+        taken = dict(self._conn.execute('SELECT id, taken_at FROM runs WHERE id IN (?, ?)', (from_run, to_run)))
+        if from_run not in taken or to_run not in taken:
+            raise ValueError(f"Unknown run: {from_run if from_run not in taken else to_run}")
+        active = self._status_id('active')
+        from_cutoff = cutoff_epoch_day(taken[from_run], days)
+        to_cutoff = cutoff_epoch_day(taken[to_run], days)
+        rows = self._conn.execute(f"""
+            SELECT a.account_id, a.name, a.email, d.name, t.last_active, st.name
+            FROM ({STATE_AT_RUN}) f
+            JOIN ({STATE_AT_RUN}) t ON t.account = f.account
+            JOIN accounts a ON a.id = f.account
+            LEFT JOIN domains d ON d.id = t.domain
+            LEFT JOIN statuses st ON st.id = t.status
+            WHERE f.status = ? AND (? IS NULL OR f.last_active >= ?)
+              AND NOT (t.status IS ? AND (? IS NULL OR t.last_active >= ?))
+            ORDER BY d.name, a.email
+        """, (from_run, to_run, active, from_cutoff, from_cutoff, active, to_cutoff, to_cutoff)).fetchall()
+        return {
+            "from_run": from_run,
+            "to_run": to_run,
+            "accounts": [
+                {"account_id": account_id, "name": name, "email": email, "domain": domain,
+                 "last_active": date.fromordinal(day + EPOCH_ORDINAL).isoformat() if day is not None else None,
+                 "status": status or "not listed"}
+                for account_id, name, email, domain, day, status in rows
+            ],
+        }
+
+    def close(self):
+        self._conn.close()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Query the history of managed accounts recorded by confluence_user_usage.py --history.")
+    parser.add_argument('--history', default=default_history_path(), help=f"User history file (default: {HISTORY_FILE})")
+    commands = parser.add_subparsers(dest='command', required=True)
+    runs = commands.add_parser('runs', help="List the recorded runs")
+    runs.add_argument('--json', action='store_true', help="Print the result as JSON")
+    per_domain = commands.add_parser('active-per-domain', help="Count active accounts per domain over the latest runs")
+    per_domain.add_argument('--runs', type=int, default=5, help="Number of latest runs (default: 5)")
+    per_domain.add_argument('--days', type=int, help="Only count accounts active within this many days before each run")
+    per_domain.add_argument('--product', help="Only count accounts with access to this product (e.g. Confluence)")
+    per_domain.add_argument('--json', action='store_true', help="Print the result as JSON")
+    inactive = commands.add_parser('went-inactive', help="List accounts that were active at one run and no longer at a later one")
+    inactive.add_argument('--from', dest='from_run', type=int, help="Earlier run ID (default: the second latest run)")
+    inactive.add_argument('--to', dest='to_run', type=int, help="Later run ID (default: the latest run)")
+    inactive.add_argument('--days', type=int, help="Also count accounts as inactive once their last activity is older than this many days")
+    inactive.add_argument('--json', action='store_true', help="Print the result as JSON")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if not os.path.exists(args.history):
+        print(f"Error: user history '{args.history}' not found, run confluence_user_usage.py with --history first")
+        return 1
+    start = time.perf_counter()
+    with UserHistory(args.history) as history:
+        if args.command == 'runs':
+            result = [{"run": run, "taken_at": taken_at, "accounts": accounts, "changed": changed}
+                      for run, taken_at, accounts, changed in history.runs()]
+        elif args.command == 'active-per-domain':
+            result = [{"run": run, "taken_at": taken_at, "domain_counts": counts}
+                      for run, taken_at, counts in history.active_per_domain(args.runs, args.days, args.product)]
+        else:
+            try:
+                result = history.went_inactive(args.from_run, args.to_run, args.days)
+            except ValueError as e:
+                print(f"Error: {e}")
+                return 1
+    elapsed = time.perf_counter() - start
+
+    if args.json:
+        print(json.dumps(result, indent=4))
+    elif args.command == 'runs':
+        for run in result:
+            print(f"{run['run']:>5}  {run['taken_at']}  {run['accounts']} accounts, {run['changed']} changed")
+    elif args.command == 'active-per-domain':
+        domains = sorted({domain for run in result for domain in run['domain_counts']})
+        print(f"{'domain':<30}" + ''.join(f"{'run ' + str(run['run']):>10}" for run in result))
+        for domain in domains:
+            print(f"{domain:<30}" + ''.join(f"{run['domain_counts'].get(domain, 0):>10}" for run in result))
+    elif not result:
+        print("The history needs at least two runs")
+    else:
+        print(f"{len(result['accounts'])} accounts went inactive between run {result['from_run']} and run {result['to_run']}")
+        for account in result['accounts']:
+            print(f"    {account['email'] or account['account_id']}  {account['status']}  last active {account['last_active'] or 'never'}")
+    print(f"({elapsed * 1000:.1f} ms)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())